@@ -1,31 +1,43 @@
+import cPickle as pickle
 import h5py
 import numpy as np
-import operator
 import os
 import re
 from decorator import decorator
 from glob import glob
-from os.path import join
+from numpy.lib.format import open_memmap
+from os.path import exists, join
 from random import shuffle
-from scipy.ndimage.interpolation import zoom
 
 from . import disk
+from .transformations.resize import resize_arrays
 
 
 pil_mode_by_array_dtype = {
     np.dtype('uint8'): None,
     np.dtype('uint16'): 'I;16',
 }
+ARRAY_CHUNK_SIZE = 1000
+BATCH_FORMATS = 'npy', 'pickle'
+EXAMPLES_FORMAT = 'examples'
+EXAMPLES_NAME = 'examples'
 
 
 class BatchGroup(object):
 
-    def __init__(self, h5_name, h5_folders, batch_size, array_shape=None):
+    def __init__(
+            self, h5_name, h5_folders, batch_size, array_shape=None,
+            preserve_order=False, array_filter=None):
+        self.h5_name = h5_name
+        self.h5_folders = h5_folders
         self.h5s = [
-            h5py.File(os.path.join(x, h5_name)) for x in h5_folders]
+            h5py.File(os.path.join(x, h5_name), 'r') for x in h5_folders]
         self.batch_size = batch_size
+        self.preserve_order = preserve_order
+        self.array_filter = array_filter
+        self.pruned_keys = []
         if array_shape is not None:
-            self._array_shape = tuple(array_shape)
+            self._array_shape = tuple(int(x) for x in array_shape)
 
     @property
     def keys(self):
@@ -36,11 +48,24 @@ class BatchGroup(object):
         keys = []
         for h5_index, h5 in enumerate(self.h5s):
             arrays = h5['arrays']
-            for array_index in xrange(len(arrays)):
+            for start_index in xrange(0, len(arrays), ARRAY_CHUNK_SIZE):
+                chunk = arrays[start_index:start_index + ARRAY_CHUNK_SIZE]
                 # Skip empty arrays
-                if arrays[array_index].max() == 0:
-                    continue
-                keys.append((h5_index, array_index))
+                array_indices = np.flatnonzero(
+                    chunk.reshape(len(chunk), -1).max(axis=1))
+                if self.array_filter and len(array_indices):
+                    # Skip arrays that the prefilter rejects
+                    is_selected = self.array_filter(
+                        self.resize_arrays(chunk[array_indices]))
+                    self.pruned_keys.extend(
+                        (h5_index, start_index + x)
+                        for x in array_indices[~is_selected])
+                    array_indices = array_indices[is_selected]
+                keys.extend((h5_index, start_index + x) for x in array_indices)
+        if self.preserve_order:
+            # Keep raster order and let the last batch be short
+            self._keys = keys
+            return self._keys
         # Use existing keys as filler to make the last batch whole
         while True:
             extra_size = len(keys) % self.batch_size
@@ -52,12 +77,7 @@ class BatchGroup(object):
         return self._keys
 
     def get_labels(self, keys):
-        labels = []
-        for h5_index, array_index in keys:
-            h5 = self.h5s[h5_index]
-            label = h5['labels'][array_index]
-            labels.append(label)
-        return labels
+        return self.get_values('labels', keys)
 
     @property
     def array_shape(self):
@@ -79,6 +99,10 @@ class BatchGroup(object):
             selected_height, selected_width, selected_band_count)
         return self._array_shape
 
+    @property
+    def array_dtype(self):
+        return np.result_type(*[x['arrays'].dtype for x in self.h5s])
+
     @property
     def array_count(self):
         try:
@@ -90,46 +114,140 @@ class BatchGroup(object):
 
     @property
     def array_mean(self):
+        if not self.array_sum_count:
+            return np.zeros(self.array_shape)
+        return self.array_sum / float(self.array_sum_count)
+
+    @property
+    def array_sum(self):
         try:
-            return self._array_mean
+            return self._array_sum
         except AttributeError:
             pass
-        if not self.array_count:
-            return np.zeros(self.array_shape)
-        array_sum = 0
+        # Add each kept array once, leaving out filler and pruned arrays
+        keys = np.array(sorted(set(self.keys)), dtype=np.int64).reshape(-1, 2)
+        array_sum = np.zeros(self.array_shape)
         for h5_index, h5 in enumerate(self.h5s):
             arrays = h5['arrays']
-            array_sum += reduce(operator.add, (
-                self.resize_array(x) for x in arrays))
-        self._array_mean = array_sum / float(self.array_count)
-        return self._array_mean
+            array_indices = keys[keys[:, 0] == h5_index, 1]
+            for start_index in xrange(0, len(arrays), ARRAY_CHUNK_SIZE):
+                chunk_indices = array_indices[
+                    (start_index <= array_indices) &
+                    (array_indices < start_index + ARRAY_CHUNK_SIZE)
+                ] - start_index
+                if not len(chunk_indices):
+                    continue
+                array_sum += self.resize_arrays(arrays[
+                    start_index:start_index + ARRAY_CHUNK_SIZE][
+                    chunk_indices]).sum(axis=0)
+        self._array_sum = array_sum
+        self._array_sum_count = len(keys)
+        return self._array_sum
+
+    @property
+    def array_sum_count(self):
+        'Count the arrays in array_sum'
+        try:
+            return self._array_sum_count
+        except AttributeError:
+            pass
+        self.array_sum
+        return self._array_sum_count
 
     def get_pixel_centers(self, keys):
-        pixel_centers = []
-        for h5_index, array_index in keys:
-            h5 = self.h5s[h5_index]
-            pixel_center = h5['pixel_centers'][array_index]
-            pixel_centers.append(pixel_center)
-        return pixel_centers
+        return self.get_values('pixel_centers', keys)
+
+    def get_batch_sources(self, keys):
+        'List the folders that contributed to each batch of keys'
+        batch_sources = []
+        for start_index in xrange(0, len(keys), self.batch_size):
+            h5_indices = sorted(set(
+                x[0] for x in keys[start_index:start_index + self.batch_size]))
+            batch_sources.append([self.h5_folders[x] for x in h5_indices])
+        return batch_sources
+
+    def get_packs(self, keys):
+        packs = self.get_pixel_centers(keys).astype(np.int64)
+        pack_columns = ['pixel_center_x', 'pixel_center_y']
+        if all('tile_indices' in x for x in self.h5s):
+            tile_indices = self.get_values('tile_indices', keys)
+            packs = np.column_stack([packs, tile_indices])
+            pack_columns.append('tile_index')
+        return packs, pack_columns
 
     def get_data(self, keys):
-        vectors = []
-        for h5_index, array_index in keys:
-            h5 = self.h5s[h5_index]
-            array = h5['arrays'][array_index]
-            vectors.append(get_vector_from_array(self.resize_array(array)))
-        return np.array(vectors).T
+        return get_vectors_from_arrays(self.get_arrays(keys)).T
+
+    def get_arrays(self, keys):
+        return self.get_values(
+            'arrays', keys, self.array_shape, self.resize_arrays)
+
+    def get_values(self, name, keys, value_shape=None, transform=None):
+        if value_shape is None:
+            value_shape = self.h5s[0][name].shape[1:]
+        value_dtype = np.result_type(*[x[name].dtype for x in self.h5s])
+        keys = np.array(keys, dtype=int).reshape(-1, 2)
+        values = np.empty(
+            (len(keys),) + tuple(value_shape), dtype=value_dtype)
+        for h5_index, h5 in enumerate(self.h5s):
+            key_indices = np.flatnonzero(keys[:, 0] == h5_index)
+            if not len(key_indices):
+                continue
+            # Read each row once and in increasing order, as h5py requires
+            array_indices, inverse_indices = np.unique(
+                keys[key_indices, 1], return_inverse=True)
+            h5_values = h5[name][list(array_indices)]
+            if transform:
+                h5_values = transform(h5_values)
+            values[key_indices] = h5_values[inverse_indices]
+        return values
 
     def resize_array(self, array):
-        pixel_height, pixel_width, band_count = self.array_shape
-        assert band_count <= array.shape[2]
-        array = array[:, :, :band_count]
-        if tuple(array.shape) == tuple(self.array_shape):
-            return array
-        return zoom(array, (
-            pixel_height / float(array.shape[0]),
-            pixel_width / float(array.shape[1]),
-            1))
+        return self.resize_arrays(array[np.newaxis])[0]
+
+    def resize_arrays(self, arrays):
+        return resize_arrays(arrays, self.array_shape)
+
+
+class BatchWriter(object):
+
+    def __init__(self, target_folder, batch_size, array_shape, batch_format):
+        self.target_folder = target_folder
+        self.batch_size = batch_size
+        self.array_shape = tuple(int(x) for x in array_shape)
+        self.batch_format = batch_format
+        self.batch_count = 0
+        self.array_count = 0
+        self.array_sum = np.zeros(self.array_shape)
+        self.packs = []
+        self._arrays, self._labels = [], []
+
+    def add(self, array, label, pack):
+        self._arrays.append(array)
+        self._labels.append(label)
+        self.packs.append(pack)
+        if len(self._arrays) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._arrays:
+            return
+        arrays = resize_arrays(np.array(self._arrays), self.array_shape)
+        start_index = self.array_count
+        self.array_count += len(arrays)
+        self.array_sum += arrays.sum(axis=0)
+        save_batch(
+            join(self.target_folder, 'data_batch_%d' % self.batch_count),
+            get_vectors_from_arrays(arrays).T, self._labels,
+            xrange(start_index, self.array_count), self.batch_format)
+        self.batch_count += 1
+        self._arrays, self._labels = [], []
+
+    @property
+    def array_mean(self):
+        if not self.array_count:
+            return np.zeros(self.array_shape)
+        return self.array_sum / float(self.array_count)
 
 
 @decorator
@@ -158,7 +276,102 @@ def get_vectors_from_arrays(arrays):
     return arrays.swapaxes(1, 3).swapaxes(2, 3).reshape((arrays.shape[0], -1))
 
 
+def load_batch_meta(batch_folder):
+    return pickle.load(open(join(batch_folder, 'batches.meta'), 'rb'))
+
+
+def save_batch_meta(
+        target_folder, array_mean, packs, pack_columns, batch_format,
+        batch_size=None, **kw):
+    vector_mean = get_vector_from_array(array_mean)
+    vector_size = vector_mean.size
+    pickle.dump(dict(kw, **{
+        'batch_size': batch_size,
+        'data_mean': vector_mean.reshape(vector_size, 1).astype(np.single),
+        'label_names': ['', 'building'],
+        'num_vis': vector_size,
+        'packs': packs,
+        'pack_columns': pack_columns,
+        'array_shape': array_mean.shape,
+        'batch_format': batch_format,
+    }), open(join(target_folder, 'batches.meta'), 'wb'), protocol=-1)
+
+
+def save_batch(batch_path, data, labels, ids, batch_format):
+    if batch_format == 'pickle':
+        pickle.dump({
+            'ids': list(ids),
+            'data': data.astype(np.single),
+            'labels': [1 if x else 0 for x in labels],
+        }, open(batch_path, 'wb'), protocol=-1)
+        return
+    # Store uint8 pixels, labels and ids as arrays that we can memory map
+    np.save(open(batch_path, 'wb'), np.ascontiguousarray(data))
+    np.save(open(batch_path + '.labels', 'wb'), np.array(
+        labels, dtype='uint8'))
+    np.save(open(batch_path + '.ids', 'wb'), np.array(
+        list(ids), dtype=np.int64))
+
+
+def load_batch(batch_path, batch_format):
+    if batch_format == 'pickle':
+        return pickle.load(open(batch_path, 'rb'))
+    return {
+        'data': np.load(batch_path, mmap_mode='r'),
+        'labels': np.load(batch_path + '.labels', mmap_mode='r'),
+        'ids': np.load(batch_path + '.ids', mmap_mode='r'),
+    }
+
+
+def prepare_examples(target_folder, example_count, vector_size, dtype):
+    'Allocate an example store that workers can fill in parallel'
+    examples_path = join(target_folder, EXAMPLES_NAME)
+    open_memmap(examples_path, 'w+', dtype, (example_count, vector_size))
+    open_memmap(examples_path + '.labels', 'w+', np.uint8, (example_count,))
+
+
+def extend_examples(target_folder, extra_count):
+    'Make room for more rows in the example store, keeping existing rows'
+    examples_path = join(target_folder, EXAMPLES_NAME)
+    for path in examples_path, examples_path + '.labels':
+        values = np.load(path, mmap_mode='r')
+        extended_values = open_memmap(
+            path + '.tmp', 'w+', values.dtype,
+            (len(values) + extra_count,) + values.shape[1:])
+        for start_index in xrange(0, len(values), ARRAY_CHUNK_SIZE):
+            stop_index = min(start_index + ARRAY_CHUNK_SIZE, len(values))
+            extended_values[start_index:stop_index] = values[
+                start_index:stop_index]
+        extended_values.flush()
+        del values, extended_values
+        os.rename(path + '.tmp', path)
+
+
+def save_examples(target_folder, start_index, data, labels):
+    'Write (VECTOR_SIZE, N) data into rows of the example store'
+    examples, example_labels = load_examples(target_folder, 'r+')
+    stop_index = start_index + len(labels)
+    examples[start_index:stop_index] = data.T
+    example_labels[start_index:stop_index] = labels
+    examples.flush()
+    example_labels.flush()
+
+
+def load_examples(target_folder, mmap_mode='r'):
+    examples_path = join(target_folder, EXAMPLES_NAME)
+    return (
+        np.load(examples_path, mmap_mode=mmap_mode),
+        np.load(examples_path + '.labels', mmap_mode=mmap_mode))
+
+
 def get_batch_range(batch_folder):
+    if exists(join(batch_folder, 'batches.meta')):
+        batch_meta = load_batch_meta(batch_folder)
+        if batch_meta.get('batch_format') == EXAMPLES_FORMAT:
+            # Count virtual batches because there are no batch files
+            batch_size = batch_meta['batch_size']
+            example_count = len(batch_meta['packs'])
+            return 0, (example_count - 1) // batch_size
     min_index = 1
     max_index = 0
     pattern_number = re.compile(r'data_batch_(\d+)')
@@ -0,0 +1,110 @@
+'Score estimated locations against actual locations at many radii at once'
+import numpy as np
+from collections import OrderedDict
+
+from .spatial_index import SpatialIndex, get_query_indices
+
+
+def evaluate_locations(
+        actual_xys, estimated_xys, radii, match_one_to_one=False):
+    'Get counts, precision and recall for each radius from one set of queries'
+    actual_xys = np.reshape(actual_xys, (-1, 2)).astype(np.float64)
+    estimated_xys = np.reshape(estimated_xys, (-1, 2)).astype(np.float64)
+    radii = np.atleast_1d(radii).astype(np.float64)
+    actual_count, estimated_count = len(actual_xys), len(estimated_xys)
+    # Count neighbors strictly within radius like query_radius
+    true_positive_counts = count_below(get_nearest_distances(
+        estimated_xys, actual_xys), radii)
+    false_negative_counts = actual_count - count_below(get_nearest_distances(
+        actual_xys, estimated_xys), radii)
+    if match_one_to_one:
+        matched_counts = count_below(get_matched_distances(
+            actual_xys, estimated_xys, radii.max()), radii)
+    rows = []
+    for radius_index, radius in enumerate(radii):
+        rows.append(get_evaluation(
+            radius, actual_count, estimated_count,
+            true_positive_counts[radius_index],
+            false_negative_counts[radius_index],
+            matched_counts[radius_index] if match_one_to_one else None))
+    return rows
+
+
+def sum_evaluations(row_groups):
+    'Pool counts over groups of rows that share radii and recompute ratios'
+    rows = []
+    for radius_rows in zip(*row_groups):
+        matched_counts = [x.get('matched_count') for x in radius_rows]
+        rows.append(get_evaluation(
+            radius_rows[0]['radius'],
+            sum(x['actual_count'] for x in radius_rows),
+            sum(x['estimated_count'] for x in radius_rows),
+            sum(x['true_positive_count'] for x in radius_rows),
+            sum(x['false_negative_count'] for x in radius_rows),
+            None if None in matched_counts else sum(matched_counts)))
+    return rows
+
+
+def get_evaluation(
+        radius, actual_count, estimated_count, true_positive_count,
+        false_negative_count, matched_count=None):
+    true_positive_count = int(true_positive_count)
+    # Without actual points every estimate is a false positive, and without
+    # estimates every actual point is a false negative; evaluate_counts
+    # used to report zero for both
+    row = OrderedDict([
+        ('radius', radius),
+        ('actual_count', actual_count),
+        ('estimated_count', estimated_count),
+        ('true_positive_count', true_positive_count),
+        ('false_positive_count', estimated_count - true_positive_count),
+        ('false_negative_count', int(false_negative_count)),
+        ('precision', divide(true_positive_count, estimated_count)),
+        ('recall', divide(true_positive_count, actual_count)),
+    ])
+    if matched_count is not None:
+        matched_count = int(matched_count)
+        row['matched_count'] = matched_count
+        row['matched_precision'] = divide(matched_count, estimated_count)
+        row['matched_recall'] = divide(matched_count, actual_count)
+    return row
+
+
+def get_nearest_distances(source_xys, target_xys):
+    'Get the distance from each source point to its nearest target point'
+    if not len(source_xys) or not len(target_xys):
+        return np.repeat(np.inf, len(source_xys))
+    return SpatialIndex(target_xys).query_nearest(source_xys)[2]
+
+
+def get_matched_distances(actual_xys, estimated_xys, maximum_radius):
+    'Pair points greedily by distance, each point at most once'
+    if not len(actual_xys) or not len(estimated_xys):
+        return np.zeros(0)
+    offsets, estimated_indices, distances = SpatialIndex(
+        estimated_xys).query_radius(actual_xys, maximum_radius)
+    actual_indices = get_query_indices(offsets)
+    # Greedy matching over pairs below a radius keeps the same pairs
+    # as greedy matching over every pair, so one pass covers all radii
+    order = np.lexsort((estimated_indices, actual_indices, distances))
+    is_actual_free = np.ones(len(actual_xys), dtype=bool)
+    is_estimated_free = np.ones(len(estimated_xys), dtype=bool)
+    matched_distances = []
+    for actual_index, estimated_index, distance in zip(
+            actual_indices[order].tolist(), estimated_indices[order].tolist(),
+            distances[order].tolist()):
+        if is_actual_free[actual_index] and is_estimated_free[
+                estimated_index]:
+            is_actual_free[actual_index] = False
+            is_estimated_free[estimated_index] = False
+            matched_distances.append(distance)
+    return np.array(matched_distances)
+
+
+def count_below(values, limits):
+    'Count values that are strictly less than each limit'
+    return np.searchsorted(np.sort(values), limits, side='left')
+
+
+def divide(numerator, denominator):
+    return numerator / float(denominator) if denominator else np.inf
@@ -1,15 +1,17 @@
 import numpy as np
-from pykdtree import kdtree
 
+from .spatial_index import SpatialIndex, get_query_indices
 
-class KDTree(object):
 
-    def __init__(self, points):
-        points = np.array(points)
-        self.point_count = len(points)
-        self.kdtree = kdtree.KDTree(points)
+class KDTree(SpatialIndex):
 
     def query(self, x, maximum_count=None, maximum_distance=None):
+        if not maximum_count and maximum_distance:
+            # Find neighbors within radius without sorting every point
+            offsets, indices, distances = self.query_radius(
+                x, maximum_distance)
+            order = np.lexsort((distances, get_query_indices(offsets)))
+            return distances[order], indices[order]
         x = np.array(x)
         if x.ndim == 1:
             x = np.array([x])
@@ -1,11 +1,18 @@
 import numpy as np
 import os
 import sys
+import time
 from os.path import join
+from Queue import Queue
+from threading import Lock, Thread
 
 from invisibleroads_macros.calculator import get_percent_change
+from numpy.lib.stride_tricks import as_strided
 
+from ..dataset import EXAMPLES_FORMAT, load_batch, load_examples
 
+
+PREFETCH_BATCH_COUNT = 2
 CCN_FOLDER = os.getenv('CUDA_CONVNET', join(
     os.getenv('VIRTUAL_ENV'), 'opt/cuda-convnet'))
 sys.path.append(CCN_FOLDER)
@@ -21,6 +28,26 @@ class ConvNet(convnet.ConvNet):
 
     patience_epoch_count = 10
 
+    def __init__(self, op, load_dic, dp_params=None):
+        dp_params = dict(dp_params or {})
+        dp_params['prefetch_batch_count'] = op.get_value(
+            'prefetch_batch_count')
+        convnet.ConvNet.__init__(self, op, load_dic, dp_params)
+
+    def start_batch(self, batch_data, train=True):
+        convnet.ConvNet.start_batch(self, batch_data, train)
+        self.started_batch = batch_data, train
+
+    def finish_batch(self):
+        batch_output = convnet.ConvNet.finish_batch(self)
+        # The model is done with the arrays, so let the provider reuse them
+        batch_data, train = self.started_batch
+        data_provider = (
+            self.train_data_provider if train else self.test_data_provider)
+        if hasattr(data_provider, 'release_batch'):
+            data_provider.release_batch(batch_data[2])
+        return batch_output
+
     def conditional_save(self):
         'Save checkpoint only if test error decreased'
         last_layer = self.layers[-1]['name']
@@ -74,25 +101,108 @@ class ConvNet(convnet.ConvNet):
         options_parser.add_option(
             'patience-epoch-count', 'patience_epoch_count',
             IntegerOptionParser, 'Patience epoch count', default=10)
+        options_parser.add_option(
+            'prefetch-batch-count', 'prefetch_batch_count',
+            IntegerOptionParser, 'Number of batches to prepare in advance',
+            default=PREFETCH_BATCH_COUNT)
         Class._options_parser = options_parser
         return options_parser
 
 
+class BufferPool(object):
+    'Lend arrays by shape and dtype and reuse only those that come back'
+
+    def __init__(self):
+        self.free_buffers_by_key = {}
+        # The prefetch thread borrows while the trainer returns
+        self.lock = Lock()
+
+    def get(self, shape, dtype=np.single):
+        key = tuple(shape), np.dtype(dtype)
+        with self.lock:
+            free_buffers = self.free_buffers_by_key.get(key)
+            if free_buffers:
+                return free_buffers.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, *arrays):
+        with self.lock:
+            for array in arrays:
+                self.free_buffers_by_key.setdefault(
+                    (array.shape, array.dtype), []).append(array)
+
+
 class GenericDataProvider(LabeledDataProvider):
 
+    def __init__(
+            self, data_dir, batch_range, init_epoch=1, init_batchnum=None,
+            dp_params=None, test=False):
+        dp_params = dp_params or {}
+        LabeledDataProvider.__init__(
+            self, data_dir, batch_range, init_epoch, init_batchnum,
+            dp_params, test)
+        self.buffer_pool = BufferPool()
+        if self.batch_meta.get('batch_format') == EXAMPLES_FORMAT:
+            self.examples, self.example_labels = load_examples(data_dir)
+            self.example_batch_size = self.batch_meta['batch_size']
+            self.example_indices_by_epoch = {}
+
     def get_data_dims(self, idx=0):
         return self.batch_meta['num_vis'] if idx == 0 else 1
 
+    def release_batch(self, batch_data):
+        'Let us reuse the arrays of a batch that the caller is done with'
+        self.buffer_pool.release(*batch_data)
+
+    def get_batch(self, batch_num):
+        batch_format = self.batch_meta.get('batch_format', 'pickle')
+        if batch_format == 'pickle':
+            return LabeledDataProvider.get_batch(self, batch_num)
+        if batch_format == EXAMPLES_FORMAT:
+            # Read rows in increasing order; order within a batch is moot
+            example_indices = np.sort(self.get_example_indices(batch_num))
+            return {
+                'data': self.examples[example_indices].T,
+                'labels': self.example_labels[example_indices],
+            }
+        return load_batch(self.get_data_file_name(batch_num), batch_format)
+
+    def get_example_indices(self, batch_num):
+        'Deal examples from our batches into new batches every epoch'
+        example_slices = [self.get_example_slice(x) for x in self.batch_range]
+        example_slice = self.get_example_slice(batch_num)
+        if self.test:
+            return np.arange(example_slice.start, example_slice.stop)
+        epoch = self.curr_epoch
+        try:
+            example_indices = self.example_indices_by_epoch[epoch]
+        except KeyError:
+            # Seed by epoch so that a resumed run sees the same batches
+            example_indices = np.random.RandomState(epoch).permutation(
+                np.concatenate([np.arange(
+                    x.start, x.stop) for x in example_slices]))
+            self.example_indices_by_epoch = {epoch: example_indices}
+        start_index = sum(x.stop - x.start for x in example_slices[
+            :self.batch_range.index(batch_num)])
+        return example_indices[start_index:start_index + (
+            example_slice.stop - example_slice.start)]
+
+    def get_example_slice(self, batch_num):
+        batch_size = self.example_batch_size
+        return slice(
+            batch_num * batch_size,
+            min((batch_num + 1) * batch_size, len(self.example_labels)))
+
     def get_next_batch(self):
         epoch_index, batch_index, d = LabeledDataProvider.get_next_batch(self)
         data, labels, count = d['data'], d['labels'], len(d['labels'])
-        data = np.require(
-            data,
-            dtype=np.single, requirements='C')
-        labels = np.require(
-            np.array(labels).reshape((1, count)),
-            dtype=np.single, requirements='C')
-        return epoch_index, batch_index, [data, labels]
+        # Cast into buffers that later providers can modify in place
+        # and that belong to the caller until it calls release_batch
+        data_buffer = self.buffer_pool.get(data.shape)
+        data_buffer[:] = data
+        labels_buffer = self.buffer_pool.get((1, count))
+        labels_buffer[0] = labels
+        return epoch_index, batch_index, [data_buffer, labels_buffer]
 
     def get_plottable_data(self, data):
         pixel_height, pixel_width, band_count = self.batch_meta['array_shape']
@@ -119,9 +229,7 @@ class ZeroMeanDataProvider(GenericDataProvider):
         epoch_index, batch_index, [
             data, labels,
         ] = GenericDataProvider.get_next_batch(self)
-        data = np.require(
-            data - self.data_mean,
-            dtype=np.single, requirements='C')
+        data -= self.data_mean
         return epoch_index, batch_index, [data, labels]
 
     def restore_data(self, data):
@@ -159,14 +267,17 @@ class CroppedZeroMeanDataProvider(ZeroMeanDataProvider):
         epoch_index, batch_index, [
             data, labels,
         ] = ZeroMeanDataProvider.get_next_batch(self)
-        cropped_data = np.require(
-            np.zeros((self.get_data_dims(), data.shape[1] * self.data_mult)),
-            dtype=np.single, requirements='C')
+        count = data.shape[1]
+        cropped_data = self.buffer_pool.get((
+            self.get_data_dims(), count * self.data_mult))
         self.__trim_borders(data, cropped_data)
-        labels = np.require(
-            np.tile(labels, (1, self.data_mult)),
-            dtype=np.single, requirements='C')
-        return epoch_index, batch_index, [cropped_data, labels]
+        self.buffer_pool.release(data)
+        if self.data_mult == 1:
+            return epoch_index, batch_index, [cropped_data, labels]
+        tiled_labels = self.buffer_pool.get((1, count * self.data_mult))
+        tiled_labels.reshape((self.data_mult, count))[:] = labels
+        self.buffer_pool.release(labels)
+        return epoch_index, batch_index, [cropped_data, tiled_labels]
 
     def get_data_dims(self, idx=0):
         inner_area = self.inner_height * self.inner_width
@@ -221,20 +332,94 @@ class CroppedZeroMeanDataProvider(ZeroMeanDataProvider):
                     :]  # just take the center for now
                 target[:, :] = pic.reshape((self.get_data_dims(), x.shape[1]))
         else:
-            for c in xrange(x.shape[1]):  # loop over cases
-                startY = np.random.randint(0, self.border_size * 2 + 1)
-                startX = np.random.randint(0, self.border_size * 2 + 1)
-                endY = startY + self.inner_height
-                endX = startX + self.inner_width
-                pic = y[:, startY:endY, startX:endX, c]
-                if np.random.randint(2) == 0:  # flip with 50% probability
-                    pic = pic[:, :, ::-1]
-                target[:, c] = pic.reshape((self.get_data_dims(),))
+            target[:, :] = crop_randomly(
+                y, self.border_size, self.inner_height, self.inner_width,
+            ).reshape((x.shape[1], self.get_data_dims())).T
 
     def restore_data(self, cropped_data):
         return cropped_data + self.cropped_data_mean
 
 
+def crop_randomly(arrays, border_size, inner_height, inner_width):
+    'Crop and flip each of (BAND_COUNT, HEIGHT, WIDTH, N) arrays at random'
+    band_count, pixel_height, pixel_width, case_count = arrays.shape
+    start_ys = np.random.randint(0, border_size * 2 + 1, case_count)
+    start_xs = np.random.randint(0, border_size * 2 + 1, case_count)
+    flips = np.random.randint(0, 2, case_count) == 0  # 50% probability
+    # View every possible crop of every case without copying
+    band_stride, y_stride, x_stride, case_stride = arrays.strides
+    windows = as_strided(arrays, (
+        border_size * 2 + 1, border_size * 2 + 1, case_count,
+        band_count, inner_height, inner_width,
+    ), (
+        y_stride, x_stride, case_stride,
+        band_stride, y_stride, x_stride))
+    crops = windows[start_ys, start_xs, np.arange(case_count)]
+    crops[flips] = crops[flips][:, :, :, ::-1]
+    return crops
+
+
+def prefetch(DataProviderClass):
+    'Prepare the next batches of DataProviderClass in a background thread'
+
+    class PrefetchingDataProvider(DataProviderClass):
+
+        def __init__(
+                self, data_dir, batch_range, init_epoch=1, init_batchnum=None,
+                dp_params=None, test=False):
+            dp_params = dp_params or {}
+            DataProviderClass.__init__(
+                self, data_dir, batch_range, init_epoch, init_batchnum,
+                dp_params, test)
+            self.prefetch_batch_count = dp_params.get(
+                'prefetch_batch_count') or PREFETCH_BATCH_COUNT
+            self.stall_seconds = 0
+            self.batch_queue = Queue(self.prefetch_batch_count)
+            # Load batches with a separate instance in the same order as
+            # the synchronous path, so that random crops draw identically
+            self.loader = DataProviderClass(
+                data_dir, batch_range, init_epoch, init_batchnum,
+                dp_params, test)
+            thread = Thread(target=self._prefetch, args=(self.loader,))
+            thread.daemon = True
+            thread.start()
+
+        def get_next_batch(self):
+            start_time = time.time()
+            batch, error = self.batch_queue.get()
+            self.stall_seconds += time.time() - start_time
+            if error:
+                raise error[0], error[1], error[2]
+            # Keep our epoch and batch numbers in step with what we return
+            self.advance_batch()
+            return batch
+
+        def release_batch(self, batch_data):
+            self.loader.release_batch(batch_data)
+
+        @property
+        def queued_batch_count(self):
+            return self.batch_queue.qsize()
+
+        def _prefetch(self, provider):
+            while True:
+                try:
+                    batch = provider.get_next_batch()
+                except Exception:
+                    self.batch_queue.put((None, sys.exc_info()))
+                    break
+                self.batch_queue.put((batch, None))
+
+    PrefetchingDataProvider.__name__ = (
+        'Prefetching' + DataProviderClass.__name__)
+    return PrefetchingDataProvider
+
+
+PrefetchingGenericDataProvider = prefetch(GenericDataProvider)
+PrefetchingZeroMeanDataProvider = prefetch(ZeroMeanDataProvider)
+PrefetchingCroppedZeroMeanDataProvider = prefetch(CroppedZeroMeanDataProvider)
+
+
 def get_model_arguments(
         target_folder, batch_folder,
         training_batch_range, testing_batch_range,
@@ -267,3 +452,12 @@ DataProvider.register_data_provider(
     'zero-mean', 'zero-mean', ZeroMeanDataProvider)
 DataProvider.register_data_provider(
     'cropped-zero-mean', 'cropped-zero-mean', CroppedZeroMeanDataProvider)
+DataProvider.register_data_provider(
+    'prefetching-generic', 'prefetching-generic',
+    PrefetchingGenericDataProvider)
+DataProvider.register_data_provider(
+    'prefetching-zero-mean', 'prefetching-zero-mean',
+    PrefetchingZeroMeanDataProvider)
+DataProvider.register_data_provider(
+    'prefetching-cropped-zero-mean', 'prefetching-cropped-zero-mean',
+    PrefetchingCroppedZeroMeanDataProvider)
@@ -0,0 +1,555 @@
+'Run saved cuda-convnet markers on the CPU with NumPy'
+import cPickle as pickle
+import numpy as np
+import os
+import re
+from math import ceil
+from numpy.lib.stride_tricks import as_strided
+
+
+CASE_CHUNK_SIZE = 128
+PATTERN_NEURON = re.compile(r'(\w+)(?:\[(.*)\])?')
+
+
+class CPUConvNet(object):
+
+    def __init__(self, layers):
+        self.layers = layers
+        self.layer_index_by_name = dict(
+            (x['name'], index) for index, x in enumerate(layers))
+
+    @classmethod
+    def load(Class, marker_path):
+        checkpoint = load_checkpoint(marker_path)
+        return Class(checkpoint['model_state']['layers'])
+
+    @property
+    def data_shape(self):
+        'Get (HEIGHT, WIDTH, BAND_COUNT) of the arrays the model expects'
+        for layer in self.layers:
+            for input_offset, input_index in enumerate(
+                    layer.get('inputs', [])):
+                input_layer = self.layers[input_index]
+                if input_layer['type'] != 'data':
+                    continue
+                if input_layer.get('dataIdx', 0) != 0:
+                    continue
+                image_size = layer['imgSize'][input_offset]
+                return image_size, image_size, layer['channels'][input_offset]
+
+    @property
+    def output_layer_name(self):
+        'Get the last layer that is not a cost'
+        for layer in reversed(self.layers):
+            if not layer['type'].startswith('cost.'):
+                return layer['name']
+
+    def predict(self, data, layer_name=None):
+        'Get (N, OUTPUT_COUNT) outputs for (VECTOR_SIZE, N) data'
+        layer_index = self.layer_index_by_name[
+            layer_name or self.output_layer_name]
+        case_count = data.shape[1]
+        chunks = []
+        # Limit the memory that convolution patches take
+        for start_index in xrange(0, case_count, CASE_CHUNK_SIZE):
+            vectors = np.ascontiguousarray(
+                data[:, start_index:start_index + CASE_CHUNK_SIZE].T,
+                dtype=np.single)
+            chunks.append(self.get_outputs(layer_index, vectors, {}))
+        return np.concatenate(chunks)
+
+    @property
+    def dense_layer_index(self):
+        'Get the convolution that alone reads the data, if we can share it'
+        data_indices = [
+            index for index, layer in enumerate(self.layers)
+            if layer['type'] == 'data' and layer.get('dataIdx', 0) == 0]
+        consumer_indices = [
+            index for index, layer in enumerate(self.layers)
+            if set(data_indices) & set(layer.get('inputs', []))]
+        if len(consumer_indices) != 1:
+            return
+        layer = self.layers[consumer_indices[0]]
+        if layer['type'] != 'conv' or len(layer['inputs']) != 1:
+            return
+        if layer.get('groups', [1])[0] != 1 or not layer.get(
+                'sharedBiases', 1):
+            return
+        return consumer_indices[0]
+
+    def predict_dense(
+            self, images, crop_xys, layer_name=None, data_mean=None):
+        'Get (N, OUTPUT_COUNT) outputs for crops at (x, y) of (C, H, W) images'
+        return self.predict_dense_views(
+            images, [(crop_xys, data_mean)], layer_name)[0]
+
+    def predict_dense_views(self, images, views, layer_name=None):
+        'Get outputs for each (CROP_XYS, DATA_MEAN) view of (C, H, W) images'
+        dense_index = self.dense_layer_index
+        if dense_index is None:
+            return [self.predict_crops(
+                images, crop_xys, layer_name, data_mean,
+            ) for crop_xys, data_mean in views]
+        layer_index = self.layer_index_by_name[
+            layer_name or self.output_layer_name]
+        layer = self.layers[dense_index]
+        crop_length = self.data_shape[0]
+        channel_count = len(images)
+        filter_size, stride = layer['filterSize'][0], layer['stride'][0]
+        # cuda-convnet may store padding as a negative module start
+        padding = abs(layer['padding'][0])
+        module_length = get_module_length(layer)
+        weights = layer['weights'][0]
+        biases = layer['biases'].reshape((1, -1, 1))
+        # Convolve the images once for every view, padding them enough
+        # that each module of each crop has an output
+        after_length = max(padding, (
+            module_length - 1) * stride + filter_size - crop_length - padding)
+        dense_outputs = compute_dense_conv(layer, np.pad(
+            images[np.newaxis].astype(np.single), (
+                (0, 0), (0, 0),
+                (padding, after_length), (padding, after_length),
+            ), 'constant'))[0]
+        filter_stride, y_stride, x_stride = dense_outputs.strides
+        windows = as_strided(dense_outputs, (
+            dense_outputs.shape[1] - module_length + 1,
+            dense_outputs.shape[2] - module_length + 1,
+            dense_outputs.shape[0], module_length, module_length,
+        ), (y_stride, x_stride, filter_stride, y_stride, x_stride))
+        # Shared outputs are exact except in modules that see the zeros
+        # around a crop, which we convolve again from each crop
+        module_starts = np.arange(module_length) * stride - padding
+        is_edge = (module_starts < 0) | (
+            module_starts + filter_size > crop_length)
+        edge_ys, edge_xs = np.nonzero(is_edge[:, np.newaxis] | is_edge)
+        outputs = []
+        for crop_xys, data_mean in views:
+            crop_xys = get_crop_xys(
+                crop_xys, self.data_shape[:2], images.shape[1:])
+            if (crop_xys % stride).any():
+                raise ValueError(
+                    'Crops must start every %s pixels' % stride)
+            # Convolve the mean once, since conv(x - m) = conv(x) - conv(m)
+            mean_outputs = 0
+            if data_mean is not None:
+                mean_images = np.zeros((
+                    1, channel_count, crop_length, crop_length,
+                ), dtype=np.single) + data_mean
+                mean_outputs = np.dot(get_patches(
+                    mean_images, filter_size, padding, stride,
+                    (module_length, module_length),
+                ).reshape((-1, weights.shape[0])), weights).T.reshape((
+                    -1, module_length, module_length))
+            chunks = []
+            for start_index in xrange(0, len(crop_xys), CASE_CHUNK_SIZE):
+                chunk_xys = crop_xys[start_index:start_index + CASE_CHUNK_SIZE]
+                module_xs, module_ys = (chunk_xys // stride).T
+                conv_outputs = windows[module_ys, module_xs]
+                if len(edge_ys):
+                    crops = np.array([images[
+                        :, y:y + crop_length, x:x + crop_length,
+                    ] for x, y in chunk_xys], dtype=np.single)
+                    edge_patches = get_patch_view(
+                        crops, filter_size, padding, stride,
+                        (module_length, module_length))[:, edge_ys, edge_xs]
+                    conv_outputs[:, :, edge_ys, edge_xs] = np.dot(
+                        edge_patches.reshape((-1, weights.shape[0])),
+                        weights,
+                    ).reshape((len(crops), len(edge_ys), -1)).transpose(
+                        0, 2, 1) + biases
+                conv_outputs -= mean_outputs
+                if layer.get('neuron'):
+                    conv_outputs = compute_neuron(
+                        layer['neuron'], conv_outputs)
+                vectors = np.ascontiguousarray(
+                    conv_outputs, dtype=np.single).reshape((
+                        len(chunk_xys), -1))
+                chunks.append(self.get_outputs(layer_index, None, {
+                    dense_index: vectors}))
+            outputs.append(
+                np.concatenate(chunks) if chunks else np.zeros((0, 0)))
+        return outputs
+
+    def predict_crops(
+            self, images, crop_xys, layer_name=None, data_mean=None):
+        'Get (N, OUTPUT_COUNT) outputs for crops at (x, y) of (C, H, W) images'
+        crop_height, crop_width = self.data_shape[:2]
+        crop_xys = get_crop_xys(
+            crop_xys, (crop_height, crop_width), images.shape[1:])
+        chunks = []
+        for start_index in xrange(0, len(crop_xys), CASE_CHUNK_SIZE):
+            data = np.array([images[
+                :, y:y + crop_height, x:x + crop_width,
+            ] for x, y in crop_xys[start_index:start_index + CASE_CHUNK_SIZE]
+            ], dtype=np.single)
+            if data_mean is not None:
+                data -= data_mean
+            chunks.append(self.predict(
+                data.reshape((len(data), -1)).T, layer_name))
+        return np.concatenate(chunks) if chunks else np.zeros((0, 0))
+
+    def get_outputs(self, layer_index, vectors, outputs_by_index):
+        try:
+            return outputs_by_index[layer_index]
+        except KeyError:
+            pass
+        layer = self.layers[layer_index]
+        if layer['type'] == 'data':
+            outputs = vectors
+        else:
+            inputs = [self.get_outputs(
+                x, vectors, outputs_by_index) for x in layer['inputs']]
+            try:
+                compute = compute_by_layer_type[layer['type']]
+            except KeyError:
+                raise NotImplementedError(
+                    'Layer type not supported: %s' % layer['type'])
+            outputs = compute(layer, inputs)
+            if layer.get('neuron'):
+                outputs = compute_neuron(layer['neuron'], outputs)
+        outputs_by_index[layer_index] = outputs
+        return outputs
+
+
+def get_crop_xys(crop_xys, crop_shape, image_shape):
+    'Get crop (x, y) as an (N, 2) array, checking that crops fit in images'
+    crop_height, crop_width = crop_shape
+    image_height, image_width = image_shape
+    crop_xys = np.array(crop_xys, dtype=int).reshape((-1, 2))
+    if len(crop_xys) and ((crop_xys < 0).any() or (
+            crop_xys[:, 0] + crop_width > image_width).any() or (
+            crop_xys[:, 1] + crop_height > image_height).any()):
+        raise ValueError('Crops must fit inside the images')
+    return crop_xys
+
+
+def get_module_length(layer, input_offset=0):
+    'Get the number of modules across the image of a conv or local layer'
+    # cuda-convnet may store padding as a negative module start
+    padding = abs(layer['padding'][input_offset])
+    return layer.get('modulesX') or 1 + int(ceil((
+        2 * padding + layer['imgSize'][input_offset] -
+        layer['filterSize'][input_offset],
+    ) / float(layer['stride'][input_offset])))
+
+
+def load_checkpoint(marker_path):
+    'Load a checkpoint file or the latest checkpoint in a folder'
+    if os.path.isdir(marker_path):
+        checkpoint_names = sorted(os.listdir(marker_path), key=lambda x: [
+            int(y) if y.isdigit() else y for y in re.split(r'(\d+)', x)])
+        marker_path = os.path.join(marker_path, checkpoint_names[-1])
+    unpickler = pickle.Unpickler(open(marker_path, 'rb'))
+    unpickler.find_global = find_global
+    return unpickler.load()
+
+
+def find_global(module_name, class_name):
+    'Stand in for classes from cuda-convnet, which we may not have'
+    try:
+        module = __import__(module_name, fromlist=[class_name])
+        return getattr(module, class_name)
+    except (ImportError, AttributeError):
+        return type(class_name, (MissingObject,), {})
+
+
+class MissingObject(object):
+
+    def __init__(self, *args, **kw):
+        pass
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            self.__dict__.update(state)
+
+
+def compute_conv(layer, inputs):
+    return compute_filters(layer, inputs, share_weights=True)
+
+
+def compute_local(layer, inputs):
+    return compute_filters(layer, inputs, share_weights=False)
+
+
+def compute_filters(layer, inputs, share_weights):
+    case_count = len(inputs[0])
+    filter_count = layer['filters']
+    outputs = 0
+    for input_offset, vectors in enumerate(inputs):
+        if layer.get('groups', [1])[input_offset] != 1:
+            raise NotImplementedError('Filter groups are not supported')
+        channel_count = layer['channels'][input_offset]
+        image_size = layer['imgSize'][input_offset]
+        filter_size = layer['filterSize'][input_offset]
+        # cuda-convnet may store padding as a negative module start
+        padding = abs(layer['padding'][input_offset])
+        stride = layer['stride'][input_offset]
+        module_length = get_module_length(layer, input_offset)
+        patches = get_patches(vectors.reshape((
+            case_count, channel_count, image_size, image_size,
+        )), filter_size, padding, stride, (module_length, module_length))
+        weights = layer['weights'][input_offset]
+        if share_weights:
+            input_outputs = np.dot(patches.reshape((
+                -1, weights.shape[0])), weights)
+        else:
+            # Multiply each module by its own weights
+            module_count = module_length * module_length
+            module_weights = weights.reshape((
+                module_count, -1, filter_count))
+            module_patches = patches.reshape((
+                case_count, module_count, -1))
+            input_outputs = np.empty(
+                (case_count, module_count, filter_count), dtype=np.single)
+            for module_index in xrange(module_count):
+                input_outputs[:, module_index] = np.dot(
+                    module_patches[:, module_index],
+                    module_weights[module_index])
+        outputs = outputs + input_outputs.reshape((
+            case_count, module_length, module_length, filter_count))
+    outputs = outputs.transpose(0, 3, 1, 2)
+    biases = layer['biases']
+    if share_weights and layer.get('sharedBiases', 1):
+        outputs = outputs + biases.reshape((1, filter_count, 1, 1))
+    else:
+        outputs = outputs + biases.reshape((
+            1, filter_count, module_length, module_length))
+    return np.ascontiguousarray(outputs, dtype=np.single).reshape((
+        case_count, -1))
+
+
+def get_patches(images, filter_size, padding, stride, module_shape):
+    'Get (N, MODULES_Y, MODULES_X, CHANNELS * FILTER_PIXELS) patches'
+    patches = get_patch_view(
+        images, filter_size, padding, stride, module_shape)
+    return patches.reshape(patches.shape[:3] + (-1,))
+
+
+def get_patch_view(images, filter_size, padding, stride, module_shape):
+    'View (N, MODULES_Y, MODULES_X, CHANNELS, FILTER_Y, FILTER_X) patches'
+    case_count, channel_count, image_height, image_width = images.shape
+    module_height, module_width = module_shape
+    padded_height = max(
+        image_height + 2 * padding, (module_height - 1) * stride + filter_size)
+    padded_width = max(
+        image_width + 2 * padding, (module_width - 1) * stride + filter_size)
+    padded_images = np.zeros((
+        case_count, channel_count, padded_height, padded_width),
+        dtype=np.single)
+    padded_images[
+        :, :, padding:padding + image_height, padding:padding + image_width,
+    ] = images
+    case_stride, channel_stride, y_stride, x_stride = padded_images.strides
+    return as_strided(padded_images, (
+        case_count, module_height, module_width,
+        channel_count, filter_size, filter_size,
+    ), (
+        case_stride, y_stride * stride, x_stride * stride,
+        channel_stride, y_stride, x_stride))
+
+
+def compute_pool(layer, inputs):
+    vectors = inputs[0]
+    case_count = len(vectors)
+    channel_count = layer['channels']
+    image_size = layer['imgSize']
+    stride = layer['stride']
+    start = layer['start']
+    output_length = layer['outputsX'] or 1 + int(ceil(
+        (image_size - start - layer['sizeX']) / float(stride)))
+    outputs = pool_images(layer, vectors.reshape((
+        case_count, channel_count, image_size, image_size,
+    )), start, (output_length, output_length))
+    return np.ascontiguousarray(outputs, dtype=np.single).reshape((
+        case_count, -1))
+
+
+def pool_images(layer, images, start, output_shape):
+    'Pool (N, C, H, W) images, clipping windows at the edges'
+    window_size = layer['sizeX']
+    stride = layer['stride']
+    if layer['pool'] == 'max':
+        return get_windows(
+            images, -np.inf, start, window_size, stride,
+            output_shape).max(axis=(4, 5))
+    if layer['pool'] == 'avg':
+        sums = get_windows(
+            images, 0, start, window_size, stride,
+            output_shape).sum(axis=(4, 5))
+        counts = get_windows(
+            np.ones((1, 1) + images.shape[2:]), 0, start, window_size,
+            stride, output_shape).sum(axis=(4, 5))
+        return sums / counts
+    raise NotImplementedError('Pool not supported: %s' % layer['pool'])
+
+
+def get_windows(images, fill_value, start, window_size, stride, output_shape):
+    image_height, image_width = images.shape[2:]
+    output_height, output_width = output_shape
+    # Pad so that every window fits
+    before_length = max(0, -start)
+    after_height = max(0, start + (
+        output_height - 1) * stride + window_size - image_height)
+    after_width = max(0, start + (
+        output_width - 1) * stride + window_size - image_width)
+    padded_images = np.pad(images, (
+        (0, 0), (0, 0),
+        (before_length, after_height), (before_length, after_width),
+    ), 'constant', constant_values=fill_value)
+    offset = before_length + start
+    padded_images = padded_images[:, :, offset:, offset:]
+    case_stride, channel_stride, y_stride, x_stride = padded_images.strides
+    return as_strided(padded_images, (
+        images.shape[0], images.shape[1], output_height, output_width,
+        window_size, window_size,
+    ), (
+        case_stride, channel_stride, y_stride * stride, x_stride * stride,
+        y_stride, x_stride))
+
+
+def compute_cmrnorm(layer, inputs):
+    vectors = inputs[0]
+    case_count = len(vectors)
+    image_size = layer['imgSize']
+    outputs = normalize_images(layer, vectors.reshape((
+        case_count, layer['channels'], image_size, image_size)))
+    return np.ascontiguousarray(outputs, dtype=np.single).reshape((
+        case_count, -1))
+
+
+def normalize_images(layer, images):
+    'Normalize each pixel by the squares of neighboring channels'
+    if layer.get('blocked'):
+        raise NotImplementedError('Blocked normalization is not supported')
+    channel_count = images.shape[1]
+    window_size = layer['size']
+    cumulative_sums = np.zeros(
+        (images.shape[0], channel_count + 1) + images.shape[2:])
+    np.cumsum(np.square(images, dtype=np.float64), axis=1,
+              out=cumulative_sums[:, 1:])
+    channel_indices = np.arange(channel_count) - window_size // 2
+    start_indices = np.clip(channel_indices, 0, channel_count)
+    stop_indices = np.clip(channel_indices + window_size, 0, channel_count)
+    square_sums = (
+        cumulative_sums[:, stop_indices] - cumulative_sums[:, start_indices])
+    # The saved scale is already divided by the window size
+    denominators = layer.get('minDiv', 1) + layer['scale'] * square_sums
+    return images * denominators ** -layer['pow']
+
+
+def compute_dense_conv(layer, images):
+    'Convolve (1, C, H, W) images without padding'
+    filter_size, stride = layer['filterSize'][0], layer['stride'][0]
+    weights = layer['weights'][0]
+    output_height, output_width = get_valid_shape(
+        images.shape[2:], filter_size, stride)
+    outputs = np.empty((
+        1, weights.shape[1], output_height, output_width), dtype=np.single)
+    # Limit the memory that convolution patches take
+    row_count = max(1, CASE_CHUNK_SIZE * 8 // max(1, output_width))
+    for start_row in xrange(0, output_height, row_count):
+        stop_row = min(start_row + row_count, output_height)
+        patches = get_patches(images[
+            :, :, start_row * stride:(stop_row - 1) * stride + filter_size,
+        ], filter_size, 0, stride, (stop_row - start_row, output_width))
+        outputs[0, :, start_row:stop_row] = np.dot(patches.reshape((
+            -1, weights.shape[0])), weights).T.reshape((
+                -1, stop_row - start_row, output_width))
+    outputs += layer['biases'].reshape((1, -1, 1, 1))
+    return outputs
+
+
+def get_valid_shape(image_shape, window_size, stride):
+    return tuple(max(0, (x - window_size) // stride + 1) for x in image_shape)
+
+
+def compute_fc(layer, inputs):
+    outputs = layer['biases'].reshape((1, -1))
+    for vectors, weights in zip(inputs, layer['weights']):
+        outputs = outputs + np.dot(vectors, weights)
+    return outputs.astype(np.single)
+
+
+def compute_softmax(layer, inputs):
+    vectors = inputs[0]
+    exponentials = np.exp(vectors - vectors.max(axis=1)[:, np.newaxis])
+    return exponentials / exponentials.sum(axis=1)[:, np.newaxis]
+
+
+def compute_neuron_layer(layer, inputs):
+    # Leave the activation to the caller, which applies it for every layer
+    return inputs[0]
+
+
+def compute_neuron(neuron, x):
+    if isinstance(neuron, dict):
+        neuron_type = neuron['type']
+        parameter_by_name = neuron.get('params', {})
+    else:
+        neuron_type, parameter_text = PATTERN_NEURON.match(neuron).groups()
+        parameter_by_name = dict(zip('ab', [
+            float(y) for y in parameter_text.split(',')
+        ] if parameter_text else []))
+    a = parameter_by_name.get('a')
+    b = parameter_by_name.get('b')
+    if neuron_type == 'ident':
+        return x
+    if neuron_type == 'relu':
+        return np.maximum(x, 0)
+    if neuron_type == 'brelu':
+        return np.clip(x, 0, a)
+    if neuron_type == 'softrelu':
+        return np.log1p(np.exp(x))
+    if neuron_type == 'logistic':
+        return 1 / (1 + np.exp(-x))
+    if neuron_type == 'tanh':
+        return a * np.tanh(b * x)
+    if neuron_type == 'abstanh':
+        return a * np.abs(np.tanh(b * x))
+    if neuron_type == 'abs':
+        return np.abs(x)
+    if neuron_type == 'square':
+        return np.square(x)
+    if neuron_type == 'sqrt':
+        return np.sqrt(x)
+    if neuron_type == 'linear':
+        return a * x + b
+    raise NotImplementedError('Neuron not supported: %s' % neuron_type)
+
+
+def get_views(data, array_shape, border_size, multiview=False):
+    'Crop (VECTOR_SIZE, N) data like CroppedZeroMeanDataProvider in test'
+    pixel_height, pixel_width, band_count = array_shape
+    inner_height = pixel_height - border_size * 2
+    inner_width = pixel_width - border_size * 2
+    case_count = data.shape[1]
+    arrays = data.reshape((band_count, pixel_height, pixel_width, case_count))
+    if multiview:
+        start_positions = [
+            (0, 0),
+            (0, border_size * 2),
+            (border_size, border_size),
+            (border_size * 2, 0),
+            (border_size * 2, border_size * 2)]
+    else:
+        start_positions = [(border_size, border_size)]
+    views = []
+    for start_y, start_x in start_positions:
+        views.append(arrays[
+            :,
+            start_y:start_y + inner_height,
+            start_x:start_x + inner_width])
+    if multiview:
+        views.extend(x[:, :, ::-1] for x in list(views))
+    return [x.reshape((-1, case_count)) for x in views]
+
+
+compute_by_layer_type = {
+    'conv': compute_conv,
+    'local': compute_local,
+    'pool': compute_pool,
+    'cmrnorm': compute_cmrnorm,
+    'fc': compute_fc,
+    'softmax': compute_softmax,
+    'neuron': compute_neuron_layer,
+}
@@ -0,0 +1,163 @@
+'Cache projected points from layers and write layers in chunks'
+import cPickle as pickle
+import hashlib
+import numpy as np
+import os
+import scipy
+from geometryIO import load_points
+from osgeo import ogr, osr
+
+from .disk import make_folder
+from .spatial_index import SpatialIndex
+
+
+driver_name_by_extension = {
+    '.fgb': 'FlatGeobuf',
+    '.gpkg': 'GPKG',
+    '.shp': 'ESRI Shapefile',
+}
+POINTS_FORMATS = 'gpkg', 'fgb'
+FEATURE_CHUNK_SIZE = 10000
+POINTS_CACHE_FOLDER = os.environ.get(
+    'COUNT_BUILDINGS_CACHE_FOLDER',
+    os.path.expanduser('~/.cache/count_buildings/points'))
+# Shapefiles keep their geometries and projection in sidecar files
+SIDECAR_EXTENSIONS = '.shx', '.prj'
+HASH_CHUNK_SIZE = 2 ** 20
+
+
+def load_projected_xys(points_path, proj4, cache_folder=None):
+    'Load (N, 2) points in proj4, memory-mapped from the cache after once'
+    try:
+        cache_path = get_cache_path(points_path, proj4, cache_folder)
+    except (IOError, OSError):
+        # Let geometryIO report sources that it cannot read
+        return get_projected_xys(points_path, proj4)
+    return load_cached_xys(cache_path, points_path, proj4)
+
+
+def load_point_index(points_path, proj4, cache_folder=None):
+    'Load a SpatialIndex of points in proj4, unpickling its tree if cached'
+    try:
+        cache_path = get_cache_path(points_path, proj4, cache_folder)
+    except (IOError, OSError):
+        return SpatialIndex(get_projected_xys(points_path, proj4))
+    xys = load_cached_xys(cache_path, points_path, proj4)
+    # Pickled trees only load in the scipy that saved them
+    kdtree_path = '%s.scipy-%s.kdtree' % (cache_path, scipy.__version__)
+    try:
+        with open(kdtree_path, 'rb') as kdtree_file:
+            return SpatialIndex(xys, pickle.load(kdtree_file))
+    except Exception:
+        # Rebuild trees that are missing or that we cannot unpickle
+        pass
+    point_index = SpatialIndex(xys)
+    if point_index.kdtree is not None:
+        save_atomically(kdtree_path, lambda x: pickle.dump(
+            point_index.kdtree, x, pickle.HIGHEST_PROTOCOL))
+    return point_index
+
+
+def load_cached_xys(cache_path, points_path, proj4):
+    xys_path = cache_path + '.npy'
+    if not os.path.exists(xys_path):
+        xys = get_projected_xys(points_path, proj4)
+        save_atomically(xys_path, lambda x: np.save(x, xys))
+    try:
+        return np.load(xys_path, mmap_mode='r')
+    except ValueError:
+        # Memory maps cannot be empty
+        return np.load(xys_path)
+
+
+def get_projected_xys(points_path, proj4):
+    return np.reshape(load_points(
+        points_path, targetProj4=proj4)[1], (-1, 2)).astype(np.float64)
+
+
+def get_cache_path(points_path, proj4, cache_folder=None):
+    'Name cached points by source contents, modification times and proj4'
+    cache_folder = make_folder(cache_folder or POINTS_CACHE_FOLDER)
+    source_hash = hashlib.sha1(proj4)
+    stem, extension = os.path.splitext(points_path)
+    source_paths = [points_path]
+    if extension.lower() == '.shp':
+        source_paths.extend(
+            stem + x for x in SIDECAR_EXTENSIONS if os.path.exists(stem + x))
+    for source_path in source_paths:
+        source_hash.update(os.path.splitext(source_path)[1])
+        source_hash.update(get_source_digest(source_path, cache_folder))
+    return os.path.join(cache_folder, source_hash.hexdigest())
+
+
+def get_source_digest(source_path, cache_folder):
+    'Hash the contents and modification time of a source file'
+    # Hashing reads the whole file, so remember its digest for as long as
+    # the file keeps its path, size and modification time
+    source_stat = os.stat(source_path)
+    digest_path = os.path.join(cache_folder, hashlib.sha1(repr((
+        os.path.abspath(source_path), source_stat.st_size,
+        source_stat.st_mtime))).hexdigest() + '.digest')
+    try:
+        with open(digest_path, 'rb') as digest_file:
+            return digest_file.read()
+    except IOError:
+        pass
+    source_hash = hashlib.sha1(repr(source_stat.st_mtime))
+    with open(source_path, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(HASH_CHUNK_SIZE), ''):
+            source_hash.update(chunk)
+    source_digest = source_hash.hexdigest()
+    save_atomically(digest_path, lambda x: x.write(source_digest))
+    return source_digest
+
+
+def save_atomically(target_path, save):
+    'Write through a temporary file so that readers never see partial files'
+    temporary_path = '%s.%s.tmp' % (target_path, os.getpid())
+    with open(temporary_path, 'wb') as temporary_file:
+        save(temporary_file)
+    os.rename(temporary_path, target_path)
+    return target_path
+
+
+def save_points(
+        target_path, proj4, xys, values_by_name=None,
+        chunk_size=FEATURE_CHUNK_SIZE):
+    'Save (N, 2) points with (N,) real attributes, one transaction per chunk'
+    stem, extension = os.path.splitext(target_path)
+    driver = ogr.GetDriverByName(driver_name_by_extension[extension])
+    if os.path.exists(target_path):
+        driver.DeleteDataSource(target_path)
+    data_source = driver.CreateDataSource(target_path)
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromProj4(proj4)
+    layer = data_source.CreateLayer(
+        os.path.basename(stem), spatial_reference, ogr.wkbPoint)
+    values_by_name = sorted((values_by_name or {}).items())
+    for name, values in values_by_name:
+        layer.CreateField(ogr.FieldDefn(name, ogr.OFTReal))
+    layer_definition = layer.GetLayerDefn()
+    use_transactions = layer.TestCapability(ogr.OLCTransactions)
+    xys = np.asarray(xys, dtype=np.float64).reshape((-1, 2))
+    for start_index in xrange(0, len(xys), chunk_size):
+        stop_index = min(start_index + chunk_size, len(xys))
+        if use_transactions:
+            layer.StartTransaction()
+        value_rows = np.column_stack([
+            values[start_index:stop_index] for name, values in values_by_name
+        ]).tolist() if values_by_name else [[]] * (stop_index - start_index)
+        for (x, y), value_row in zip(
+                xys[start_index:stop_index].tolist(), value_rows):
+            feature = ogr.Feature(layer_definition)
+            point = ogr.Geometry(ogr.wkbPoint)
+            point.AddPoint_2D(x, y)
+            feature.SetGeometry(point)
+            for field_index, value in enumerate(value_row):
+                feature.SetField(field_index, float(value))
+            layer.CreateFeature(feature)
+        if use_transactions:
+            layer.CommitTransaction()
+    # Release the data source to flush features and write the index
+    layer = data_source = None
+    return target_path
@@ -0,0 +1,104 @@
+'Reject tiles that are clearly free of buildings before the marker sees them'
+import cPickle as pickle
+import numpy as np
+
+
+PREFILTER_NAME = 'prefilter.pkl'
+ITERATION_COUNT = 500
+LEARNING_RATE = 0.5
+
+
+class Prefilter(object):
+
+    def __init__(
+            self, feature_means, feature_scales, weights, bias,
+            threshold=-np.inf):
+        self.feature_means = feature_means
+        self.feature_scales = feature_scales
+        self.weights = weights
+        self.bias = bias
+        self.threshold = threshold
+
+    @classmethod
+    def load(Class, prefilter_path):
+        return Class(**pickle.load(open(prefilter_path, 'rb')))
+
+    def save(self, prefilter_path):
+        pickle.dump(dict(
+            feature_means=self.feature_means,
+            feature_scales=self.feature_scales,
+            weights=self.weights,
+            bias=self.bias,
+            threshold=self.threshold,
+        ), open(prefilter_path, 'wb'), protocol=-1)
+
+    @classmethod
+    def fit(Class, features, labels, target_recall):
+        'Train logistic regression and keep target_recall of positives'
+        labels = np.asarray(labels, dtype=bool)
+        feature_means = features.mean(axis=0)
+        feature_scales = features.std(axis=0)
+        feature_scales[feature_scales == 0] = 1
+        x = (features - feature_means) / feature_scales
+        # Weigh classes equally because most tiles have no buildings
+        sample_weights = np.where(
+            labels, 0.5 / max(1, labels.sum()),
+            0.5 / max(1, (~labels).sum()))
+        weights = np.zeros(x.shape[1])
+        bias = 0.
+        for iteration_index in xrange(ITERATION_COUNT):
+            errors = sample_weights * (
+                1 / (1 + np.exp(-(np.dot(x, weights) + bias))) - labels)
+            weights -= LEARNING_RATE * np.dot(errors, x)
+            bias -= LEARNING_RATE * errors.sum()
+        prefilter = Class(feature_means, feature_scales, weights, bias)
+        prefilter.threshold = get_threshold(
+            prefilter.get_scores(features[labels]), target_recall)
+        return prefilter
+
+    def get_scores(self, features):
+        return np.dot(
+            (features - self.feature_means) / self.feature_scales,
+            self.weights) + self.bias
+
+    def select(self, arrays):
+        'Return True for (N, HEIGHT, WIDTH, BAND_COUNT) arrays worth marking'
+        return self.get_scores(get_features(arrays)) >= self.threshold
+
+
+def get_features(arrays):
+    'Get band means, band deviations and edge densities for each array'
+    arrays = np.asarray(arrays, dtype=np.single)
+    intensities = arrays.mean(axis=3)
+    return np.column_stack([
+        arrays.mean(axis=(1, 2)),
+        arrays.std(axis=(1, 2)),
+        np.abs(np.diff(intensities, axis=1)).mean(axis=(1, 2)),
+        np.abs(np.diff(intensities, axis=2)).mean(axis=(1, 2)),
+    ])
+
+
+def get_threshold(positive_scores, target_recall):
+    'Get the highest score that keeps target_recall of positive scores'
+    if not len(positive_scores):
+        return -np.inf
+    positive_scores = np.sort(positive_scores)
+    # Round before ceil so that 0.8 * 10 keeps 8 scores and not 9
+    kept_count = int(np.ceil(np.round(
+        target_recall * len(positive_scores), 6)))
+    return positive_scores[len(positive_scores) - max(1, kept_count)]
+
+
+def summarize_pruning(batch_group, pruned_keys, keys):
+    'Count pruned tiles and the fraction of labelled buildings that remain'
+    summary = dict(pruned_count=len(pruned_keys))
+    if 'labels' not in batch_group.h5s[0]:
+        return summary
+    kept_positive_count = np.sum(batch_group.get_labels(sorted(set(
+        tuple(x) for x in keys))))
+    pruned_positive_count = np.sum(batch_group.get_labels(pruned_keys))
+    positive_count = kept_positive_count + pruned_positive_count
+    if positive_count:
+        summary['prefilter_recall'] = kept_positive_count / float(
+            positive_count)
+    return summary
@@ -0,0 +1,193 @@
+'Store probabilities with their pixel centers and tile indices in one file'
+import numpy as np
+import os
+from fractions import gcd
+from numpy.lib.format import (
+    dtype_to_descr, magic, read_array_header_1_0, read_magic)
+from pandas import DataFrame, read_csv
+from scipy.ndimage import maximum_filter
+
+
+PROBABILITIES_NAME = 'probabilities.npy'
+PROBABILITIES_CSV = 'probabilities.csv'
+PACK_COLUMNS = 'pixel_center_x', 'pixel_center_y', 'tile_index'
+# Reserve enough digits in the header to append rows without moving data
+HEADER_ALIGNMENT = 64
+ROW_COUNT_LENGTH = 20
+GRID_NULL_VALUE = -1
+# Refuse inferred grids that are mostly empty, which suggests that merged
+# shards threw off the inferred interval
+MAXIMUM_CELLS_PER_RECORD = 8
+
+
+def get_probability_dtype(class_count=2):
+    return np.dtype([(str(x), np.float32) for x in xrange(class_count)] + [
+        ('pixel_center_x', np.int32),
+        ('pixel_center_y', np.int32),
+        ('tile_index', np.int64)])
+
+
+def get_probability_records(probabilities, pixel_centers, tile_indices=None):
+    'Pack (N, CLASS_COUNT) probabilities into records; -1 marks no tile'
+    probabilities = np.asarray(probabilities)
+    records = np.zeros(len(probabilities), dtype=get_probability_dtype(
+        probabilities.shape[1]))
+    for class_index in xrange(probabilities.shape[1]):
+        records[str(class_index)] = probabilities[:, class_index]
+    if len(pixel_centers):
+        records['pixel_center_x'], records['pixel_center_y'] = np.transpose(
+            pixel_centers)
+    records['tile_index'] = -1 if tile_indices is None else tile_indices
+    return records
+
+
+def save_probabilities(target_path, records):
+    'Write records to a new store, replacing any existing store'
+    with open(target_path, 'wb') as target_file:
+        write_header(target_file, records.dtype, 0)
+    append_probabilities(target_path, records)
+
+
+def append_probabilities(target_path, records):
+    'Add records to the end of a store, creating it if necessary'
+    if not os.path.exists(target_path):
+        return save_probabilities(target_path, records)
+    with open(target_path, 'r+b') as target_file:
+        dtype, row_count = read_header(target_file)
+        if dtype != records.dtype:
+            raise ValueError(
+                'Cannot append %s to a store of %s' % (records.dtype, dtype))
+        target_file.seek(0, os.SEEK_END)
+        target_file.write(np.ascontiguousarray(records).tostring())
+        target_file.seek(0)
+        write_header(target_file, dtype, row_count + len(records))
+
+
+def load_probabilities(probabilities_folder, mmap_mode='r'):
+    'Map the store in a folder, converting probabilities.csv if that is all'
+    probabilities_path = os.path.join(probabilities_folder, PROBABILITIES_NAME)
+    if not os.path.exists(probabilities_path):
+        return get_records_from_table(read_csv(os.path.join(
+            probabilities_folder, PROBABILITIES_CSV)))
+    if not read_row_count(probabilities_path):
+        # Skip mmap, which refuses to map nothing
+        return np.load(probabilities_path)
+    return np.load(probabilities_path, mmap_mode=mmap_mode)
+
+
+def load_positive_pixel_centers(probabilities_folder):
+    'Get pixel centers of tiles whose building probability wins'
+    records = load_probabilities(probabilities_folder)
+    is_positive = records['1'] > records['0']
+    return np.column_stack([
+        records['pixel_center_x'][is_positive],
+        records['pixel_center_y'][is_positive]])
+
+
+def get_table_from_records(records):
+    table = DataFrame(dict((x, records[x]) for x in records.dtype.names))
+    return table[list(records.dtype.names)]
+
+
+def get_records_from_table(table):
+    class_columns = [x for x in table.columns if x not in PACK_COLUMNS]
+    return get_probability_records(
+        table[class_columns].values,
+        table[['pixel_center_x', 'pixel_center_y']].values,
+        table['tile_index'].values if 'tile_index' in table else None)
+
+
+def export_probabilities(target_path, records):
+    'Write records as a CSV table like the one from ccn-predict'
+    get_table_from_records(records).to_csv(target_path, index=False)
+
+
+def get_probability_grid(records, pixel_interval=None, class_name='1'):
+    'Place probabilities on the tile grid as (ROW_COUNT, COLUMN_COUNT) cells'
+    pixel_centers = np.column_stack([
+        records['pixel_center_x'], records['pixel_center_y']])
+    is_inferred = pixel_interval is None
+    pixel_origin, pixel_interval = get_grid_geometry(
+        pixel_centers, pixel_interval)
+    grid_xys = (pixel_centers - pixel_origin) // pixel_interval
+    column_count, row_count = grid_xys.max(axis=0) + 1 if len(
+        grid_xys) else (0, 0)
+    if is_inferred and row_count * column_count > len(
+            records) * MAXIMUM_CELLS_PER_RECORD:
+        raise ValueError(
+            'Inferred a pixel interval of %sx%s, which makes a grid of '
+            '%sx%s cells for %s tiles; please specify the tile dimensions' % (
+                pixel_interval[0], pixel_interval[1],
+                column_count, row_count, len(records)))
+    grid = np.empty((row_count, column_count), dtype=np.float32)
+    grid.fill(GRID_NULL_VALUE)
+    grid[grid_xys[:, 1], grid_xys[:, 0]] = records[class_name]
+    return grid, pixel_origin, pixel_interval
+
+
+def get_grid_geometry(pixel_centers, pixel_interval=None):
+    'Get the pixel center of the first cell and the pixel interval per axis'
+    if not len(pixel_centers):
+        return np.zeros(2, dtype=int), np.ones(2, dtype=int)
+    pixel_origin = pixel_centers.min(axis=0)
+    if pixel_interval is not None:
+        return pixel_origin, np.array(pixel_interval, dtype=int)
+    # Tile centers sit a whole number of intervals from the first center,
+    # which overestimates the interval if every other column is missing
+    pixel_interval = [reduce(gcd, set(np.diff(np.unique(
+        pixel_centers[:, x])).tolist()), 0) for x in xrange(2)]
+    if not all(pixel_interval):
+        # Use the other axis for a single row or column of tiles
+        pixel_interval = [max(pixel_interval) or 1] * 2
+    return pixel_origin, np.array(pixel_interval)
+
+
+def get_peak_pixel_centers(
+        grid, pixel_origin, pixel_interval, pixel_radius, threshold=0.5):
+    'Get centers of cells that beat the threshold and all cells near them'
+    if not grid.size:
+        return np.zeros((0, 2), dtype=int)
+    cell_radius_x, cell_radius_y = [
+        int(np.ceil(pixel_radius / float(x))) for x in pixel_interval]
+    offset_ys, offset_xs = np.mgrid[
+        -cell_radius_y:cell_radius_y + 1, -cell_radius_x:cell_radius_x + 1]
+    # Count cells strictly within radius like the hotspots
+    footprint = np.square(offset_xs * pixel_interval[0]) + np.square(
+        offset_ys * pixel_interval[1]) < pixel_radius ** 2
+    footprint[cell_radius_y, cell_radius_x] = True
+    # Rank cells so that equal probabilities yield one peak, not a plateau
+    ranks = np.empty(grid.size, dtype=np.int64)
+    ranks[np.argsort(grid.ravel(), kind='mergesort')] = np.arange(grid.size)
+    ranks = ranks.reshape(grid.shape)
+    is_peak = (ranks == maximum_filter(
+        ranks, footprint=footprint, mode='constant', cval=-1)) & (
+        grid > threshold)
+    peak_rows, peak_columns = np.nonzero(is_peak)
+    return pixel_origin + np.column_stack([
+        peak_columns, peak_rows]) * pixel_interval
+
+
+def read_header(source_file):
+    read_magic(source_file)
+    shape, fortran_order, dtype = read_array_header_1_0(source_file)
+    return dtype, shape[0]
+
+
+def read_row_count(probabilities_path):
+    with open(probabilities_path, 'rb') as source_file:
+        return read_header(source_file)[1]
+
+
+def write_header(target_file, dtype, row_count):
+    'Write a version 1.0 header padded to the same length for any row count'
+    template = "{'descr': %r, 'fortran_order': False, 'shape': (%s,), }"
+    descr = dtype_to_descr(dtype)
+    header = template % (descr, row_count)
+    prefix_length = len(magic(1, 0)) + 2
+    padded_length = prefix_length + len(
+        template % (descr, '')) + ROW_COUNT_LENGTH + 1
+    padded_length += -padded_length % HEADER_ALIGNMENT
+    header = header.ljust(padded_length - prefix_length - 1) + '\n'
+    target_file.write(magic(1, 0))
+    target_file.write(np.array(len(header), dtype='<u2').tostring())
+    target_file.write(header)
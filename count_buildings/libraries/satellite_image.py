@@ -9,6 +9,14 @@ from scipy.misc import toimage
 from skimage.exposure import rescale_intensity
 
 
+gdal_type_by_array_dtype = {
+    np.dtype('uint8'): gdal.GDT_Byte,
+    np.dtype('uint16'): gdal.GDT_UInt16,
+    np.dtype('float32'): gdal.GDT_Float32,
+    np.dtype('float64'): gdal.GDT_Float64,
+}
+
+
 class ProjectedCalibration(object):
 
     def __init__(self, calibration_pack):
@@ -40,6 +48,12 @@ class ProjectedCalibration(object):
         projected_y = g3 + pixel_x * g4 + pixel_y * g5
         return np.array([projected_x, projected_y])
 
+    def to_projected_xys(self, pixel_xys):
+        'Get (N, 2) projected coordinates given (N, 2) pixel coordinates'
+        g0, g1, g2, g3, g4, g5 = self.calibration_pack
+        pixel_xys = np.asarray(pixel_xys, dtype=np.float64).reshape((-1, 2))
+        return np.dot(pixel_xys, [[g1, g4], [g2, g5]]) + (g0, g3)
+
     def to_pixel_xy(self, (projected_x, projected_y)):
         'Get pixel coordinates given projected coordinates'
         g0, g1, g2, g3, g4, g5 = self.calibration_pack
@@ -365,6 +379,25 @@ def get_dtype_bounds(dtype):
     return iinfo.min, iinfo.max
 
 
+def save_geoimage(
+        target_path, array, calibration_pack, proj4, null_value=None):
+    'Save a (HEIGHT, WIDTH) array as a single-band GeoTIFF'
+    row_count, column_count = array.shape
+    gdal_image = gdal.GetDriverByName('GTiff').Create(
+        target_path, column_count, row_count, 1,
+        gdal_type_by_array_dtype[array.dtype], ['COMPRESS=DEFLATE'])
+    gdal_image.SetGeoTransform(tuple(calibration_pack))
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromProj4(proj4)
+    gdal_image.SetProjection(spatial_reference.ExportToWkt())
+    band = gdal_image.GetRasterBand(1)
+    if null_value is not None:
+        band.SetNoDataValue(null_value)
+    band.WriteArray(array)
+    band.FlushCache()
+    return target_path
+
+
 def render_array(target_path, array):
     render_enhanced_array(target_path, enhance_array(array))
     return array
@@ -0,0 +1,94 @@
+'Bulk-load (N, 2) points once and answer batches of queries as CSR lists'
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class SpatialIndex(object):
+    'Answer queries with CSR lists; query i owns OFFSETS[i]:OFFSETS[i + 1]'
+
+    def __init__(self, xys, kdtree=None):
+        # Keep memory-mapped points on disk unless they need converting
+        self.xys = np.reshape(xys, (-1, 2)).astype(np.float64, copy=False)
+        self.point_count = len(self.xys)
+        if kdtree is None and self.point_count:
+            kdtree = cKDTree(self.xys)
+        self.kdtree = kdtree
+
+    def query_boxes(self, boxes):
+        'Get (OFFSETS, INDICES) of points inside each (x1, y1, x2, y2) box'
+        boxes = np.reshape(boxes, (-1, 4)).astype(np.float64)
+        lower_xys, upper_xys = boxes[:, :2], boxes[:, 2:]
+        # Find points in a square around each box, then keep those inside
+        offsets, indices = self._query_balls(
+            (lower_xys + upper_xys) / 2.,
+            (upper_xys - lower_xys).max(axis=1) / 2., p=np.inf)[:2]
+        query_indices = get_query_indices(offsets)
+        xys = self.xys[indices]
+        is_inside = np.all(
+            (lower_xys[query_indices] <= xys) &
+            (xys <= upper_xys[query_indices]), axis=1)
+        return select_neighbors(offsets, is_inside), indices[is_inside]
+
+    def query_radius(self, xys, radius):
+        'Get (OFFSETS, INDICES, DISTANCES) of points strictly within radius'
+        xys = np.reshape(xys, (-1, 2)).astype(np.float64)
+        offsets, indices, distances = self._query_balls(xys, radius)
+        is_near = distances < radius
+        return (
+            select_neighbors(offsets, is_near), indices[is_near],
+            distances[is_near])
+
+    def query_nearest(
+            self, xys, maximum_count=1, maximum_distance=np.inf):
+        'Get (OFFSETS, INDICES, DISTANCES) of nearest points, nearest first'
+        xys = np.reshape(xys, (-1, 2)).astype(np.float64)
+        neighbor_count = min(maximum_count, self.point_count)
+        if not neighbor_count or not len(xys):
+            return get_offsets(np.zeros(len(xys), dtype=np.int64)), np.zeros(
+                0, dtype=np.int64), np.zeros(0)
+        distances, indices = self.kdtree.query(
+            xys, k=neighbor_count, distance_upper_bound=maximum_distance)
+        distances = distances.reshape((len(xys), neighbor_count))
+        indices = indices.reshape((len(xys), neighbor_count))
+        # Missing neighbors have index point_count and distance inf
+        is_found = indices < self.point_count
+        return (
+            get_offsets(is_found.sum(axis=1)),
+            indices[is_found].astype(np.int64), distances[is_found])
+
+    def _query_balls(self, xys, radii, p=2):
+        'Get (OFFSETS, INDICES, DISTANCES) of points within radii, inclusive'
+        if not self.point_count or not len(xys):
+            return get_offsets(np.zeros(len(xys), dtype=np.int64)), np.zeros(
+                0, dtype=np.int64), np.zeros(0)
+        radii = np.broadcast_to(radii, len(xys))
+        pair_chunks = []
+        # Give each radius its own tree so that small balls stay small
+        for radius in np.unique(radii):
+            query_indices = np.flatnonzero(radii == radius)
+            # Pair both trees in compiled code instead of building index lists
+            pairs = cKDTree(xys[query_indices]).sparse_distance_matrix(
+                self.kdtree, radius, p=p, output_type='ndarray')
+            pairs['i'] = query_indices[pairs['i']]
+            pair_chunks.append(pairs)
+        pairs = np.concatenate(pair_chunks)
+        pairs = pairs[np.argsort(pairs['i'], kind='mergesort')]
+        return get_offsets(np.bincount(pairs['i'], minlength=len(
+            xys))), pairs['j'].astype(np.int64), pairs['v']
+
+
+def get_offsets(counts):
+    'Get CSR offsets from the number of neighbors of each query'
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+def get_query_indices(offsets):
+    'Get the query index of each neighbor in CSR lists'
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def select_neighbors(offsets, is_selected):
+    'Get CSR offsets after keeping only the selected neighbors'
+    return get_offsets(np.bincount(
+        get_query_indices(offsets)[is_selected],
+        minlength=len(offsets) - 1))
@@ -0,0 +1,46 @@
+import numpy as np
+from scipy.ndimage.interpolation import zoom
+
+
+_zoom_matrix_by_lengths = {}
+
+
+def resize_arrays(arrays, array_shape):
+    'Resize a stack of (N, HEIGHT, WIDTH, BAND_COUNT) arrays like zoom'
+    pixel_height, pixel_width, band_count = [int(x) for x in array_shape]
+    assert band_count <= arrays.shape[3]
+    arrays = arrays[:, :, :, :band_count]
+    if arrays.shape[1:3] == (pixel_height, pixel_width):
+        return arrays
+    # Zoom is separable, so interpolate rows and then columns
+    height_matrix = get_zoom_matrix(arrays.shape[1], pixel_height)
+    width_matrix = get_zoom_matrix(arrays.shape[2], pixel_width)
+    resized_arrays = np.tensordot(
+        height_matrix, arrays, axes=(1, 1)).transpose(1, 0, 2, 3)
+    resized_arrays = np.tensordot(
+        width_matrix, resized_arrays, axes=(1, 2)).transpose(1, 2, 0, 3)
+    return cast_array(resized_arrays, arrays.dtype)
+
+
+def get_zoom_matrix(source_length, target_length):
+    'Get interpolation weights that zoom applies along one axis'
+    key = source_length, target_length
+    try:
+        return _zoom_matrix_by_lengths[key]
+    except KeyError:
+        pass
+    # Zoom is linear, so zooming each unit vector recovers its weights
+    zoom_factor = target_length / float(source_length)
+    zoom_matrix = np.array([zoom(
+        x, zoom_factor, output=np.float64) for x in np.eye(source_length)]).T
+    _zoom_matrix_by_lengths[key] = zoom_matrix
+    return zoom_matrix
+
+
+def cast_array(array, dtype):
+    'Round and clip to integer dtypes the way zoom does'
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'iu':
+        return array.astype(dtype)
+    iinfo = np.iinfo(dtype)
+    return np.clip(np.round(array), iinfo.min, iinfo.max).astype(dtype)
@@ -1,12 +1,19 @@
 import logging
 import numpy as np
+import os
 import sys
 from collections import OrderedDict
 from crosscompute.libraries import script
-from geometryIO import GeometryError, load_points
+from geometryIO import GeometryError
+from pandas import DataFrame
 
+from ..libraries.evaluation import evaluate_locations
+from ..libraries.points import load_point_index, load_projected_xys
+from ..libraries.probabilities import load_positive_pixel_centers
 from ..libraries.satellite_image import SatelliteImage
-from ..libraries.kdtree import KDTree
+
+
+EVALUATIONS_CSV = 'evaluations.csv'
 
 
 def start(argv=sys.argv):
@@ -18,90 +25,82 @@ def start(argv=sys.argv):
             '--points_path', metavar='PATH', required=True,
             help='')
         starter.add_argument(
-            '--counts_path', metavar='PATH', required=True,
+            '--counts_path', metavar='PATH',
             help='')
+        starter.add_argument(
+            '--probabilities_folder', metavar='FOLDER',
+            help='evaluate centers of positive tiles instead of counts')
         starter.add_argument(
             '--maximum_metric_radius', metavar='METERS', required=True,
-            type=float,
-            help='')
+            type=float, nargs='+',
+            help='summarize the first radius; tabulate every radius')
+        starter.add_argument(
+            '--match_one_to_one', action='store_true',
+            help='also count pairs where each point matches at most once')
 
 
 def run(
         target_folder, image_path, points_path, counts_path,
-        maximum_metric_radius):
+        maximum_metric_radius, probabilities_folder=None,
+        match_one_to_one=False):
+    rows = evaluate_scene(
+        image_path, points_path, counts_path, maximum_metric_radius,
+        probabilities_folder, match_one_to_one)
+    evaluations_path = os.path.join(target_folder, EVALUATIONS_CSV)
+    save_evaluations(evaluations_path, rows)
+    return OrderedDict(
+        [(k, v) for k, v in rows[0].items() if k != 'radius'] + [
+            ('evaluations_path', evaluations_path)])
+
+
+def evaluate_scene(
+        image_path, points_path, counts_path, maximum_metric_radii,
+        probabilities_folder=None, match_one_to_one=False):
+    'Compare estimated and actual locations inside an image at each radius'
+    if not counts_path and not probabilities_folder:
+        raise ValueError('Specify counts_path or probabilities_folder')
     image = SatelliteImage(image_path)
     assert '+units=m' in image.proj4
     try:
-        old_locations = load_points(points_path, targetProj4=image.proj4)[1]
+        # Pick points within the image from the cached index
+        points_index = load_point_index(points_path, image.proj4)
+        old_locations = points_index.xys[np.sort(points_index.query_boxes(
+            get_projected_bounds(image))[1])]
     except GeometryError:
         logging.warn('could not load points_path=%s' % points_path)
         old_locations = []
-    try:
-        new_locations = load_points(counts_path, targetProj4=image.proj4)[1]
-    except GeometryError:
-        logging.warn('could not load counts_path=%s' % counts_path)
-        new_locations = []
+    if probabilities_folder:
+        new_locations = image.to_projected_xys(load_positive_pixel_centers(
+            probabilities_folder))
+    else:
+        try:
+            new_locations = load_projected_xys(counts_path, image.proj4)
+        except GeometryError:
+            logging.warn('could not load counts_path=%s' % counts_path)
+            new_locations = []
 
-    old_locations = select_projected_xys(old_locations, image)
     new_locations = select_projected_xys(new_locations, image)
+    return evaluate_locations(
+        old_locations, new_locations, maximum_metric_radii,
+        match_one_to_one)
 
-    old_location_count = len(old_locations)
-    new_location_count = len(new_locations)
-
-    true_positive_count = 0
-    false_positive_count = 0
-    false_negative_count = 0
-
-    if old_locations:
-        old_tree = KDTree(old_locations)
-        for new_location in new_locations:
-            old_indices = old_tree.query(
-                new_location, maximum_distance=maximum_metric_radius)[1]
-            if not len(old_indices):
-                false_positive_count += 1
-            else:
-                true_positive_count += 1
-
-    if new_locations:
-        new_tree = KDTree(new_locations)
-        for old_location in old_locations:
-            new_indices = new_tree.query(
-                old_location, maximum_distance=maximum_metric_radius)[1]
-            if not len(new_indices):
-                false_negative_count += 1
 
-    try:
-        precision = true_positive_count / float(new_location_count)
-    except ZeroDivisionError:
-        precision = np.inf
-    try:
-        recall = true_positive_count / float(old_location_count)
-    except ZeroDivisionError:
-        recall = np.inf
-    return OrderedDict([
-        ('actual_count', old_location_count),
-        ('estimated_count', new_location_count),
-        ('true_positive_count', true_positive_count),
-        ('false_positive_count', false_positive_count),
-        ('false_negative_count', false_negative_count),
-        ('precision', precision),
-        ('recall', recall),
-    ])
+def save_evaluations(target_path, rows):
+    table = DataFrame(rows, columns=rows[0].keys())
+    table = table.rename(columns={'radius': 'maximum_metric_radius'})
+    table.to_csv(target_path, index=False)
 
 
 def select_projected_xys(projected_xys, image):
-    # Define upper left and lower right pixel corners
-    pixel_xy1 = 0, 0
-    pixel_xy2 = image.pixel_dimensions
-    # Convert pixel corners into projected corners
-    x1, y1 = image.to_projected_xy(pixel_xy1)
-    x2, y2 = image.to_projected_xy(pixel_xy2)
-    # Sort coordinates into bounds
-    x1, x2 = sorted([x1, x2])
-    y1, y2 = sorted([y1, y2])
-    # Define filter
-    in_image = lambda (x, y): (
-        x1 <= x) and (x <= x2) and (
-        y1 <= y) and (y <= y2)
-    # Apply filter
-    return filter(in_image, projected_xys)
+    'Keep (N, 2) projected coordinates that lie within the image'
+    projected_xys = np.reshape(projected_xys, (-1, 2)).astype(np.float64)
+    x1, y1, x2, y2 = get_projected_bounds(image)
+    xs, ys = projected_xys.T
+    return projected_xys[(x1 <= xs) & (xs <= x2) & (y1 <= ys) & (ys <= y2)]
+
+
+def get_projected_bounds(image):
+    'Get (x1, y1, x2, y2) projected bounds of the image'
+    # Sort projected corners into bounds
+    return np.sort(image.to_projected_xys([
+        (0, 0), image.pixel_dimensions]), axis=0).ravel()
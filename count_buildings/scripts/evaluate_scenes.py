@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+from collections import OrderedDict
+from crosscompute.libraries import script
+from multiprocessing import Pool, cpu_count
+from pandas import DataFrame, isnull, read_csv
+
+from .evaluate_counts import EVALUATIONS_CSV, evaluate_scene
+from ..libraries.evaluation import sum_evaluations
+
+
+OVERALL_NAME = 'overall'
+
+
+def start(argv=sys.argv):
+    with script.Starter(run, argv) as starter:
+        starter.add_argument(
+            '--manifest_path', metavar='PATH', required=True,
+            help='table with columns scene_name, image_path, points_path '
+                 'and counts_path or probabilities_folder')
+        starter.add_argument(
+            '--maximum_metric_radius', metavar='METERS', required=True,
+            type=float, nargs='+',
+            help='summarize the first radius; tabulate every radius')
+        starter.add_argument(
+            '--match_one_to_one', action='store_true',
+            help='also count pairs where each point matches at most once')
+        starter.add_argument(
+            '--worker_count', metavar='INTEGER',
+            type=int,
+            help='number of processes that evaluate scenes')
+
+
+def run(
+        target_folder, manifest_path, maximum_metric_radius,
+        match_one_to_one=False, worker_count=None):
+    scenes = load_scenes(manifest_path)
+    worker_count = max(1, min(worker_count or cpu_count(), len(scenes)))
+    tasks = [(
+        scene_index, scene, maximum_metric_radius, match_one_to_one,
+    ) for scene_index, scene in enumerate(scenes)]
+    start_time = time.time()
+    pool = Pool(worker_count)
+    # Keep the order of the manifest
+    evaluations = [None] * len(scenes)
+    try:
+        for finished_count, (scene_index, rows, seconds, error) in enumerate(
+                pool.imap_unordered(evaluate_scene_in_worker, tasks), 1):
+            evaluations[scene_index] = rows, seconds, error
+            print '%s / %s scenes (%s %s in %.1f seconds)' % (
+                finished_count, len(scenes),
+                scenes[scene_index]['scene_name'],
+                'failed' if error else 'finished', seconds)
+        pool.close()
+    finally:
+        # Stop workers if we fail or are interrupted
+        pool.terminate()
+        pool.join()
+    elapsed_seconds = time.time() - start_time
+    # Pool counts over the scenes that we could evaluate
+    row_groups = [rows for rows, seconds, error in evaluations if not error]
+    overall_rows = sum_evaluations(row_groups) if row_groups else []
+    table_rows = []
+    scene_names = [x['scene_name'] for x in scenes] + [OVERALL_NAME]
+    for scene_name, (rows, seconds, error) in zip(
+            scene_names, evaluations + [(overall_rows, elapsed_seconds, '')]):
+        for row in rows or [OrderedDict()]:
+            table_rows.append(OrderedDict(
+                [('scene_name', scene_name)] + row.items() + [
+                    ('seconds', seconds), ('error', error)]))
+    evaluations_path = os.path.join(target_folder, EVALUATIONS_CSV)
+    table = DataFrame(table_rows, columns=max(
+        (x.keys() for x in table_rows), key=len))
+    table = table.rename(columns={'radius': 'maximum_metric_radius'})
+    table.to_csv(evaluations_path, index=False)
+    return OrderedDict(
+        [('scene_count', len(scenes)), ('failed_scene_count', len(
+            scenes) - len(row_groups))] + [
+            (k, v) for k, v in (overall_rows or [{}])[0].items()
+            if k != 'radius'] + [
+            ('elapsed_seconds', elapsed_seconds),
+            ('evaluations_path', evaluations_path)])
+
+
+def load_scenes(manifest_path):
+    'Read scenes from a table, resolving paths against its folder'
+    manifest_folder = os.path.dirname(os.path.abspath(manifest_path))
+    scenes = []
+    for scene_index, row in read_csv(manifest_path).iterrows():
+        scene = {}
+        for key in (
+                'image_path', 'points_path', 'counts_path',
+                'probabilities_folder'):
+            value = row.get(key)
+            scene[key] = None if value is None or isnull(
+                value) else os.path.join(
+                manifest_folder, os.path.expanduser(value))
+        scene_name = row.get('scene_name')
+        scene['scene_name'] = str(scene_index) if scene_name is None or \
+            isnull(scene_name) else str(scene_name)
+        scenes.append(scene)
+    if not scenes:
+        raise ValueError('Manifest has no scenes: %s' % manifest_path)
+    return scenes
+
+
+def evaluate_scene_in_worker((
+        scene_index, scene, maximum_metric_radii, match_one_to_one)):
+    start_time = time.time()
+    try:
+        rows = evaluate_scene(
+            scene['image_path'], scene['points_path'], scene['counts_path'],
+            maximum_metric_radii, scene['probabilities_folder'],
+            match_one_to_one)
+    except Exception as error:
+        # Record the failure so that one bad scene does not stop the rest
+        return scene_index, None, time.time() - start_time, '%s: %s' % (
+            error.__class__.__name__, error)
+    return scene_index, rows, time.time() - start_time, ''
@@ -56,7 +56,7 @@ def save_arrays(
     if not tile_indices:
         tile_indices = xrange(image_scope.tile_count)
     array_count = min(len(tile_indices), image_scope.tile_count)
-    arrays, pixel_centers, labels = get_target_pack(
+    arrays, pixel_centers, labels, array_tile_indices = get_target_pack(
         target_folder, image_scope, array_count)
     for array_index, tile_index in enumerate(tile_indices):
         if tile_index > maximum_tile_index:
@@ -70,6 +70,7 @@ def save_arrays(
         pixel_centers[array_index, :] = get_pixel_center_from_pixel_frame(
             pixel_frame)
         labels[array_index] = get_label(points_tree, pixel_frame)
+        array_tile_indices[array_index] = tile_index
     print('%s / %s' % (array_count - 1, array_count - 1))
     return dict(
         tile_pixel_dimensions=image_scope.tile_pixel_dimensions,
@@ -92,7 +93,10 @@ def get_target_pack(target_folder, image_scope, array_count):
     pixel_centers.attrs['proj4'] = image_scope.proj4
     labels = arrays_h5.create_dataset(
         'labels', shape=(array_count,), dtype=bool)
-    return arrays, pixel_centers, labels
+    tile_indices = arrays_h5.create_dataset(
+        'tile_indices', shape=(array_count,),
+        dtype=np.min_scalar_type(image_scope.tile_count))
+    return arrays, pixel_centers, labels, tile_indices
 
 
 def get_arrays_h5(target_folder):
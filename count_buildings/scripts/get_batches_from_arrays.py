@@ -4,7 +4,8 @@ from crosscompute.libraries import script
 
 from .get_arrays_from_image import ARRAYS_NAME
 from .get_batches_from_datasets import save_meta, save_data
-from ..libraries.dataset import BatchGroup
+from ..libraries.dataset import BATCH_FORMATS, BatchGroup
+from ..libraries.prefilter import Prefilter, summarize_pruning
 
 
 def start(argv=sys.argv):
@@ -20,17 +21,36 @@ def start(argv=sys.argv):
             '--array_shape', metavar='HEIGHT,WIDTH,BAND_COUNT',
             type=script.parse_numbers,
             help='')
+        starter.add_argument(
+            '--batch_format', metavar='FORMAT',
+            choices=BATCH_FORMATS, default=BATCH_FORMATS[0],
+            help='store uint8 arrays (npy) or float32 pickles (pickle)')
+        starter.add_argument(
+            '--preserve_order', action='store_true',
+            help='keep tiles in raster order without padding the last batch')
+        starter.add_argument(
+            '--prefilter_path', metavar='PATH',
+            help='skip tiles that this prefilter rejects')
 
 
 def run(
-        target_folder, arrays_folder, batch_size, array_shape):
+        target_folder, arrays_folder, batch_size, array_shape,
+        batch_format=BATCH_FORMATS[0], preserve_order=False,
+        prefilter_path=None):
     batch_group = BatchGroup(
-        ARRAYS_NAME, [arrays_folder], batch_size, array_shape)
+        ARRAYS_NAME, [arrays_folder], batch_size, array_shape,
+        preserve_order, Prefilter.load(
+            prefilter_path).select if prefilter_path else None)
     keys = batch_group.keys
-    save_meta(target_folder, batch_group, keys)
-    batch_count = save_data(target_folder, batch_group, keys, batch_size)
-    return dict(
+    save_meta(target_folder, batch_group, keys, batch_format, batch_size)
+    batch_count = save_data(
+        target_folder, batch_group, keys, batch_size, batch_format)
+    result = dict(
         array_count=batch_group.array_count,
         array_shape=batch_group.array_shape,
         batch_count=batch_count,
         positive_count=np.sum(batch_group.get_labels(keys)))
+    if prefilter_path:
+        result.update(summarize_pruning(
+            batch_group, batch_group.pruned_keys, keys))
+    return result
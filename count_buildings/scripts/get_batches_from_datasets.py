@@ -1,12 +1,15 @@
-import cPickle as pickle
 import numpy as np
 import os
 import sys
+import time
 from crosscompute.libraries import script
+from multiprocessing import Pool, Value, cpu_count
 
 from .get_dataset_from_examples import DATASET_NAME
-from ..libraries.dataset import BatchGroup
-from ..libraries.dataset import get_vector_from_array
+from ..libraries.dataset import BATCH_FORMATS, EXAMPLES_FORMAT, BatchGroup
+from ..libraries.dataset import extend_examples, prepare_examples
+from ..libraries.dataset import load_batch_meta, save_examples
+from ..libraries.dataset import save_batch, save_batch_meta
 
 
 def start(argv=sys.argv):
@@ -23,15 +26,51 @@ def start(argv=sys.argv):
             '--array_shape', metavar='HEIGHT,WIDTH,BAND_COUNT',
             type=script.parse_numbers,
             help='')
+        starter.add_argument(
+            '--batch_format', metavar='FORMAT',
+            choices=BATCH_FORMATS + (EXAMPLES_FORMAT,),
+            default=BATCH_FORMATS[0],
+            help='store uint8 arrays (npy), float32 pickles (pickle) '
+                 'or one store that providers reshuffle each epoch '
+                 '(examples)')
+        starter.add_argument(
+            '--worker_count', metavar='INTEGER',
+            type=int,
+            help='number of processes that build batches')
+        starter.add_argument(
+            '--append', action='store_true',
+            help='add batches for new dataset folders to existing batches')
 
 
 def run(
-        target_folder, dataset_folders, batch_size, array_shape=None):
+        target_folder, dataset_folders, batch_size, array_shape=None,
+        batch_format=BATCH_FORMATS[0], worker_count=None, append=False):
+    dataset_folders = [os.path.abspath(x) for x in dataset_folders]
+    batch_meta = {}
+    if append:
+        batch_meta = load_batch_meta(target_folder)
+        if 'array_sum' not in batch_meta:
+            raise ValueError('Cannot append to batches without array_sum')
+        # Keep the layout of existing batches and skip known folders
+        batch_size = batch_meta['batch_size']
+        array_shape = batch_meta['array_shape']
+        batch_format = batch_meta['batch_format']
+        dataset_folders = [
+            x for x in dataset_folders
+            if x not in batch_meta['dataset_folders']]
+        if not dataset_folders:
+            return dict(array_count=0, batch_count=0)
     batch_group = BatchGroup(
         DATASET_NAME, dataset_folders, batch_size, array_shape)
     keys = batch_group.keys
-    save_meta(target_folder, batch_group, keys)
-    batch_count = save_data(target_folder, batch_group, keys, batch_size)
+    batch_count = save_data(
+        target_folder, batch_group, keys, batch_size, batch_format,
+        worker_count, len(batch_meta.get('batch_sources', [])))
+    # Describe batches only after they exist so that a failed append
+    # leaves the previous meta in place
+    save_meta(
+        target_folder, batch_group, keys, batch_format, batch_size,
+        batch_meta)
     return dict(
         array_count=batch_group.array_count,
         array_shape=batch_group.array_shape,
@@ -39,39 +78,100 @@ def run(
         positive_count=np.sum(batch_group.get_labels(keys)))
 
 
-def save_meta(target_folder, batch_group, keys):
-    target_path = os.path.join(target_folder, 'batches.meta')
-    array_mean = batch_group.array_mean
+def save_meta(
+        target_folder, batch_group, keys, batch_format, batch_size=None,
+        batch_meta=None):
+    packs, pack_columns = batch_group.get_packs(keys)
+    array_sum = batch_group.array_sum
+    array_count = batch_group.array_sum_count
+    dataset_folders = batch_group.h5_folders
+    batch_sources = batch_group.get_batch_sources(keys)
+    if batch_meta:
+        # Update the mean from running sums instead of rereading arrays
+        if pack_columns != batch_meta['pack_columns']:
+            raise ValueError('Cannot append %s to batches with %s' % (
+                pack_columns, batch_meta['pack_columns']))
+        packs = np.concatenate([batch_meta['packs'], packs])
+        array_sum = batch_meta['array_sum'] + array_sum
+        array_count = batch_meta['array_count'] + array_count
+        dataset_folders = batch_meta['dataset_folders'] + dataset_folders
+        batch_sources = batch_meta['batch_sources'] + batch_sources
+    array_mean = array_sum / float(array_count) if array_count else array_sum
+    save_batch_meta(
+        target_folder, array_mean, packs, pack_columns, batch_format,
+        batch_size, array_sum=array_sum, array_count=array_count,
+        dataset_folders=dataset_folders, batch_sources=batch_sources)
 
-    vector_mean = get_vector_from_array(array_mean)
-    vector_size = vector_mean.size
 
-    transform_vector = lambda x: x.reshape(vector_size, 1).astype(np.single)
-    pickle.dump({
-        'data_mean': transform_vector(vector_mean),
-        'label_names': ['', 'building'],
-        'num_vis': vector_size,
-        'packs': map(tuple, batch_group.get_pixel_centers(keys)),
-        'pack_columns': ['pixel_center_x', 'pixel_center_y'],
-        'array_shape': array_mean.shape,
-    }, open(target_path, 'w'), protocol=-1)
+def save_data(
+        target_folder, batch_group, keys, batch_size, batch_format,
+        worker_count=None, first_batch_index=0):
+    batch_count = len(xrange(0, len(keys), batch_size))
+    worker_count = max(1, min(worker_count or cpu_count(), batch_count))
+    if batch_format == EXAMPLES_FORMAT and first_batch_index:
+        extend_examples(target_folder, len(keys))
+    elif batch_format == EXAMPLES_FORMAT:
+        prepare_examples(
+            target_folder, len(keys), np.prod(batch_group.array_shape),
+            batch_group.array_dtype)
+    # Give each worker a contiguous range of batch indices
+    tasks = []
+    for batch_indices in np.array_split(np.arange(batch_count), worker_count):
+        if not len(batch_indices):
+            continue
+        first_key_index = batch_indices[0] * batch_size
+        last_key_index = (batch_indices[-1] + 1) * batch_size
+        tasks.append((
+            target_folder, batch_group.h5_name, batch_group.h5_folders,
+            batch_group.array_shape, batch_size, batch_format,
+            first_batch_index + batch_indices[0],
+            keys[first_key_index:last_key_index]))
+    saved_batch_count = Value('i', 0)
+    pool = Pool(
+        worker_count, initializer=prepare_worker,
+        initargs=(saved_batch_count,))
+    result = pool.map_async(save_batches, tasks)
+    start_time = time.time()
+    while not result.ready():
+        result.wait(10)
+        print_progress(saved_batch_count.value, batch_count, start_time)
+    result.get()
+    pool.close()
+    pool.join()
+    return batch_count
+
 
+def prepare_worker(saved_batch_count):
+    global _saved_batch_count
+    _saved_batch_count = saved_batch_count
 
-def save_data(target_folder, batch_group, keys, batch_size):
+
+def save_batches((
+        target_folder, h5_name, h5_folders, array_shape, batch_size,
+        batch_format, first_batch_index, keys)):
+    # Open separate read-only h5 handles in each worker
+    batch_group = BatchGroup(h5_name, h5_folders, batch_size, array_shape)
     target_path_template = os.path.join(target_folder, 'data_batch_%d')
-    start_indices = xrange(0, len(keys), batch_size)
-    batch_index = 0
-    batch_count = len(start_indices)
-    for batch_index, start_index in enumerate(start_indices):
-        if batch_index % 10 == 0:
-            print '%s / %s' % (batch_index, batch_count - 1)
-        selected_keys = keys[start_index:start_index + batch_size]
+    for batch_offset, key_offset in enumerate(xrange(
+            0, len(keys), batch_size)):
+        batch_index = first_batch_index + batch_offset
+        start_index = batch_index * batch_size
+        selected_keys = keys[key_offset:key_offset + batch_size]
         data = batch_group.get_data(selected_keys)
         labels = batch_group.get_labels(selected_keys)
-        pickle.dump({
-            'ids': range(start_index, start_index + len(selected_keys)),
-            'data': data.astype(np.single),
-            'labels': [1 if x else 0 for x in labels],
-        }, open(target_path_template % batch_index, 'w'), protocol=-1)
-    print '%s / %s' % (batch_index, batch_count - 1)
-    return batch_count
+        if batch_format == EXAMPLES_FORMAT:
+            save_examples(target_folder, start_index, data, labels)
+        else:
+            save_batch(
+                target_path_template % batch_index, data, labels,
+                xrange(start_index, start_index + len(selected_keys)),
+                batch_format)
+        with _saved_batch_count.get_lock():
+            _saved_batch_count.value += 1
+
+
+def print_progress(saved_batch_count, batch_count, start_time):
+    elapsed_time = time.time() - start_time
+    print '%s / %s batches (%.2f batches per second)' % (
+        saved_batch_count, batch_count,
+        saved_batch_count / elapsed_time if elapsed_time else 0)
@@ -0,0 +1,112 @@
+import numpy as np
+import sys
+from crosscompute.libraries import script
+
+from ..libraries.dataset import BATCH_FORMATS, BatchWriter, save_batch_meta
+from ..libraries.prefilter import Prefilter
+from ..libraries.satellite_image import SatelliteImage, MetricScope
+from ..libraries.satellite_image import get_pixel_center_from_pixel_frame
+from ..libraries.transformations.resize import resize_arrays
+
+
+PACK_COLUMNS = ['pixel_center_x', 'pixel_center_y', 'tile_index']
+
+
+def start(argv=sys.argv):
+    with script.Starter(run, argv) as starter:
+        starter.add_argument(
+            '--image_path', metavar='PATH', required=True,
+            help='satellite image')
+        starter.add_argument(
+            '--tile_metric_dimensions', metavar='WIDTH,HEIGHT', required=True,
+            type=script.parse_dimensions,
+            help='dimensions of extracted tile in metric units')
+        starter.add_argument(
+            '--overlap_metric_dimensions', metavar='WIDTH,HEIGHT',
+            type=script.parse_dimensions, default=(0, 0),
+            help='dimensions of tile overlap in metric units')
+        starter.add_argument(
+            '--tile_indices', metavar='INTEGER',
+            type=script.parse_indices,
+            help='comma-separated indices and ranges')
+        starter.add_argument(
+            '--batch_size', metavar='SIZE', required=True,
+            type=script.parse_size,
+            help='maximum number of examples to include per batch')
+        starter.add_argument(
+            '--array_shape', metavar='HEIGHT,WIDTH,BAND_COUNT',
+            type=script.parse_numbers,
+            help='')
+        starter.add_argument(
+            '--batch_format', metavar='FORMAT',
+            choices=BATCH_FORMATS, default=BATCH_FORMATS[0],
+            help='store uint8 arrays (npy) or float32 pickles (pickle)')
+        starter.add_argument(
+            '--prefilter_path', metavar='PATH',
+            help='skip tiles that this prefilter rejects')
+
+
+def run(
+        target_folder, image_path,
+        tile_metric_dimensions, overlap_metric_dimensions, tile_indices,
+        batch_size, array_shape=None, batch_format=BATCH_FORMATS[0],
+        prefilter_path=None):
+    return save_batches(
+        target_folder, image_path,
+        tile_metric_dimensions, overlap_metric_dimensions, tile_indices,
+        batch_size, array_shape, batch_format, prefilter_path)
+
+
+def save_batches(
+        target_folder, image_path,
+        tile_metric_dimensions, overlap_metric_dimensions, tile_indices,
+        batch_size, array_shape, batch_format, prefilter_path=None):
+    image = SatelliteImage(image_path)
+    image_scope = MetricScope(
+        image, tile_metric_dimensions, overlap_metric_dimensions)
+    if not array_shape:
+        tile_pixel_width, tile_pixel_height = image_scope.tile_pixel_dimensions
+        array_shape = tile_pixel_height, tile_pixel_width, image.band_count
+    maximum_tile_index = image_scope.tile_count - 1
+    if not tile_indices:
+        tile_indices = xrange(image_scope.tile_count)
+    tile_count = min(len(tile_indices), image_scope.tile_count)
+    # Stream non-empty tiles straight into batches
+    batch_writer = BatchWriter(
+        target_folder, batch_size, array_shape, batch_format)
+    prefilter = Prefilter.load(prefilter_path) if prefilter_path else None
+    empty_count = 0
+    pruned_count = 0
+    for tile_offset, tile_index in enumerate(tile_indices):
+        if tile_index > maximum_tile_index:
+            break
+        if tile_offset % 1000 == 0:
+            print('%s / %s' % (tile_offset, tile_count - 1))
+        pixel_frame = image_scope.get_pixel_frame_from_tile_index(
+            tile_index)
+        array = image_scope.get_array_from_pixel_frame(pixel_frame)
+        if array.max() == 0:
+            empty_count += 1
+            continue
+        if array.ndim == 2:
+            array = array[:, :, np.newaxis]
+        if prefilter and not prefilter.select(resize_arrays(
+                array[np.newaxis], array_shape))[0]:
+            pruned_count += 1
+            continue
+        pixel_x, pixel_y = get_pixel_center_from_pixel_frame(pixel_frame)
+        batch_writer.add(array, False, (pixel_x, pixel_y, tile_index))
+    batch_writer.flush()
+    print('%s / %s' % (tile_count - 1, tile_count - 1))
+    save_batch_meta(
+        target_folder, batch_writer.array_mean,
+        np.array(batch_writer.packs, dtype=np.int64).reshape(-1, 3),
+        PACK_COLUMNS, batch_format, batch_size)
+    return dict(
+        tile_pixel_dimensions=image_scope.tile_pixel_dimensions,
+        overlap_pixel_dimensions=image_scope.overlap_pixel_dimensions,
+        array_count=batch_writer.array_count,
+        array_shape=batch_writer.array_shape,
+        batch_count=batch_writer.batch_count,
+        empty_count=empty_count,
+        pruned_count=pruned_count)
@@ -1,17 +1,22 @@
-import geometryIO
 import numpy as np
 import os
 import sys
-from count_buildings.libraries.kdtree import KDTree
-from count_buildings.libraries.satellite_image import SatelliteImage
+from count_buildings.libraries.points import (
+    POINTS_FORMATS, load_projected_xys, save_points)
+from count_buildings.libraries.probabilities import (
+    GRID_NULL_VALUE, get_peak_pixel_centers, get_probability_grid,
+    load_probabilities)
+from count_buildings.libraries.satellite_image import (
+    MetricScope, SatelliteImage, save_geoimage)
+from count_buildings.libraries.spatial_index import SpatialIndex
 from crosscompute.libraries import script
-from geometryIO import get_transformPoint
-from pandas import read_csv
+from pandas import DataFrame
 
 
-COUNTS_SHP = 'counts.shp'
-PROBABILITIES_CSV = 'probabilities.csv'
-PROBABILITIES_SHP = 'probabilities.shp'
+COUNTS_NAME = 'counts'
+PROBABILITIES_NAME = 'probabilities'
+PROBABILITIES_TIF = 'probabilities.tif'
+PEAK_THRESHOLD = 0.5
 
 
 def start(argv=sys.argv):
@@ -41,23 +46,62 @@ def start(argv=sys.argv):
             '--maximum_metric_radius', metavar='METERS',
             type=float,
             help='')
+        starter.add_argument(
+            '--peak_metric_radius', metavar='METERS',
+            type=float,
+            help='count tiles that beat every tile within this radius')
+        starter.add_argument(
+            '--peak_threshold', metavar='PROBABILITY',
+            type=float, default=PEAK_THRESHOLD,
+            help='minimum probability of a peak')
+        starter.add_argument(
+            '--tile_metric_dimensions', metavar='WIDTH,HEIGHT',
+            type=script.parse_dimensions,
+            help='dimensions of scanned tile, if not inferred from centers')
+        starter.add_argument(
+            '--overlap_metric_dimensions', metavar='WIDTH,HEIGHT',
+            type=script.parse_dimensions, default=(0, 0),
+            help='dimensions of tile overlap in metric units')
+        starter.add_argument(
+            '--save_heatmap', action='store_true',
+            help='save probabilities as a GeoTIFF aligned with the image')
+        starter.add_argument(
+            '--points_format', metavar='FORMAT',
+            choices=POINTS_FORMATS, default=POINTS_FORMATS[0],
+            help='save points as GeoPackage (gpkg) or FlatGeobuf (fgb)')
 
 
 def run(
         target_folder, probabilities_folder,
         image_path, points_path, actual_count, actual_metric_radius,
-        minimum_metric_radius, maximum_metric_radius):
+        minimum_metric_radius, maximum_metric_radius,
+        peak_metric_radius=None, peak_threshold=PEAK_THRESHOLD,
+        tile_metric_dimensions=None, overlap_metric_dimensions=(0, 0),
+        points_format=POINTS_FORMATS[0], save_heatmap=False):
     value_by_key = {}
-    probability_packs = get_probability_packs(probabilities_folder)
+    probabilities = load_probabilities(probabilities_folder)
+    probability_packs = get_probability_packs(probabilities)
     image = SatelliteImage(image_path)
-    if not points_path and not actual_count and not actual_metric_radius:
+    # Save the heatmap whenever we grid the probabilities, which peak
+    # counting needs and which scanned tile dimensions make unambiguous
+    if save_heatmap or tile_metric_dimensions or \
+            peak_metric_radius is not None:
+        probability_grid = get_probability_grid(probabilities, MetricScope(
+            image, tile_metric_dimensions, overlap_metric_dimensions,
+        ).interval_pixel_dimensions if tile_metric_dimensions else None)
+        save_probability_grid(os.path.join(
+            target_folder, PROBABILITIES_TIF), probability_grid, image)
+    if not points_path and not actual_count and not actual_metric_radius \
+            and peak_metric_radius is None:
         pixel_centers = probability_packs[[
             'pixel_center_x', 'pixel_center_y']].values
-        target_path = os.path.join(target_folder, PROBABILITIES_SHP)
-        save_pixel_centers(target_path, pixel_centers, image)
+        target_path = os.path.join(target_folder, '%s.%s' % (
+            PROBABILITIES_NAME, points_format))
+        save_pixel_centers(
+            target_path, pixel_centers, image, probability_packs['1'].values)
         return dict(probability_count=len(pixel_centers))
     elif points_path:
-        pixel_bounds = get_pixel_bounds(probabilities_folder)
+        pixel_bounds = get_pixel_bounds(probabilities)
         actual_count = get_actual_count(image, points_path, pixel_bounds)
         value_by_key['pixel_bounds'] = pixel_bounds
 
@@ -66,7 +110,16 @@ def run(
     to_metric_radius = lambda pixel_radius: min(image.to_metric_dimensions((
         pixel_radius, pixel_radius)))
 
-    if actual_metric_radius is not None:
+    selected_probabilities = None
+    if peak_metric_radius is not None:
+        selected_pixel_radius = to_pixel_radius(peak_metric_radius)
+        selected_pixel_centers = get_peak_pixel_centers(*(
+            probability_grid + (selected_pixel_radius, peak_threshold)))
+        selected_probabilities = get_grid_values(
+            probability_grid, selected_pixel_centers)
+        value_by_key['selected_metric_radius'] = to_metric_radius(
+            selected_pixel_radius)
+    elif actual_metric_radius is not None:
         selected_pixel_radius = to_pixel_radius(actual_metric_radius)
         selected_pixel_centers = get_selected_pixel_centers(
             probability_packs, selected_pixel_radius)
@@ -84,8 +137,10 @@ def run(
             min(best_pixel_radiuses))
         value_by_key['maximum_best_metric_radius'] = to_metric_radius(
             max(best_pixel_radiuses))
-    target_path = os.path.join(target_folder, COUNTS_SHP)
-    save_pixel_centers(target_path, selected_pixel_centers, image)
+    target_path = os.path.join(target_folder, '%s.%s' % (
+        COUNTS_NAME, points_format))
+    save_pixel_centers(
+        target_path, selected_pixel_centers, image, selected_probabilities)
     estimated_count = len(selected_pixel_centers)
 
     if actual_count is not None:
@@ -99,27 +154,36 @@ def run(
         **value_by_key)
 
 
-def get_probability_packs(probabilities_folder):
-    probabilities_path = os.path.join(probabilities_folder, PROBABILITIES_CSV)
-    probabilities_table = read_csv(probabilities_path)
-    predictions = probabilities_table[
-        probabilities_table['1'] > probabilities_table['0']]
-    return predictions[['1', 'pixel_center_x', 'pixel_center_y']]
+def get_probability_packs(probabilities):
+    is_positive = probabilities['1'] > probabilities['0']
+    return DataFrame(dict((x, probabilities[x][is_positive]) for x in [
+        '1', 'pixel_center_x', 'pixel_center_y']))
 
 
-def get_pixel_bounds(probabilities_folder):
-    probabilities_path = os.path.join(probabilities_folder, PROBABILITIES_CSV)
-    probabilities_table = read_csv(probabilities_path)
-    xys = probabilities_table[['pixel_center_x', 'pixel_center_y']]
-    return [
-        min(xys.pixel_center_x), min(xys.pixel_center_y),
-        max(xys.pixel_center_x), max(xys.pixel_center_y)]
+def get_pixel_bounds(probabilities):
+    xs = probabilities['pixel_center_x']
+    ys = probabilities['pixel_center_y']
+    return [xs.min(), ys.min(), xs.max(), ys.max()]
+
+
+def save_probability_grid(target_path, (
+        grid, pixel_origin, pixel_interval), image):
+    'Save grid cells as pixels of a GeoTIFF that lines up with the image'
+    if not grid.size:
+        return
+    g0, g1, g2, g3, g4, g5 = image.calibration_pack
+    # Let each cell span half an interval on either side of its tile center
+    pixel_x, pixel_y = pixel_origin - pixel_interval / 2.
+    interval_x, interval_y = pixel_interval
+    save_geoimage(target_path, grid, (
+        g0 + pixel_x * g1 + pixel_y * g2, g1 * interval_x, g2 * interval_y,
+        g3 + pixel_x * g4 + pixel_y * g5, g4 * interval_x, g5 * interval_y,
+    ), image.proj4, GRID_NULL_VALUE)
 
 
 def get_actual_count(image, points_path, pixel_bounds):
-    points_proj4, xys = geometryIO.load_points(points_path)[:2]
-    transform_point = get_transformPoint(points_proj4, image.proj4)
-    pixel_xys = [image.to_pixel_xy(transform_point(*_)) for _ in xys]
+    xys = load_projected_xys(points_path, image.proj4)
+    pixel_xys = [image.to_pixel_xy(_) for _ in xys]
     min_pixel_x, min_pixel_y, max_pixel_x, max_pixel_y = pixel_bounds
     included_pixel_xys = set()
     for pixel_x, pixel_y in pixel_xys:
@@ -131,21 +195,31 @@ def get_actual_count(image, points_path, pixel_bounds):
     return len(included_pixel_xys)
 
 
-def save_pixel_centers(target_path, pixel_centers, image):
-    projected_centers = [image.to_projected_xy(_) for _ in pixel_centers]
-    geometryIO.save_points(target_path, image.proj4, projected_centers)
+def get_grid_values((grid, pixel_origin, pixel_interval), pixel_centers):
+    grid_xs, grid_ys = np.transpose((
+        np.reshape(pixel_centers, (-1, 2)) - pixel_origin) // pixel_interval)
+    return grid[grid_ys, grid_xs]
+
+
+def save_pixel_centers(target_path, pixel_centers, image, probabilities=None):
+    save_points(
+        target_path, image.proj4, image.to_projected_xys(pixel_centers),
+        None if probabilities is None else {'probability': probabilities})
 
 
 def determine_pixel_radius(
         probability_packs, actual_count,
         minimum_pixel_radius, maximum_pixel_radius):
+    hotspot_selector = HotspotSelector(
+        probability_packs[['pixel_center_x', 'pixel_center_y']].values,
+        probability_packs['1'].values, maximum_pixel_radius)
     best_margin = np.inf
     best_pixel_centers = []
     best_pixel_radiuses = []
     pixel_radius = minimum_pixel_radius
     while True:
-        selected_pixel_centers = get_selected_pixel_centers(
-            probability_packs, pixel_radius)
+        selected_pixel_centers = hotspot_selector.get_pixel_centers(
+            pixel_radius)
         actual_margin = len(selected_pixel_centers) - actual_count
         print 'pixel_radius >= %s\tactual_margin = %s' % (
             pixel_radius, actual_margin)
@@ -164,36 +238,78 @@ def determine_pixel_radius(
     return best_pixel_radiuses, best_pixel_centers
 
 
+class HotspotSelector(object):
+    'Select hotspots at several radii from one neighbor graph'
+
+    def __init__(self, xys, metrics, maximum_radius=np.inf):
+        self.xys = xys
+        self.metrics = metrics
+        self.maximum_radius = maximum_radius
+        self.graph_radius = 0
+        self.neighbor_graph = None
+        self.sorted_distances = None
+        self.pixel_centers_by_pair_count = {}
+
+    def get_pixel_centers(self, radius):
+        if radius > self.graph_radius:
+            # Grow the graph geometrically if there is no maximum radius
+            self.graph_radius = max(radius, self.maximum_radius if np.isfinite(
+                self.maximum_radius) else 2 * self.graph_radius)
+            self.neighbor_graph = get_neighbor_graph(
+                self.xys, self.graph_radius)
+            self.sorted_distances = np.sort(self.neighbor_graph[2])
+        # Radii that keep the same pairs of neighbors select the same
+        # hotspots, so most steps of the walk need no selection pass
+        pair_count = np.searchsorted(self.sorted_distances, radius)
+        try:
+            return self.pixel_centers_by_pair_count[pair_count]
+        except KeyError:
+            pass
+        pixel_centers = list(yield_hotspot_via_metric(
+            self.xys, radius, self.metrics, self.neighbor_graph))
+        self.pixel_centers_by_pair_count[pair_count] = pixel_centers
+        return pixel_centers
+
+
 def get_selected_pixel_centers(probability_packs, actual_metric_radius):
     xys = probability_packs[['pixel_center_x', 'pixel_center_y']].values
     return list(yield_hotspot_via_metric(
         xys, radius=actual_metric_radius,
-        get_metric=lambda index: probability_packs['1'].values[index]))
-
-
-def yield_hotspot_via_metric(xys, radius, get_metric):
-    pending_indices = np.arange(len(xys))
-    while len(pending_indices):
-        pending_xys = xys[pending_indices]
-        pending_tree = KDTree(pending_xys)
-        best_metric, best_hotspot_xy, best_indices = -np.inf, None, []
-        for pending_index in pending_indices:
-            # Get metric
-            metric = get_metric(pending_index)
-            if metric < best_metric:
-                continue
-            xy = xys[pending_index]
-            # Get events within radius
-            selected_distances, selected_indices = pending_tree.query(
-                xy, maximum_distance=radius)
-            selected_xys = pending_xys[selected_indices]
-            selected_metrics = [
-                get_metric(x) for x in pending_indices[selected_indices]]
-            # Save
-            best_metric = metric
-            best_hotspot_xy = np.average(
-                selected_xys, axis=0, weights=selected_metrics)
-            best_indices = pending_indices[selected_indices]
-        yield best_hotspot_xy
-        pending_indices = np.array(list(
-            set(pending_indices) - set(best_indices)))
+        metrics=probability_packs['1'].values))
+
+
+def yield_hotspot_via_metric(xys, radius, metrics, neighbor_graph=None):
+    'Yield metric-weighted centers of pending points near each best point'
+    xys = np.asarray(xys)
+    metrics = np.asarray(metrics, dtype=float)
+    if not len(xys):
+        return
+    if neighbor_graph is None:
+        neighbor_graph = get_neighbor_graph(xys, radius)
+    offsets, neighbor_indices, distances = neighbor_graph
+    is_near = distances < radius
+    hotspot_indices = np.full(len(xys), -1, dtype=np.int64)
+    hotspot_count = 0
+    # Visit points by decreasing metric and let later rows win ties
+    for index in np.lexsort((-np.arange(len(xys)), -metrics)):
+        if hotspot_indices[index] >= 0:
+            continue
+        neighbor_slice = slice(offsets[index], offsets[index + 1])
+        selected_indices = neighbor_indices[neighbor_slice][
+            is_near[neighbor_slice]]
+        selected_indices = selected_indices[
+            hotspot_indices[selected_indices] < 0]
+        hotspot_indices[selected_indices] = hotspot_count
+        hotspot_indices[index] = hotspot_count
+        hotspot_count += 1
+    # Average the points of every hotspot at once
+    weight_sums = np.bincount(hotspot_indices, metrics, hotspot_count)
+    for hotspot_xy in np.column_stack([np.bincount(
+            hotspot_indices, metrics * xys[:, x], hotspot_count)
+            for x in xrange(2)]) / weight_sums[:, np.newaxis]:
+        yield hotspot_xy
+
+
+def get_neighbor_graph(xys, radius):
+    'Get (OFFSETS, INDICES, DISTANCES) of points within radius'
+    return SpatialIndex(xys).query_radius(xys, radius)
@@ -3,17 +3,18 @@ import numpy as np
 import operator
 import sys
 from crosscompute.libraries import script
-from geometryIO import get_transformPoint, load_points
 from invisibleroads_macros.calculator import round_number
 from os.path import join
 
 from ..libraries import disk
+from ..libraries.points import load_projected_xys
 from ..libraries.satellite_image import (
     SatelliteImage, MetricScope, render_array)
-from ..libraries.tree import RTree
+from ..libraries.spatial_index import SpatialIndex
 
 
 EXAMPLES_NAME = 'examples.h5'
+RANDOM_BATCH_SIZE = 1000
 
 
 def start(argv=sys.argv):
@@ -94,11 +95,9 @@ def get_pixel_centers(points_paths, image_scope):
         return []
     pixel_centers = []
     for points_path in points_paths:
-        points_proj4, projected_centers = load_points(points_path)[:2]
-        transform_point = get_transformPoint(points_proj4, image_scope.proj4)
+        projected_xys = load_projected_xys(points_path, image_scope.proj4)
         pixel_centers.extend(filter(image_scope.is_pixel_center, (
-            image_scope.to_pixel_xy(transform_point(
-                *_)) for _ in projected_centers)))
+            image_scope.to_pixel_xy(_) for _ in projected_xys)))
     return pixel_centers
 
 
@@ -193,12 +192,14 @@ def yield_negative_pixel_center(
         image_scope, negative_pixel_centers, positive_pixel_centers):
     for pixel_center in negative_pixel_centers:
         yield pixel_center
-    point_rtree = RTree(positive_pixel_centers)
+    point_index = SpatialIndex(positive_pixel_centers)
     while True:
-        pixel_center = image_scope.get_random_pixel_center()
+        pixel_centers = np.array([
+            image_scope.get_random_pixel_center()
+            for x in xrange(RANDOM_BATCH_SIZE)])
         # Retry if the pixel_frame contains a positive_pixel_center
-        pixel_bounds = image_scope.get_pixel_bounds_from_pixel_center(
-            pixel_center)
-        if point_rtree.intersects(pixel_bounds):
-            continue
-        yield pixel_center
+        offsets = point_index.query_boxes([
+            image_scope.get_pixel_bounds_from_pixel_center(x)
+            for x in pixel_centers])[0]
+        for pixel_center in pixel_centers[np.diff(offsets) == 0]:
+            yield pixel_center
@@ -0,0 +1,65 @@
+import numpy as np
+import os
+import sys
+from crosscompute.libraries import script
+
+from .get_dataset_from_examples import DATASET_NAME
+from ..libraries.dataset import ARRAY_CHUNK_SIZE, BatchGroup
+from ..libraries.prefilter import PREFILTER_NAME, Prefilter, get_features
+
+
+TARGET_RECALL = 0.99
+VALIDATION_FRACTION = 0.2
+
+
+def start(argv=sys.argv):
+    with script.Starter(run, argv) as starter:
+        starter.add_argument(
+            '--dataset_folders', metavar='FOLDER', required=True,
+            nargs='+',
+            help='selections of positive and negative examples')
+        starter.add_argument(
+            '--array_shape', metavar='HEIGHT,WIDTH,BAND_COUNT',
+            type=script.parse_numbers,
+            help='shape of the arrays that will be batched')
+        starter.add_argument(
+            '--target_recall', metavar='FRACTION',
+            type=float, default=TARGET_RECALL,
+            help='fraction of positive examples to keep')
+        starter.add_argument(
+            '--validation_fraction', metavar='FRACTION',
+            type=float, default=VALIDATION_FRACTION,
+            help='fraction of examples to hold out for measuring recall')
+
+
+def run(
+        target_folder, dataset_folders, array_shape=None,
+        target_recall=TARGET_RECALL, validation_fraction=VALIDATION_FRACTION):
+    batch_group = BatchGroup(
+        DATASET_NAME, dataset_folders, ARRAY_CHUNK_SIZE, array_shape,
+        preserve_order=True)
+    keys = batch_group.keys
+    features = np.concatenate([get_features(batch_group.get_arrays(
+        keys[x:x + ARRAY_CHUNK_SIZE])) for x in xrange(
+        0, len(keys), ARRAY_CHUNK_SIZE)])
+    labels = batch_group.get_labels(keys).astype(bool)
+    is_validation = np.random.RandomState(0).rand(
+        len(keys)) < validation_fraction
+    prefilter = Prefilter.fit(
+        features[~is_validation], labels[~is_validation], target_recall)
+    prefilter_path = os.path.join(target_folder, PREFILTER_NAME)
+    prefilter.save(prefilter_path)
+    # Measure on held-out examples, which are as balanced as the datasets,
+    # so whole scenes with mostly empty tiles will see more pruning
+    is_selected = prefilter.get_scores(
+        features[is_validation]) >= prefilter.threshold
+    validation_labels = labels[is_validation]
+    validation_recall = is_selected[validation_labels].mean() if np.any(
+        validation_labels) else None
+    return dict(
+        prefilter_path=prefilter_path,
+        array_shape=batch_group.array_shape,
+        training_count=int((~is_validation).sum()),
+        validation_count=int(is_validation.sum()),
+        validation_recall=validation_recall,
+        validation_pruned_fraction=1 - is_selected.mean())
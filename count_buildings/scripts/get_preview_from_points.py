@@ -2,16 +2,25 @@ import numpy as np
 import rtree.index
 import sys
 from crosscompute.libraries import script
-from functools import partial
-from geometryIO import load_points
 from os.path import basename, join
-from random import sample
 from scipy.stats import entropy
 from skimage.draw import circle, circle_perimeter
 
+from ..libraries.points import load_projected_xys
+from ..libraries.probabilities import load_positive_pixel_centers
 from ..libraries.satellite_image import (
-    SatelliteImage, PixelScope, get_pixel_frame_from_pixel_center,
-    enhance_array, render_enhanced_array, render_array)
+    SatelliteImage, PixelScope, enhance_array, render_enhanced_array,
+    render_array)
+
+
+BIN_PIXEL_LENGTH = 10
+SPOT_PIXEL_RADIUS = 3
+# Stamp a yellow disk and then a black ring around each point
+SPOT_DISK = circle(0, 0, SPOT_PIXEL_RADIUS)
+SPOT_RING = circle_perimeter(0, 0, SPOT_PIXEL_RADIUS, method='andres')
+SPOT_ROW_OFFSETS, SPOT_COLUMN_OFFSETS = np.concatenate([
+    SPOT_DISK, SPOT_RING], axis=1)
+SPOT_COLOR_INDICES = np.repeat([0, 1], [len(SPOT_DISK[0]), len(SPOT_RING[0])])
 
 
 def start(argv=sys.argv):
@@ -22,6 +31,9 @@ def start(argv=sys.argv):
         starter.add_argument(
             '--points_path', metavar='PATH',
             help='building locations')
+        starter.add_argument(
+            '--probabilities_folder', metavar='FOLDER',
+            help='mark centers of positive tiles instead of points')
         starter.add_argument(
             '--tile_pixel_dimensions', metavar='WIDTH,HEIGHT',
             type=script.parse_integer_dimensions, default=(500, 500),
@@ -30,42 +42,60 @@ def start(argv=sys.argv):
             '--random_iteration_count', metavar='INTEGER',
             type=int, default=25,
             help='')
+        starter.add_argument(
+            '--preview_count', metavar='INTEGER',
+            type=int, default=1,
+            help='number of previews that do not overlap')
+        starter.add_argument(
+            '--bin_pixel_length', metavar='INTEGER',
+            type=int, default=BIN_PIXEL_LENGTH,
+            help='pixel length of cells that count points near each other')
 
 
 def run(
         target_folder, image_path, points_path, tile_pixel_dimensions,
-        random_iteration_count):
+        random_iteration_count, probabilities_folder=None, preview_count=1,
+        bin_pixel_length=BIN_PIXEL_LENGTH):
     image = SatelliteImage(image_path)
-    if points_path:
-        projected_xys = load_points(points_path, targetProj4=image.proj4)[1]
+    if probabilities_folder:
+        pixel_xys = load_positive_pixel_centers(probabilities_folder)
+    elif points_path:
+        projected_xys = load_projected_xys(points_path, image.proj4)
         pixel_xys = [image.to_pixel_xy(_) for _ in projected_xys]
     else:
         pixel_xys = []
 
-    if pixel_xys:
+    if len(pixel_xys):
         image_pixel_frame = (0, 0), image.pixel_dimensions
-        image_pixel_xys = filter(get_in_frame(image_pixel_frame), pixel_xys)
-
-        selected_pixel_frame = get_pixel_frame(
-            tile_pixel_dimensions, image_pixel_xys, image,
-            random_iteration_count)
-        selected_pixel_xys = filter(
-            get_in_frame(selected_pixel_frame), image_pixel_xys)
+        image_pixel_xys = select_pixel_xys(pixel_xys, image_pixel_frame)
 
-        pixel_x, pixel_y = selected_pixel_frame[0]
-        relate = lambda (x, y): (x - pixel_x, y - pixel_y)
-        relative_pixel_xys = [relate(_) for _ in selected_pixel_xys]
+        selected_pixel_frames = get_dense_pixel_frames(
+            image_pixel_xys, tile_pixel_dimensions, image.pixel_dimensions,
+            preview_count, bin_pixel_length)
+        preview_image_names = []
+        selected_point_counts = []
+        for selected_pixel_frame in selected_pixel_frames:
+            selected_pixel_xys = select_pixel_xys(
+                image_pixel_xys, selected_pixel_frame)
+            pixel_x, pixel_y = selected_pixel_frame[0]
+            relative_pixel_xys = selected_pixel_xys - (pixel_x, pixel_y)
 
-        array = image.get_array_from_pixel_frame(selected_pixel_frame)
-        enhanced_array = enhance_array(array)
-        painted_array = paint_spots(enhanced_array, relative_pixel_xys)
+            array = image.get_array_from_pixel_frame(selected_pixel_frame)
+            enhanced_array = enhance_array(array)
+            painted_array = paint_spots(enhanced_array, relative_pixel_xys)
 
-        target_path = join(target_folder, 'pul%dx%d.jpg' % (pixel_x, pixel_y))
-        render_enhanced_array(target_path, painted_array)
+            target_path = join(
+                target_folder, 'pul%dx%d.jpg' % (pixel_x, pixel_y))
+            render_enhanced_array(target_path, painted_array)
+            preview_image_names.append(basename(target_path))
+            selected_point_counts.append(len(relative_pixel_xys))
+        selected_pixel_frame = selected_pixel_frames[0]
         return {
             'selected_pixel_upper_left': selected_pixel_frame[0],
             'selected_pixel_dimensions': selected_pixel_frame[1],
-            'selected_point_count': len(relative_pixel_xys),
+            'selected_point_count': selected_point_counts[0],
+            'preview_image_names': preview_image_names,
+            'selected_point_counts': selected_point_counts,
         }
     else:
         image_pixel_dimensions = image.pixel_dimensions
@@ -112,81 +142,95 @@ def run(
         }
 
 
-def get_in_frame(pixel_frame):
+def select_pixel_xys(pixel_xys, pixel_frame):
+    'Get (N, 2) pixel coordinates inside a frame, including its far edges'
+    pixel_xys = np.reshape(pixel_xys, (-1, 2))
     (x1, y1), (pixel_width, pixel_height) = pixel_frame
     x2, y2 = x1 + pixel_width, y1 + pixel_height
-    return lambda (x, y): (x1 <= x) and (x <= x2) and (y1 <= y) and (y <= y2)
-
-
-def get_pixel_frame(
-        target_pixel_dimensions, source_pixel_xys, source_image,
-        random_iteration_count):
-    # Fit pixel_dimensions to source_image.pixel_dimensions
-    target_pixel_width, target_pixel_height = target_pixel_dimensions
-    source_pixel_width, source_pixel_height = source_image.pixel_dimensions
-    pixel_width = min(target_pixel_width, source_pixel_width)
-    pixel_height = min(target_pixel_height, source_pixel_height)
-    pixel_dimensions = pixel_width, pixel_height
-    # Get pixel_frames
-    if len(source_pixel_xys) > random_iteration_count:
-        pixel_xys = sample(source_pixel_xys, random_iteration_count)
-    else:
-        pixel_xys = source_pixel_xys
-    pixel_frames = get_pixel_frames(pixel_xys, pixel_dimensions, source_image)
-    # Pick the pixel_frame with the most number of source_pixel_xys
-    rank_pixel_frame = partial(count_pixel_xys_in_frame, source_pixel_xys)
-    return max(pixel_frames, key=rank_pixel_frame)
+    xs, ys = pixel_xys.T
+    return pixel_xys[(x1 <= xs) & (xs <= x2) & (y1 <= ys) & (ys <= y2)]
+
+
+def get_dense_pixel_frames(
+        pixel_xys, target_pixel_dimensions, image_pixel_dimensions,
+        frame_count=1, bin_pixel_length=BIN_PIXEL_LENGTH):
+    'Get frames that hold the most points without overlapping each other'
+    image_pixel_width, image_pixel_height = image_pixel_dimensions
+    pixel_width = min(target_pixel_dimensions[0], image_pixel_width)
+    pixel_height = min(target_pixel_dimensions[1], image_pixel_height)
+    window_sums = get_window_sums(
+        pixel_xys, (pixel_width, pixel_height), image_pixel_dimensions,
+        bin_pixel_length)
+    # Count the bins that a frame touches, even partly
+    bin_width = max(1, -(-pixel_width // bin_pixel_length))
+    bin_height = max(1, -(-pixel_height // bin_pixel_length))
+    pixel_frames = []
+    for frame_index in xrange(frame_count):
+        if not window_sums.size or window_sums.max() < 0:
+            break
+        bin_y, bin_x = np.unravel_index(
+            window_sums.argmax(), window_sums.shape)
+        pixel_frames.append((
+            (bin_x * bin_pixel_length, bin_y * bin_pixel_length),
+            (pixel_width, pixel_height)))
+        # Rule out windows that would overlap this one
+        window_sums[
+            max(0, bin_y - bin_height + 1):bin_y + bin_height,
+            max(0, bin_x - bin_width + 1):bin_x + bin_width] = -1
+    return pixel_frames
+
+
+def get_window_sums(
+        pixel_xys, window_pixel_dimensions, image_pixel_dimensions,
+        bin_pixel_length):
+    'Count points in windows that start on bins, using a summed-area table'
+    image_pixel_width, image_pixel_height = image_pixel_dimensions
+    window_pixel_width, window_pixel_height = window_pixel_dimensions
+    column_count = -(-image_pixel_width // bin_pixel_length)
+    row_count = -(-image_pixel_height // bin_pixel_length)
+    bin_xs, bin_ys = np.transpose(np.reshape(
+        pixel_xys, (-1, 2)).astype(np.int64) // bin_pixel_length)
+    # Count points on the far edges of the image in the last bins
+    bin_xs = np.clip(bin_xs, 0, column_count - 1)
+    bin_ys = np.clip(bin_ys, 0, row_count - 1)
+    sums = np.zeros((row_count + 1, column_count + 1), dtype=np.int64)
+    sums[1:, 1:] = np.bincount(
+        bin_ys * column_count + bin_xs, minlength=row_count * column_count,
+    ).reshape((row_count, column_count)).cumsum(axis=0).cumsum(axis=1)
+    # Use whole bins inside the window and keep windows inside the image
+    bin_width = max(1, window_pixel_width // bin_pixel_length)
+    bin_height = max(1, window_pixel_height // bin_pixel_length)
+    last_x = (image_pixel_width - window_pixel_width) // bin_pixel_length
+    last_y = (image_pixel_height - window_pixel_height) // bin_pixel_length
+    y1, x1 = np.ogrid[:last_y + 1, :last_x + 1]
+    y2, x2 = y1 + bin_height, x1 + bin_width
+    return sums[y2, x2] - sums[y1, x2] - sums[y2, x1] + sums[y1, x1]
 
 
 def paint_spots(target_array, pixel_xys):
     target_array = np.copy(target_array)
     yellow = target_array[:, :, 0].max(), target_array[:, :, 1].max(), 0
     black = 0, 0, 0
-    for pixel_x, pixel_y in pixel_xys:
-        paint_array(target_array, circle(
-            pixel_y, pixel_x, 3), yellow)
-        paint_array(target_array, circle_perimeter(
-            pixel_y, pixel_x, 3, method='andres'), black)
+    colors = np.array([yellow, black], dtype=target_array.dtype)
+    pixel_xys = np.reshape(pixel_xys, (-1, 2)).astype(np.int64)
+    rows = (pixel_xys[:, 1:] + SPOT_ROW_OFFSETS).ravel()
+    columns = (pixel_xys[:, :1] + SPOT_COLUMN_OFFSETS).ravel()
+    color_indices = np.tile(SPOT_COLOR_INDICES, len(pixel_xys))
+    row_count, column_count = target_array.shape[:2]
+    is_inside = (rows >= 0) & (rows < row_count) & (
+        columns >= 0) & (columns < column_count)
+    rows = rows[is_inside]
+    columns = columns[is_inside]
+    color_indices = color_indices[is_inside]
+    # Keep the last color painted on each pixel, as if painting in turn
+    reversed_indices = np.unique(
+        (rows * column_count + columns)[::-1], return_index=True)[1]
+    indices = len(rows) - 1 - reversed_indices
+    target_array[rows[indices], columns[indices]] = colors[
+        color_indices[indices]]
     return target_array
 
 
-def paint_array(target_array, (rows, columns), color):
-    try:
-        target_array[rows, columns] = color
-    except IndexError:
-        row_count, column_count = target_array.shape[:2]
-        indices = (
-            rows >= 0) & (rows < row_count) & (
-            columns >= 0) & (columns < column_count)
-        target_array[rows[indices], columns[indices]] = color
-
-
-def get_pixel_frames(pixel_xys, pixel_dimensions, source_image):
-    rough_pixel_frames = (get_pixel_frame_from_pixel_center(
-        _, pixel_dimensions) for _ in pixel_xys)
-    image_pixel_width, image_pixel_height = source_image.pixel_dimensions
-    final_pixel_frames = []
-    for (pixel_x, pixel_y), (pixel_width, pixel_height) in rough_pixel_frames:
-        pixel_x = adjust_placement(pixel_x, pixel_width, image_pixel_width)
-        pixel_y = adjust_placement(pixel_y, pixel_height, image_pixel_height)
-        final_pixel_frames.append(
-            ((pixel_x, pixel_y), (pixel_width, pixel_height)))
-    return final_pixel_frames
-
-
-def count_pixel_xys_in_frame(pixel_xys, pixel_frame):
-    in_frame = get_in_frame(pixel_frame)
-    return sum(in_frame(_) for _ in pixel_xys)
-
-
-def adjust_placement(t, length, maximum_length):
-    if t < 0:
-        return 0
-    if t + length > maximum_length:
-        return maximum_length - length
-    return t
-
-
 def select_unique_pixel_frames(pixel_frames):
     selected_pixel_frames = []
     pixel_frame_tree = rtree.index.Index()
@@ -0,0 +1,86 @@
+import numpy as np
+import os
+import sys
+from crosscompute.libraries import script
+
+from .get_arrays_from_image import ARRAYS_NAME
+from ..libraries.dataset import BatchGroup, get_vector_from_array
+from ..libraries.markers.ccn_cpu import CPUConvNet, get_views
+from ..libraries.prefilter import Prefilter, summarize_pruning
+from ..libraries.probabilities import (
+    PROBABILITIES_CSV, PROBABILITIES_NAME, export_probabilities,
+    get_probability_records, save_probabilities)
+
+
+def start(argv=sys.argv):
+    with script.Starter(run, argv) as starter:
+        starter.add_argument(
+            '--arrays_folder', metavar='FOLDER', required=True,
+            help='')
+        starter.add_argument(
+            '--marker_path', metavar='PATH', required=True,
+            help='checkpoint file or folder saved by cuda-convnet')
+        starter.add_argument(
+            '--batch_size', metavar='SIZE', required=True,
+            type=script.parse_size,
+            help='maximum number of examples to score at once')
+        starter.add_argument(
+            '--crop_border_pixel_length', metavar='INTEGER',
+            type=int, default=0,
+            help='')
+        starter.add_argument(
+            '--multiview', action='store_true',
+            help='average probabilities over ten crops and flips')
+        starter.add_argument(
+            '--prefilter_path', metavar='PATH',
+            help='skip tiles that this prefilter rejects')
+        starter.add_argument(
+            '--export_csv', action='store_true',
+            help='also write probabilities as a CSV table')
+
+
+def run(
+        target_folder, arrays_folder, marker_path, batch_size,
+        crop_border_pixel_length, multiview=False, prefilter_path=None,
+        export_csv=False):
+    marker = CPUConvNet.load(marker_path)
+    inner_height, inner_width, band_count = marker.data_shape
+    array_shape = (
+        inner_height + crop_border_pixel_length * 2,
+        inner_width + crop_border_pixel_length * 2,
+        band_count)
+    batch_group = BatchGroup(
+        ARRAYS_NAME, [arrays_folder], batch_size, array_shape,
+        preserve_order=True, array_filter=Prefilter.load(
+            prefilter_path).select if prefilter_path else None)
+    keys = batch_group.keys
+    packs, pack_columns = batch_group.get_packs(keys)
+    # Subtract the mean of the scored arrays like ZeroMeanDataProvider
+    data_mean = get_vector_from_array(batch_group.array_mean)[:, np.newaxis]
+    probability_chunks = []
+    for start_index in xrange(0, len(keys), batch_size):
+        print('%s / %s' % (start_index, len(keys)))
+        data = batch_group.get_data(
+            keys[start_index:start_index + batch_size]) - data_mean
+        views = get_views(
+            data, array_shape, crop_border_pixel_length, multiview)
+        probability_chunks.append(np.mean([
+            marker.predict(x) for x in views], axis=0))
+    probabilities = np.concatenate(
+        probability_chunks) if probability_chunks else np.zeros((0, 2))
+    records = get_probability_records(
+        probabilities, packs[:, :2], packs[:, 2] if len(
+            pack_columns) > 2 else None)
+    save_probabilities(os.path.join(
+        target_folder, PROBABILITIES_NAME), records)
+    if export_csv:
+        export_probabilities(os.path.join(
+            target_folder, PROBABILITIES_CSV), records)
+    result = dict(
+        array_count=len(keys),
+        array_shape=array_shape,
+        positive_count=int((records['1'] > records['0']).sum()))
+    if prefilter_path:
+        result.update(summarize_pruning(
+            batch_group, batch_group.pruned_keys, keys))
+    return result
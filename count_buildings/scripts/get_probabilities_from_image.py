@@ -0,0 +1,263 @@
+import numpy as np
+import os
+import sys
+from crosscompute.libraries import script
+
+from ..libraries.dataset import load_batch_meta
+from ..libraries.markers.ccn_cpu import CPUConvNet
+from ..libraries.probabilities import (
+    PROBABILITIES_CSV, PROBABILITIES_NAME, export_probabilities,
+    get_probability_records, save_probabilities)
+from ..libraries.satellite_image import SatelliteImage, MetricScope
+
+
+BLOCK_TILE_COUNT = 16
+
+
+def start(argv=sys.argv):
+    with script.Starter(run, argv) as starter:
+        starter.add_argument(
+            '--image_path', metavar='PATH', required=True,
+            help='satellite image')
+        starter.add_argument(
+            '--marker_path', metavar='PATH', required=True,
+            help='checkpoint file or folder saved by cuda-convnet')
+        starter.add_argument(
+            '--tile_metric_dimensions', metavar='WIDTH,HEIGHT', required=True,
+            type=script.parse_dimensions,
+            help='dimensions of scanned tile in metric units')
+        starter.add_argument(
+            '--overlap_metric_dimensions', metavar='WIDTH,HEIGHT',
+            type=script.parse_dimensions, default=(0, 0),
+            help='dimensions of tile overlap in metric units')
+        starter.add_argument(
+            '--crop_border_pixel_length', metavar='INTEGER',
+            type=int, default=0,
+            help='')
+        starter.add_argument(
+            '--multiview', action='store_true',
+            help='average probabilities over ten crops and flips')
+        starter.add_argument(
+            '--batches_folder', metavar='FOLDER',
+            help='subtract the data mean of these batches instead of '
+                 'reading the image twice to average its tiles')
+        starter.add_argument(
+            '--block_tile_count', metavar='INTEGER',
+            type=int, default=BLOCK_TILE_COUNT,
+            help='number of tile rows and columns to scan at once')
+        starter.add_argument(
+            '--export_csv', action='store_true',
+            help='also write probabilities as a CSV table')
+
+
+def run(
+        target_folder, image_path, marker_path, tile_metric_dimensions,
+        overlap_metric_dimensions, crop_border_pixel_length,
+        multiview=False, batches_folder=None,
+        block_tile_count=BLOCK_TILE_COUNT, export_csv=False):
+    marker = CPUConvNet.load(marker_path)
+    image_scope = MetricScope(
+        SatelliteImage(image_path), tile_metric_dimensions,
+        overlap_metric_dimensions)
+    view_offsets = get_view_offsets(crop_border_pixel_length, multiview)
+    check_marker(marker, image_scope, crop_border_pixel_length, view_offsets)
+    band_count = marker.data_shape[2]
+    if batches_folder:
+        tile_mean = load_tile_mean(batches_folder, image_scope, band_count)
+    else:
+        # Subtract the mean of the scored tiles like
+        # get_probabilities_from_arrays
+        tile_mean = get_tile_mean(image_scope, band_count, block_tile_count)
+    block_count = get_block_count(image_scope, block_tile_count)
+    tile_index_chunks, probability_chunks = [], []
+    for block_index, (tile_indices, block) in enumerate(yield_blocks(
+            image_scope, block_tile_count)):
+        print('%s / %s' % (block_index, block_count))
+        tile_indices, probabilities = get_probabilities(
+            marker, image_scope, tile_indices, block, tile_mean,
+            view_offsets)
+        tile_index_chunks.append(tile_indices)
+        probability_chunks.append(probabilities)
+    tile_indices = np.concatenate(tile_index_chunks)
+    probabilities = np.concatenate(probability_chunks)
+    # Keep raster order like the scan over arrays
+    order = np.argsort(tile_indices, kind='mergesort')
+    tile_indices, probabilities = tile_indices[order], probabilities[order]
+    pixel_centers = get_pixel_upper_lefts(
+        image_scope, tile_indices) + image_scope.tile_pixel_dimensions / 2
+    records = get_probability_records(
+        probabilities, pixel_centers, tile_indices)
+    save_probabilities(os.path.join(
+        target_folder, PROBABILITIES_NAME), records)
+    if export_csv:
+        export_probabilities(os.path.join(
+            target_folder, PROBABILITIES_CSV), records)
+    return dict(
+        tile_pixel_dimensions=image_scope.tile_pixel_dimensions,
+        array_count=len(tile_indices),
+        positive_count=int((records['1'] > records['0']).sum()))
+
+
+def get_view_offsets(border_size, multiview=False):
+    'Get (x, y) crop offsets in each tile like get_views'
+    if not multiview:
+        return [(border_size, border_size)]
+    return [
+        (0, 0),
+        (border_size * 2, 0),
+        (border_size, border_size),
+        (0, border_size * 2),
+        (border_size * 2, border_size * 2)]
+
+
+def check_marker(marker, image_scope, border_size, view_offsets):
+    'Make sure that the marker can score the tiles of the image'
+    inner_height, inner_width, band_count = marker.data_shape
+    tile_pixel_width, tile_pixel_height = image_scope.tile_pixel_dimensions
+    if (tile_pixel_height, tile_pixel_width) != (
+            inner_height + border_size * 2, inner_width + border_size * 2):
+        raise ValueError(
+            'Tiles have %sx%s pixels but the marker needs %sx%s' % (
+                tile_pixel_width, tile_pixel_height,
+                inner_width + border_size * 2,
+                inner_height + border_size * 2))
+    if image_scope.band_count < band_count:
+        raise ValueError('Image has %s bands but the marker needs %s' % (
+            image_scope.band_count, band_count))
+    dense_index = marker.dense_layer_index
+    if dense_index is None:
+        print('Warning: Scoring each crop on its own because no '
+              'convolution alone reads the data')
+        return
+    stride = marker.layers[dense_index]['stride'][0]
+    pixel_lengths = list(image_scope.interval_pixel_dimensions) + [
+        x for xy in view_offsets for x in xy]
+    if any(x % stride for x in pixel_lengths):
+        raise ValueError(
+            'Tile intervals and crop offsets must be multiples of %s '
+            'pixels' % stride)
+
+
+def load_tile_mean(batches_folder, image_scope, band_count):
+    'Load the data mean saved with batches as (C, H, W)'
+    batch_meta = load_batch_meta(batches_folder)
+    pixel_height, pixel_width, mean_band_count = batch_meta['array_shape']
+    tile_pixel_width, tile_pixel_height = image_scope.tile_pixel_dimensions
+    if (pixel_height, pixel_width, mean_band_count) != (
+            tile_pixel_height, tile_pixel_width, band_count):
+        raise ValueError(
+            'Batches have %sx%sx%s arrays but tiles are %sx%sx%s' % (
+                pixel_width, pixel_height, mean_band_count,
+                tile_pixel_width, tile_pixel_height, band_count))
+    return batch_meta['data_mean'].reshape((
+        band_count, pixel_height, pixel_width))
+
+
+def get_tile_mean(image_scope, band_count, block_tile_count):
+    'Average tiles that are not empty, pixel by pixel, as (C, H, W)'
+    tile_pixel_width, tile_pixel_height = image_scope.tile_pixel_dimensions
+    tile_sum = np.zeros((tile_pixel_height, tile_pixel_width, band_count))
+    tile_count = 0
+    for tile_indices, block in yield_blocks(image_scope, block_tile_count):
+        tile_yxs = get_block_tile_yxs(image_scope, tile_indices)
+        is_full = get_tile_sums(
+            block.max(axis=2) != 0, tile_yxs, image_scope) > 0
+        for y, x in tile_yxs[is_full]:
+            tile_sum += block[
+                y:y + tile_pixel_height, x:x + tile_pixel_width, :band_count]
+        tile_count += is_full.sum()
+    return np.rollaxis(tile_sum / max(1, tile_count), 2).astype(np.single)
+
+
+def get_probabilities(
+        marker, image_scope, tile_indices, block, tile_mean, view_offsets):
+    'Score the tiles in a block that are not empty'
+    tile_yxs = get_block_tile_yxs(image_scope, tile_indices)
+    is_full = get_tile_sums(
+        block.max(axis=2) != 0, tile_yxs, image_scope) > 0
+    tile_indices, tile_yxs = tile_indices[is_full], tile_yxs[is_full]
+    if not len(tile_indices):
+        return tile_indices, np.zeros((0, 2))
+    images = np.rollaxis(block[:, :, :len(tile_mean)].astype(np.single), 2)
+    inner_height, inner_width = marker.data_shape[:2]
+    views = []
+    for view_x, view_y in view_offsets:
+        views.append((tile_yxs[:, ::-1] + (view_x, view_y), tile_mean[
+            :, view_y:view_y + inner_height, view_x:view_x + inner_width]))
+    # Share the first convolution of the block among views
+    probabilities = sum(marker.predict_dense_views(images, views))
+    if len(view_offsets) > 1:
+        # Flip each crop by flipping the whole block
+        probabilities += sum(marker.predict_dense_views(
+            images[:, :, ::-1], [(np.column_stack([
+                images.shape[2] - crop_xys[:, 0] - inner_width,
+                crop_xys[:, 1],
+            ]), crop_mean[:, :, ::-1]) for crop_xys, crop_mean in views]))
+    view_count = len(view_offsets) * (2 if len(view_offsets) > 1 else 1)
+    return tile_indices, probabilities / view_count
+
+
+def yield_blocks(image_scope, block_tile_count):
+    'Yield tile indices and (HEIGHT, WIDTH, BAND_COUNT) pixels around them'
+    for tile_row in xrange(0, image_scope.row_count, block_tile_count):
+        for tile_column in xrange(
+                0, image_scope.column_count, block_tile_count):
+            tile_rows, tile_columns = np.mgrid[
+                tile_row:min(
+                    tile_row + block_tile_count, image_scope.row_count),
+                tile_column:min(
+                    tile_column + block_tile_count, image_scope.column_count)]
+            tile_indices = (
+                tile_rows * image_scope.column_count + tile_columns).ravel()
+            yield tile_indices, get_block(image_scope, tile_indices)
+
+
+def get_block(image_scope, tile_indices):
+    'Read pixels under tiles, with zeros outside the image'
+    pixel_upper_lefts = get_pixel_upper_lefts(image_scope, tile_indices)
+    x1, y1 = pixel_upper_lefts.min(axis=0)
+    x2, y2 = pixel_upper_lefts.max(
+        axis=0) + image_scope.tile_pixel_dimensions
+    image_width, image_height = image_scope.pixel_dimensions
+    inner_x1, inner_y1 = max(0, x1), max(0, y1)
+    inner_x2, inner_y2 = min(image_width, x2), min(image_height, y2)
+    block = np.zeros((
+        y2 - y1, x2 - x1, image_scope.band_count),
+        dtype=image_scope.array_dtype)
+    block[
+        inner_y1 - y1:inner_y2 - y1, inner_x1 - x1:inner_x2 - x1,
+    ] = image_scope.get_array_from_pixel_frame((
+        (inner_x1, inner_y1), (inner_x2 - inner_x1, inner_y2 - inner_y1),
+    )).reshape((inner_y2 - inner_y1, inner_x2 - inner_x1, -1))
+    return block
+
+
+def get_block_tile_yxs(image_scope, tile_indices):
+    'Get the (y, x) of each tile upper left in its block'
+    pixel_upper_lefts = get_pixel_upper_lefts(image_scope, tile_indices)
+    return (pixel_upper_lefts - pixel_upper_lefts.min(axis=0))[:, ::-1]
+
+
+def get_pixel_upper_lefts(image_scope, tile_indices):
+    tile_columns = tile_indices % image_scope.column_count
+    tile_rows = tile_indices // image_scope.column_count
+    return np.column_stack([
+        tile_columns, tile_rows]) * image_scope.interval_pixel_dimensions
+
+
+def get_tile_sums(array, tile_yxs, image_scope):
+    'Sum (HEIGHT, WIDTH, ...) values under each tile with a summed-area table'
+    array = array.reshape(array.shape[:2] + (-1,))
+    sums = np.zeros((
+        array.shape[0] + 1, array.shape[1] + 1, array.shape[2]))
+    sums[1:, 1:] = array.cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+    tile_pixel_width, tile_pixel_height = image_scope.tile_pixel_dimensions
+    y1, x1 = tile_yxs.T
+    y2, x2 = y1 + tile_pixel_height, x1 + tile_pixel_width
+    tile_sums = sums[y2, x2] - sums[y1, x2] - sums[y2, x1] + sums[y1, x1]
+    return tile_sums if tile_sums.shape[1] > 1 else tile_sums[:, 0]
+
+
+def get_block_count(image_scope, block_tile_count):
+    return len(xrange(0, image_scope.row_count, block_tile_count)) * len(
+        xrange(0, image_scope.column_count, block_tile_count))
@@ -0,0 +1,42 @@
+import numpy as np
+import os
+import sys
+from crosscompute.libraries import script
+from pandas import read_csv
+
+from ..libraries.probabilities import (
+    PROBABILITIES_CSV, PROBABILITIES_NAME, append_probabilities,
+    export_probabilities, get_records_from_table, load_probabilities)
+
+
+def start(argv=sys.argv):
+    with script.Starter(run, argv) as starter:
+        starter.add_argument(
+            '--shard_paths', metavar='PATH', required=True,
+            nargs='+',
+            help='probability tables from ccn-predict or probability folders')
+        starter.add_argument(
+            '--export_csv', action='store_true',
+            help='also write probabilities as a CSV table')
+
+
+def run(target_folder, shard_paths, export_csv=False):
+    probabilities_path = os.path.join(target_folder, PROBABILITIES_NAME)
+    if os.path.exists(probabilities_path):
+        os.remove(probabilities_path)
+    probability_count = 0
+    for shard_path in shard_paths:
+        if os.path.isdir(shard_path):
+            records = load_probabilities(shard_path)
+        else:
+            records = get_records_from_table(read_csv(shard_path))
+        append_probabilities(probabilities_path, records)
+        probability_count += len(records)
+    records = load_probabilities(target_folder)
+    if export_csv:
+        export_probabilities(os.path.join(
+            target_folder, PROBABILITIES_CSV), records)
+    return dict(
+        shard_count=len(shard_paths),
+        probability_count=probability_count,
+        positive_count=int(np.sum(records['1'] > records['0'])))
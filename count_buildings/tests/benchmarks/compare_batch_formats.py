@@ -0,0 +1,56 @@
+import numpy as np
+import os
+import shutil
+import sys
+import time
+from os.path import join
+from tempfile import mkdtemp
+
+from count_buildings.libraries.dataset import BATCH_FORMATS
+from count_buildings.libraries.dataset import load_batch, save_batch
+
+
+ARRAY_SHAPE = 32, 32, 4
+BATCH_SIZE = 5000
+BATCH_COUNT = 4
+
+
+def run(batch_size, batch_count):
+    vector_size = reduce(lambda x, y: x * y, ARRAY_SHAPE)
+    batches = [(
+        np.random.randint(0, 256, (vector_size, batch_size)).astype('uint8'),
+        np.random.randint(0, 2, batch_size).astype(bool),
+    ) for x in xrange(batch_count)]
+    print('format\tmegabytes\twrite_seconds\tload_seconds')
+    for batch_format in BATCH_FORMATS:
+        batch_folder = mkdtemp()
+        try:
+            print('%s\t%.1f\t%.3f\t%.3f' % ((batch_format,) + measure(
+                batch_folder, batches, batch_format)))
+        finally:
+            shutil.rmtree(batch_folder)
+
+
+def measure(batch_folder, batches, batch_format):
+    batch_paths = [
+        join(batch_folder, 'data_batch_%d' % x) for x in xrange(len(batches))]
+    start_time = time.time()
+    for batch_path, (data, labels) in zip(batch_paths, batches):
+        save_batch(batch_path, data, labels, xrange(len(labels)), batch_format)
+    write_seconds = time.time() - start_time
+    byte_count = sum(os.path.getsize(join(
+        batch_folder, x)) for x in os.listdir(batch_folder))
+    start_time = time.time()
+    for batch_path in batch_paths:
+        # Prepare data the way GenericDataProvider.get_next_batch does
+        batch = load_batch(batch_path, batch_format)
+        np.require(batch['data'], dtype=np.single, requirements='C')
+        np.require(np.array(batch['labels']), dtype=np.single)
+    load_seconds = time.time() - start_time
+    return byte_count / float(1024 * 1024), write_seconds, load_seconds
+
+
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else BATCH_SIZE,
+        int(sys.argv[2]) if len(sys.argv) > 2 else BATCH_COUNT)
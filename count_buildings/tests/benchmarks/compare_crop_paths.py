@@ -0,0 +1,66 @@
+import numpy as np
+import sys
+import time
+
+from count_buildings.libraries.markers.ccn import crop_randomly
+
+
+ARRAY_SHAPE = 3, 32, 32
+BORDER_SIZE = 4
+CASE_COUNT = 5000
+
+
+def run(case_count, border_size):
+    band_count, pixel_height, pixel_width = ARRAY_SHAPE
+    inner_height = pixel_height - border_size * 2
+    inner_width = pixel_width - border_size * 2
+    arrays = np.random.rand(
+        band_count, pixel_height, pixel_width, case_count).astype(np.single)
+    print('path\tseconds')
+    np.random.seed(0)
+    start_time = time.time()
+    crop_by_loop(arrays, border_size, inner_height, inner_width)
+    print('loop\t%.3f' % (time.time() - start_time))
+    np.random.seed(0)
+    start_time = time.time()
+    crops = crop_randomly(arrays, border_size, inner_height, inner_width)
+    target = np.zeros((crops[0].size, case_count), dtype=np.single)
+    target[:, :] = crops.reshape((case_count, crops[0].size)).T
+    print('strided\t%.3f' % (time.time() - start_time))
+    # Replay the same draws to check each crop
+    np.random.seed(0)
+    start_ys = np.random.randint(0, border_size * 2 + 1, case_count)
+    start_xs = np.random.randint(0, border_size * 2 + 1, case_count)
+    flips = np.random.randint(0, 2, case_count) == 0
+    for c in xrange(case_count):
+        pic = arrays[
+            :,
+            start_ys[c]:start_ys[c] + inner_height,
+            start_xs[c]:start_xs[c] + inner_width,
+            c]
+        if flips[c]:
+            pic = pic[:, :, ::-1]
+        assert np.array_equal(crops[c], pic)
+
+
+def crop_by_loop(arrays, border_size, inner_height, inner_width):
+    'Crop the way CroppedZeroMeanDataProvider used to, one case at a time'
+    case_count = arrays.shape[3]
+    target = np.zeros((
+        arrays.shape[0] * inner_height * inner_width, case_count),
+        dtype=np.single)
+    for c in xrange(case_count):
+        startY = np.random.randint(0, border_size * 2 + 1)
+        startX = np.random.randint(0, border_size * 2 + 1)
+        pic = arrays[
+            :, startY:startY + inner_height, startX:startX + inner_width, c]
+        if np.random.randint(2) == 0:
+            pic = pic[:, :, ::-1]
+        target[:, c] = pic.reshape((target.shape[0],))
+    return target
+
+
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else CASE_COUNT,
+        int(sys.argv[2]) if len(sys.argv) > 2 else BORDER_SIZE)
@@ -0,0 +1,52 @@
+'Compare how hotspot selection scales with the number of probabilities'
+import numpy as np
+import sys
+import time
+
+from count_buildings.scripts.get_counts_from_probabilities import (
+    yield_hotspot_via_metric)
+from count_buildings.tests.get_counts_from_probabilities_test import (
+    yield_hotspot_by_loop)
+
+
+PROBABILITY_COUNTS = 1000, 2000, 4000, 8000, 16000, 128000
+MAXIMUM_LOOP_COUNT = 4000
+PIXEL_RADIUS = 6
+
+
+def run(probability_counts, pixel_radius, maximum_loop_count):
+    print('probability_count\tloop_seconds\tmask_seconds\thotspot_count')
+    for probability_count in probability_counts:
+        xys, metrics = get_probabilities(probability_count)
+        start_time = time.time()
+        hotspot_xys = list(yield_hotspot_via_metric(
+            xys, pixel_radius, metrics))
+        mask_seconds = time.time() - start_time
+        loop_seconds = np.nan
+        if probability_count <= maximum_loop_count:
+            start_time = time.time()
+            expected_hotspot_xys = list(yield_hotspot_by_loop(
+                xys, pixel_radius, lambda index: metrics[index]))
+            loop_seconds = time.time() - start_time
+            assert np.allclose(hotspot_xys, expected_hotspot_xys)
+        print('%s\t%.3f\t%.3f\t%s' % (
+            probability_count, loop_seconds, mask_seconds, len(hotspot_xys)))
+
+
+def get_probabilities(probability_count):
+    'Scatter positive tiles in clusters with a tile interval of 8 pixels'
+    random_state = np.random.RandomState(0)
+    cluster_count = max(1, probability_count // 20)
+    cluster_xys = random_state.randint(0, 10000, (cluster_count, 2))
+    xys = cluster_xys[random_state.randint(
+        0, cluster_count, probability_count)] + 8 * random_state.randint(
+        -3, 4, (probability_count, 2))
+    return xys, random_state.rand(probability_count)
+
+
+if __name__ == '__main__':
+    run(
+        [int(x) for x in sys.argv[1].split(',')] if len(
+            sys.argv) > 1 else PROBABILITY_COUNTS,
+        int(sys.argv[2]) if len(sys.argv) > 2 else PIXEL_RADIUS,
+        int(sys.argv[3]) if len(sys.argv) > 3 else MAXIMUM_LOOP_COUNT)
@@ -0,0 +1,58 @@
+'Measure data provider throughput on the CPU; needs only the Python sources'
+import numpy as np
+import os
+import re
+import sys
+import time
+
+from count_buildings.libraries.markers.ccn import DataProvider
+
+
+DATA_PROVIDERS = 'cropped-zero-mean', 'prefetching-cropped-zero-mean'
+BATCH_COUNT = 10
+COMPUTE_SECONDS = 0.5
+
+
+def run(batch_folder, batch_count, compute_seconds, dp_params):
+    batch_range = sorted(int(x.split('_')[-1]) for x in os.listdir(
+        batch_folder) if re.match(r'data_batch_\d+$', x))
+    print('provider\tbatches_per_second\tstall_seconds')
+    batches_by_provider = {}
+    for data_provider in DATA_PROVIDERS:
+        # Seed identically so that random crops are comparable
+        np.random.seed(0)
+        provider = DataProvider.get_instance(
+            batch_folder, batch_range, type=data_provider,
+            dp_params=dp_params)
+        batches = []
+        start_time = time.time()
+        for batch_index in xrange(batch_count):
+            epoch, batch_num, data = provider.get_next_batch()
+            batches.append((epoch, batch_num, data))
+            # Simulate the time that the trainer spends on the batch
+            time.sleep(compute_seconds)
+        elapsed_seconds = time.time() - start_time
+        print('%s\t%.2f\t%.3f' % (
+            data_provider, batch_count / elapsed_seconds,
+            getattr(provider, 'stall_seconds', elapsed_seconds - (
+                batch_count * compute_seconds))))
+        batches_by_provider[data_provider] = batches
+    for batches in zip(*batches_by_provider.values()):
+        for (epoch, batch_num, data), (
+                other_epoch, other_batch_num, other_data) in zip(
+                    batches, batches[1:]):
+            assert (epoch, batch_num) == (other_epoch, other_batch_num)
+            for array, other_array in zip(data, other_data):
+                assert np.array_equal(array, other_array)
+
+
+if __name__ == '__main__':
+    run(
+        sys.argv[1],
+        int(sys.argv[2]) if len(sys.argv) > 2 else BATCH_COUNT,
+        float(sys.argv[3]) if len(sys.argv) > 3 else COMPUTE_SECONDS,
+        dict(
+            crop_border=int(sys.argv[4]) if len(sys.argv) > 4 else 4,
+            multiview_test=False,
+            prefetch_batch_count=int(sys.argv[5]) if len(
+                sys.argv) > 5 else None))
@@ -0,0 +1,87 @@
+'Compare the bulk-loaded spatial index with per-point rtree and kdtree loops'
+import numpy as np
+import rtree.index
+import sys
+import time
+from pykdtree.kdtree import KDTree
+
+from count_buildings.libraries.spatial_index import SpatialIndex
+
+
+POINT_COUNTS = 10000, 50000, 200000
+QUERY_COUNT = 2000
+TILE_PIXEL_LENGTH = 40
+PIXEL_RADIUS = 20
+
+
+def run(point_counts, query_count):
+    print('\t'.join([
+        'point_count', 'query_count',
+        'rtree_build_seconds', 'index_build_seconds',
+        'rtree_box_seconds', 'index_box_seconds',
+        'kdtree_radius_seconds', 'index_radius_seconds']))
+    for point_count in point_counts:
+        xys, query_xys = get_points(point_count, query_count)
+        boxes = np.column_stack([
+            query_xys - TILE_PIXEL_LENGTH / 2,
+            query_xys + TILE_PIXEL_LENGTH / 2])
+
+        start_time = time.time()
+        point_rtree = rtree.index.Index()
+        for index, xy in enumerate(xys):
+            point_rtree.insert(index, tuple(xy))
+        rtree_build_seconds = time.time() - start_time
+        start_time = time.time()
+        spatial_index = SpatialIndex(xys)
+        index_build_seconds = time.time() - start_time
+
+        start_time = time.time()
+        rtree_counts = [point_rtree.count(tuple(x)) for x in boxes]
+        rtree_box_seconds = time.time() - start_time
+        start_time = time.time()
+        offsets = spatial_index.query_boxes(boxes)[0]
+        index_box_seconds = time.time() - start_time
+        assert np.diff(offsets).tolist() == rtree_counts
+
+        # Ask for every point as the wrappers did without a maximum_count
+        point_kdtree = KDTree(xys.astype(np.float64))
+        start_time = time.time()
+        kdtree_counts = []
+        for xy in query_xys.astype(np.float64):
+            indices = point_kdtree.query(
+                np.array([xy]), k=point_count,
+                distance_upper_bound=PIXEL_RADIUS)[1]
+            kdtree_counts.append(np.sum(indices != point_count))
+        kdtree_radius_seconds = time.time() - start_time
+        start_time = time.time()
+        offsets = spatial_index.query_radius(query_xys, PIXEL_RADIUS)[0]
+        index_radius_seconds = time.time() - start_time
+        assert np.diff(offsets).tolist() == kdtree_counts
+
+        print('%s\t%s\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f' % (
+            point_count, query_count,
+            rtree_build_seconds, index_build_seconds,
+            rtree_box_seconds, index_box_seconds,
+            kdtree_radius_seconds, index_radius_seconds))
+
+
+def get_points(point_count, query_count):
+    'Scatter buildings in settlements across a 20000 x 20000 pixel image'
+    random_state = np.random.RandomState(0)
+    settlement_count = max(1, point_count // 200)
+    settlement_xys = random_state.randint(
+        1000, 19000, (settlement_count, 2))
+    xys = settlement_xys[random_state.randint(
+        0, settlement_count, point_count)] + random_state.normal(
+        0, 150, (point_count, 2)).astype(int)
+    query_xys = xys[random_state.randint(
+        0, point_count, query_count)] + random_state.randint(
+        -50, 50, (query_count, 2))
+    return xys, query_xys
+
+
+if __name__ == '__main__':
+    run(
+        [int(x) for x in sys.argv[1].split(',')] if len(
+            sys.argv) > 1 else POINT_COUNTS,
+        int(sys.argv[2]) if len(sys.argv) > 2 else QUERY_COUNT)
@@ -0,0 +1,407 @@
+import ConfigParser
+import cPickle as pickle
+import numpy as np
+import os
+import re
+import shutil
+import sys
+import types
+import unittest
+from pandas import read_csv
+from tempfile import mkdtemp
+
+from ..libraries.dataset import load_batch, load_batch_meta
+from ..libraries.markers.ccn_cpu import CPUConvNet, load_checkpoint
+from ..libraries.markers.ccn_cpu import compute_cmrnorm, compute_conv
+from ..libraries.markers.ccn_cpu import compute_local, compute_pool
+from ..libraries.markers.ccn_cpu import get_views
+
+
+CASE_COUNT = 3
+FIXTURE_FOLDER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ccn_predict')
+PRODUCTION_LAYER_DEFINITION_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+    'run_experiments', '20141231-2344', 'layer-definition.cfg')
+
+
+class ComputeConvTest(unittest.TestCase):
+
+    def test_compute_conv_like_loop(self):
+        layer = get_filter_layer(
+            channels=3, image_size=7, filter_size=3, padding=-1, stride=2,
+            filter_count=4)
+        images = np.random.rand(CASE_COUNT, 3, 7, 7).astype(np.single)
+        outputs = compute_conv(layer, [images.reshape((CASE_COUNT, -1))])
+        expected_outputs = compute_filters_by_loop(layer, images, True)
+        self.assert_(np.allclose(outputs, expected_outputs, atol=1e-5))
+
+    def test_compute_local_like_loop(self):
+        layer = get_filter_layer(
+            channels=2, image_size=5, filter_size=3, padding=1, stride=1,
+            filter_count=3, share_weights=False)
+        images = np.random.rand(CASE_COUNT, 2, 5, 5).astype(np.single)
+        outputs = compute_local(layer, [images.reshape((CASE_COUNT, -1))])
+        expected_outputs = compute_filters_by_loop(layer, images, False)
+        self.assert_(np.allclose(outputs, expected_outputs, atol=1e-5))
+
+
+class ComputePoolTest(unittest.TestCase):
+
+    def test_compute_pool_like_loop(self):
+        images = np.random.rand(CASE_COUNT, 2, 8, 8).astype(np.single)
+        for pool in 'max', 'avg':
+            for start in 0, -1:
+                layer = dict(
+                    pool=pool, channels=2, imgSize=8, sizeX=3, stride=2,
+                    start=start, outputsX=0)
+                outputs = compute_pool(
+                    layer, [images.reshape((CASE_COUNT, -1))])
+                expected_outputs = compute_pool_by_loop(layer, images)
+                self.assert_(np.allclose(outputs, expected_outputs))
+
+
+class ComputeCMRNormTest(unittest.TestCase):
+
+    def test_compute_cmrnorm_like_loop(self):
+        images = np.random.rand(CASE_COUNT, 6, 4, 4).astype(np.single)
+        layer = dict(channels=6, imgSize=4, size=3, scale=0.5, pow=0.75)
+        outputs = compute_cmrnorm(layer, [images.reshape((CASE_COUNT, -1))])
+        expected_outputs = np.empty_like(images)
+        for c in xrange(6):
+            start_c = max(0, c - 1)
+            stop_c = min(6, c - 1 + 3)
+            square_sums = (images[:, start_c:stop_c] ** 2).sum(axis=1)
+            expected_outputs[:, c] = images[:, c] * (
+                1 + 0.5 * square_sums) ** -0.75
+        self.assert_(np.allclose(
+            outputs, expected_outputs.reshape((CASE_COUNT, -1))))
+
+
+class CPUConvNetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_predict(self):
+        conv_layer = get_filter_layer(
+            channels=3, image_size=6, filter_size=3, padding=-1, stride=1,
+            filter_count=4)
+        conv_layer.update(name='conv1', type='conv', inputs=[0], neuron={
+            'type': 'relu', 'params': {}})
+        fc_weights = np.random.rand(4 * 36, 2).astype(np.single) - 0.5
+        fc_biases = np.random.rand(1, 2).astype(np.single)
+        layers = [
+            dict(name='data', type='data', dataIdx=0),
+            dict(name='labels', type='data', dataIdx=1),
+            conv_layer,
+            dict(
+                name='fc2', type='fc', inputs=[2],
+                weights=[fc_weights], biases=fc_biases, neuron=None),
+            dict(name='probs', type='softmax', inputs=[3]),
+            dict(name='logprob', type='cost.logreg', inputs=[1, 4]),
+        ]
+        # Save a checkpoint that refers to a module we do not have
+        module = types.ModuleType(MissingOptions.__module__)
+        module.MissingOptions = MissingOptions
+        sys.modules[module.__name__] = module
+        for checkpoint_name in '9.4', '10.2':
+            pickle.dump({
+                'model_state': {'layers': layers},
+                'op': MissingOptions(),
+            }, open(os.path.join(
+                self.folder, checkpoint_name), 'wb'), protocol=-1)
+        del sys.modules[module.__name__]
+        self.assertEqual(
+            load_checkpoint(self.folder)['op'].value_by_key, {'a': 1})
+        marker = CPUConvNet.load(self.folder)
+        self.assertEqual(marker.data_shape, (6, 6, 3))
+        self.assertEqual(marker.output_layer_name, 'probs')
+
+        images = np.random.rand(CASE_COUNT, 3, 6, 6).astype(np.single)
+        probabilities = marker.predict(images.reshape((CASE_COUNT, -1)).T)
+        conv_outputs = np.maximum(compute_filters_by_loop(
+            conv_layer, images, True), 0)
+        fc_outputs = np.dot(conv_outputs, fc_weights) + fc_biases
+        expected_probabilities = np.exp(fc_outputs) / np.exp(
+            fc_outputs).sum(axis=1)[:, np.newaxis]
+        self.assert_(np.allclose(
+            probabilities, expected_probabilities, atol=1e-5))
+
+    def test_predict_with_neuron_layer(self):
+        # Use an activation that changes its outputs when applied twice
+        fc_weights = np.random.rand(12, 2).astype(np.single) - 0.5
+        fc_biases = np.random.rand(1, 2).astype(np.single)
+        layers = [
+            dict(name='data', type='data', dataIdx=0),
+            dict(name='neuron1', type='neuron', inputs=[0], neuron={
+                'type': 'linear', 'params': {'a': 2, 'b': 1}}),
+            dict(
+                name='fc2', type='fc', inputs=[1],
+                weights=[fc_weights], biases=fc_biases, neuron=None),
+            dict(name='probs', type='softmax', inputs=[2]),
+        ]
+        marker = CPUConvNet(layers)
+        data = np.random.rand(12, CASE_COUNT).astype(np.single)
+        fc_outputs = np.dot(2 * data.T + 1, fc_weights) + fc_biases
+        expected_probabilities = np.exp(fc_outputs) / np.exp(
+            fc_outputs).sum(axis=1)[:, np.newaxis]
+        self.assert_(np.allclose(
+            marker.predict(data), expected_probabilities, atol=1e-5))
+
+    def test_predict_dense(self):
+        conv_layer = get_filter_layer(
+            channels=3, image_size=12, filter_size=3, padding=-1, stride=2,
+            filter_count=4)
+        conv_layer.update(name='conv1', type='conv', inputs=[0], neuron={
+            'type': 'relu', 'params': {}})
+        local_layer = get_filter_layer(
+            channels=4, image_size=3, filter_size=3, padding=1, stride=1,
+            filter_count=3, share_weights=False)
+        local_layer.update(name='local4', type='local', inputs=[4])
+        layers = [
+            dict(name='data', type='data', dataIdx=0),
+            conv_layer,
+            dict(
+                name='pool2', type='pool', inputs=[1], pool='max',
+                channels=4, imgSize=7, sizeX=3, stride=2, start=0,
+                outputsX=0),
+            dict(
+                name='rnorm3', type='cmrnorm', inputs=[2], channels=4,
+                imgSize=3, size=3, scale=0.5, pow=0.75),
+            dict(
+                name='neuron4', type='neuron', inputs=[3], neuron={
+                    'type': 'abs', 'params': {}}),
+            local_layer,
+            dict(
+                name='fc6', type='fc', inputs=[5], neuron=None,
+                weights=[np.random.rand(27, 2).astype(np.single) - 0.5],
+                biases=np.random.rand(1, 2).astype(np.single)),
+            dict(name='probs', type='softmax', inputs=[6]),
+        ]
+        marker = CPUConvNet(layers)
+        self.assertEqual(marker.dense_layer_index, 1)
+        images = np.random.rand(3, 30, 40).astype(np.single) - 0.5
+        data_mean = np.random.rand(3, 12, 12).astype(np.single) - 0.5
+        crop_xys = [(0, 0), (10, 4), (28, 18), (20, 2)]
+        probabilities = marker.predict_dense(
+            images, crop_xys, data_mean=data_mean)
+        expected_probabilities = marker.predict(np.array([
+            (images[:, y:y + 12, x:x + 12] - data_mean).ravel()
+            for x, y in crop_xys]).T)
+        self.assert_(np.allclose(
+            probabilities, expected_probabilities, atol=1e-5))
+        # Convolution with stride 2 only lines up with even crop positions
+        with self.assertRaises(ValueError):
+            marker.predict_dense(images, [(1, 0)])
+        # Score each crop on its own if no convolution reads the data
+        layers[1]['type'] = 'local'
+        layers[1]['weights'] = [np.tile(
+            layers[1]['weights'][0], (49, 1))]
+        layers[1]['biases'] = np.repeat(layers[1]['biases'], 49, axis=0)
+        marker = CPUConvNet(layers)
+        self.assertEqual(marker.dense_layer_index, None)
+        self.assert_(np.allclose(marker.predict_dense(
+            images, crop_xys, data_mean=data_mean,
+        ), expected_probabilities, atol=1e-5))
+
+    def test_predict_dense_like_production(self):
+        layers = get_layers(PRODUCTION_LAYER_DEFINITION_PATH, image_size=32)
+        marker = CPUConvNet(layers)
+        self.assertEqual(marker.dense_layer_index, 2)
+        images = np.random.rand(4, 70, 70).astype(np.single) * 255
+        tile_mean = np.random.rand(4, 40, 40).astype(np.single) * 255
+        crop_xys = np.array([(0, 0), (5, 9), (18, 28), (30, 20)])
+        views = [
+            (crop_xys, tile_mean[:, :32, :32]),
+            (crop_xys + 8, tile_mean[:, 8:, 8:]),
+            (crop_xys, None)]
+        outputs = marker.predict_dense_views(images, views, 'fc2')
+        for (view_xys, data_mean), view_outputs in zip(views, outputs):
+            data = np.array([images[
+                :, y:y + 32, x:x + 32] for x, y in view_xys])
+            if data_mean is not None:
+                data -= data_mean
+            expected_outputs = marker.predict(
+                data.reshape((len(data), -1)).T, 'fc2')
+            self.assert_(np.allclose(
+                view_outputs, expected_outputs, rtol=1e-4, atol=1e-4))
+
+
+class CCNPredictTest(unittest.TestCase):
+
+    @unittest.skipUnless(os.path.exists(os.path.join(
+        FIXTURE_FOLDER, 'probabilities.csv',
+    )), 'run make_ccn_predict_fixture.sh where cuda-convnet works')
+    def test_predict_like_ccn_predict(self):
+        marker = CPUConvNet.load(os.path.join(FIXTURE_FOLDER, 'marker'))
+        batch_folder = os.path.join(FIXTURE_FOLDER, 'batches')
+        batch_meta = load_batch_meta(batch_folder)
+        batch = load_batch(os.path.join(
+            batch_folder, 'data_batch_1'), 'pickle')
+        # Score the test batch the way options.cfg tells ccn-predict to
+        views = get_views(
+            batch['data'] - batch_meta['data_mean'],
+            batch_meta['array_shape'], border_size=4, multiview=True)
+        probabilities = np.mean([marker.predict(x) for x in views], axis=0)
+        expected_probabilities = read_csv(os.path.join(
+            FIXTURE_FOLDER, 'probabilities.csv'))[['0', '1']].values
+        self.assert_(np.allclose(
+            probabilities, expected_probabilities, atol=1e-4))
+
+
+class GetViewsTest(unittest.TestCase):
+
+    def test_get_views(self):
+        arrays = np.random.rand(2, 8, 8, CASE_COUNT)
+        data = arrays.reshape((-1, CASE_COUNT))
+        views = get_views(data, (8, 8, 2), 2)
+        self.assertEqual(len(views), 1)
+        self.assert_((views[0] == arrays[:, 2:6, 2:6].reshape((
+            -1, CASE_COUNT))).all())
+        views = get_views(data, (8, 8, 2), 2, multiview=True)
+        self.assertEqual(len(views), 10)
+        self.assert_((views[9] == arrays[:, 4:8, 4:8][:, :, ::-1].reshape((
+            -1, CASE_COUNT))).all())
+
+
+class MissingOptions(object):
+
+    __module__ = 'missing_options_module'
+
+    def __init__(self):
+        self.value_by_key = {'a': 1}
+
+
+def get_filter_layer(
+        channels, image_size, filter_size, padding, stride, filter_count,
+        share_weights=True):
+    modules_x = 1 + int(np.ceil(
+        (2 * abs(padding) + image_size - filter_size) / float(stride)))
+    weight_count = channels * filter_size * filter_size
+    bias_count = filter_count
+    if not share_weights:
+        # Give each module its own weights and biases
+        weight_count *= modules_x * modules_x
+        bias_count *= modules_x * modules_x
+    return dict(
+        channels=[channels], imgSize=[image_size], filterSize=[filter_size],
+        padding=[padding], stride=[stride], filters=filter_count,
+        modulesX=modules_x, sharedBiases=1, groups=[1],
+        weights=[np.random.rand(
+            weight_count, filter_count).astype(np.single) - 0.5],
+        biases=np.random.rand(bias_count, 1).astype(np.single))
+
+
+def get_layers(definition_path, image_size):
+    'Give the layers in a layer definition random weights'
+    configuration = ConfigParser.RawConfigParser()
+    configuration.optionxform = str
+    configuration.read(definition_path)
+    layers = []
+    layer_index_by_name = {}
+    shape_by_name = {}
+    for name in configuration.sections():
+        layer = dict(configuration.items(name), name=name)
+        for key, value in layer.items():
+            if re.match(r'-?[\d.]+$', value):
+                layer[key] = float(value) if '.' in value else int(value)
+        if 'inputs' in layer:
+            input_names = layer['inputs'].split(',')
+            layer['inputs'] = [layer_index_by_name[x] for x in input_names]
+            channel_count, input_size = shape_by_name[input_names[-1]]
+        layer_type = layer['type']
+        if layer_type == 'data':
+            shape = channel_count, input_size = 4, image_size
+        elif layer_type in ('conv', 'local'):
+            filter_layer = get_filter_layer(
+                channel_count, input_size, layer['filterSize'],
+                -layer['padding'], layer['stride'], layer['filters'],
+                share_weights=layer_type == 'conv')
+            # Keep outputs near one like a trained marker
+            filter_layer['weights'][0] /= layer['filterSize'] * np.sqrt(
+                channel_count)
+            layer.update(filter_layer)
+            shape = layer['filters'], layer['modulesX']
+        elif layer_type == 'pool':
+            layer['imgSize'] = input_size
+            shape = channel_count, 1 + int(np.ceil(float(
+                input_size - layer['start'] - layer['sizeX']) / layer[
+                'stride']))
+        elif layer_type == 'cmrnorm':
+            layer.update(imgSize=input_size, scale=0.001 / layer[
+                'size'], pow=0.75)
+            shape = channel_count, input_size
+        elif layer_type == 'fc':
+            input_count = channel_count * input_size ** 2
+            layer.update(weights=[(np.random.rand(
+                input_count, layer['outputs']) - 0.5).astype(
+                np.single) / np.sqrt(input_count)], biases=np.random.rand(
+                1, layer['outputs']).astype(np.single))
+            shape = layer['outputs'], 1
+        else:
+            shape = channel_count, input_size
+        if layer.get('neuron'):
+            layer['neuron'] = {'type': layer['neuron'], 'params': {}}
+        layer_index_by_name[name] = len(layers)
+        shape_by_name[name] = shape
+        layers.append(layer)
+    return layers
+
+
+def compute_filters_by_loop(layer, images, share_weights):
+    case_count, channel_count, image_size = images.shape[:3]
+    filter_size = layer['filterSize'][0]
+    padding = abs(layer['padding'][0])
+    stride = layer['stride'][0]
+    modules_x = layer['modulesX']
+    weights = layer['weights'][0]
+    biases = layer['biases'].ravel()
+    outputs = np.zeros((
+        case_count, layer['filters'], modules_x, modules_x))
+    for f in xrange(layer['filters']):
+        for my in xrange(modules_x):
+            for mx in xrange(modules_x):
+                m = my * modules_x + mx
+                for c in xrange(channel_count):
+                    for y in xrange(filter_size):
+                        for x in xrange(filter_size):
+                            iy = my * stride - padding + y
+                            ix = mx * stride - padding + x
+                            if not 0 <= iy < image_size:
+                                continue
+                            if not 0 <= ix < image_size:
+                                continue
+                            row = (c * filter_size + y) * filter_size + x
+                            if not share_weights:
+                                row += m * channel_count * filter_size ** 2
+                            outputs[:, f, my, mx] += weights[
+                                row, f] * images[:, c, iy, ix]
+                outputs[:, f, my, mx] += biases[
+                    f if share_weights else f * modules_x ** 2 + m]
+    return outputs.reshape((case_count, -1))
+
+
+def compute_pool_by_loop(layer, images):
+    image_size = layer['imgSize']
+    size, stride, start = layer['sizeX'], layer['stride'], layer['start']
+    outputs_x = 1 + int(np.ceil(
+        (image_size - start - size) / float(stride)))
+    outputs = np.empty(images.shape[:2] + (outputs_x, outputs_x))
+    for oy in xrange(outputs_x):
+        for ox in xrange(outputs_x):
+            start_y = max(0, start + oy * stride)
+            start_x = max(0, start + ox * stride)
+            stop_y = min(image_size, start + oy * stride + size)
+            stop_x = min(image_size, start + ox * stride + size)
+            window = images[:, :, start_y:stop_y, start_x:stop_x]
+            outputs[:, :, oy, ox] = window.max(axis=(2, 3)) if layer[
+                'pool'] == 'max' else window.mean(axis=(2, 3))
+    return outputs.reshape((len(images), -1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import numpy as np
+import os
+import shutil
+import unittest
+from mock import MagicMock, patch
+from tempfile import mkdtemp
+
+from ..libraries.dataset import save_batch, save_batch_meta
+from ..libraries.markers import ccn
+from ..libraries.markers.ccn import (
+    ConvNet, CroppedZeroMeanDataProvider, ZeroMeanDataProvider)
+
+
+class DataProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        arrays = np.random.randint(0, 256, (6, 8, 8, 3)).astype(np.uint8)
+        save_batch_meta(
+            self.folder, arrays.mean(axis=0), range(6), [], 'npy')
+        for batch_index in xrange(2):
+            save_batch(
+                os.path.join(self.folder, 'data_batch_%s' % batch_index),
+                arrays[batch_index * 3:(batch_index + 1) * 3].swapaxes(
+                    1, 3).swapaxes(2, 3).reshape((3, -1)).T,
+                [True, False, True], xrange(3), 'npy')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_release_batch(self):
+        for DataProviderClass, dp_params in [
+            (ZeroMeanDataProvider, {}),
+            (CroppedZeroMeanDataProvider, {
+                'crop_border': 2, 'multiview_test': True}),
+        ]:
+            provider = DataProviderClass(
+                self.folder, [0, 1], dp_params=dp_params, test=True)
+            epoch, batch_num, batch_data = provider.get_next_batch()
+            expected_data = batch_data[0].copy()
+            provider.release_batch(batch_data)
+            epoch, batch_num, next_batch_data = provider.get_next_batch()
+            self.assertEqual(batch_num, 1)
+            for array, next_array in zip(batch_data, next_batch_data):
+                self.assertIs(array, next_array)
+            # Arrays that the caller keeps must stay intact
+            epoch, batch_num, other_batch_data = provider.get_next_batch()
+            self.assert_(np.array_equal(other_batch_data[0], expected_data))
+            self.assertIsNot(other_batch_data[0], batch_data[0])
+
+
+class ConvNetTest(unittest.TestCase):
+
+    @patch.object(ccn.convnet.ConvNet, 'finish_batch', create=True)
+    @patch.object(ccn.convnet.ConvNet, 'start_batch', create=True)
+    def test_finish_batch(self, mock_start_batch, mock_finish_batch):
+        model = ConvNet.__new__(ConvNet)
+        model.train_data_provider = MagicMock()
+        model.test_data_provider = MagicMock()
+        batch_data = 1, 2, [np.zeros((4, 3)), np.zeros((1, 3))]
+        model.start_batch(batch_data, train=False)
+        self.assertFalse(model.test_data_provider.release_batch.called)
+        self.assertEqual(
+            model.finish_batch(), mock_finish_batch.return_value)
+        model.test_data_provider.release_batch.assert_called_once_with(
+            batch_data[2])
+        self.assertFalse(model.train_data_provider.release_batch.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
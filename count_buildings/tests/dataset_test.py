@@ -0,0 +1,62 @@
+import h5py
+import numpy as np
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from ..libraries.dataset import (
+    BATCH_FORMATS, BatchGroup, load_batch, save_batch)
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_load_batch(self):
+        data = np.arange(12, dtype=np.uint8).reshape(4, 3)
+        labels = [True, False, False]
+        for batch_format in BATCH_FORMATS:
+            batch_path = os.path.join(
+                self.folder, 'data_batch_' + batch_format)
+            save_batch(batch_path, data, labels, xrange(5, 8), batch_format)
+            batch = load_batch(batch_path, batch_format)
+            self.assertEqual(sorted(batch), ['data', 'ids', 'labels'])
+            self.assert_(np.array_equal(batch['data'], data))
+            self.assertEqual(list(batch['labels']), [1, 0, 0])
+            self.assertEqual(list(batch['ids']), [5, 6, 7])
+
+
+class BatchGroupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_array_mean_with_array_filter(self):
+        arrays = np.full((10, 2, 2, 1), 100, dtype=np.uint8)
+        arrays[5:] = 50
+        with h5py.File(os.path.join(self.folder, 'arrays.h5'), 'w') as h5:
+            h5['arrays'] = arrays
+
+        def keep_two(arrays):
+            is_selected = np.zeros(len(arrays), dtype=bool)
+            is_selected[[0, 6]] = True
+            return is_selected
+
+        batch_group = BatchGroup(
+            'arrays.h5', [self.folder], 4, array_filter=keep_two)
+        self.assertEqual(batch_group.array_count, 4)
+        self.assertEqual(len(batch_group.pruned_keys), 8)
+        self.assert_((batch_group.array_mean == 75).all())
+        self.assertEqual(batch_group.array_sum_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import unittest
+from mock import patch
+from pandas import read_csv
+from tempfile import mkdtemp
+
+from ..libraries.evaluation import get_evaluation
+from ..scripts.evaluate_scenes import load_scenes, run
+
+
+SCRIPT_ROUTE = 'count_buildings.scripts.evaluate_scenes'
+
+
+class EvaluateScenesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.manifest_path = os.path.join(self.folder, 'manifest.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_manifest(self, text):
+        open(self.manifest_path, 'wt').write(text)
+
+    def test_load_scenes(self):
+        self.write_manifest(
+            'scene_name,image_path,points_path,counts_path\n'
+            'a,images/a.tif,/points/a.shp,counts/a.shp\n'
+            ',~/b.tif,b.shp,\n')
+        scenes = load_scenes(self.manifest_path)
+        self.assertEqual(scenes[0], {
+            'scene_name': 'a',
+            'image_path': os.path.join(self.folder, 'images/a.tif'),
+            'points_path': '/points/a.shp',
+            'counts_path': os.path.join(self.folder, 'counts/a.shp'),
+            'probabilities_folder': None})
+        self.assertEqual(scenes[1]['scene_name'], '1')
+        self.assertEqual(
+            scenes[1]['image_path'], os.path.expanduser('~/b.tif'))
+        self.assertEqual(scenes[1]['counts_path'], None)
+        self.write_manifest('scene_name,image_path\n')
+        with self.assertRaises(ValueError):
+            load_scenes(self.manifest_path)
+
+    @patch(SCRIPT_ROUTE + '.evaluate_scene')
+    def test_run(self, mock_evaluate_scene):
+        self.write_manifest(
+            'scene_name,image_path,points_path,counts_path\n'
+            'a,a.tif,a.shp,a_counts.shp\n'
+            'b,b.tif,b.shp,b_counts.shp\n')
+
+        def evaluate_scene(image_path, *args):
+            if image_path.endswith('b.tif'):
+                return [get_evaluation(5, 4, 2, 2, 2)]
+            return [get_evaluation(5, 2, 3, 1, 1)]
+
+        mock_evaluate_scene.side_effect = evaluate_scene
+        result = run(self.folder, self.manifest_path, [5], worker_count=2)
+        self.assertEqual(result['scene_count'], 2)
+        self.assertEqual(result['failed_scene_count'], 0)
+        self.assertEqual(result['actual_count'], 6)
+        self.assertEqual(result['true_positive_count'], 3)
+        self.assertEqual(result['precision'], 0.6)
+        table = read_csv(result['evaluations_path'])
+        self.assertEqual(
+            table['scene_name'].tolist(), ['a', 'b', 'overall'])
+        self.assertEqual(table['estimated_count'].tolist(), [3, 2, 5])
+
+    @patch(SCRIPT_ROUTE + '.evaluate_scene')
+    def test_run_with_failed_scene(self, mock_evaluate_scene):
+        self.write_manifest(
+            'scene_name,image_path,points_path,counts_path\n'
+            'a,a.tif,a.shp,a_counts.shp\n'
+            'b,b.tif,b.shp,b_counts.shp\n')
+
+        def evaluate_scene(image_path, *args):
+            if image_path.endswith('b.tif'):
+                raise IOError('cannot open b.tif')
+            return [get_evaluation(5, 2, 3, 1, 1)]
+
+        mock_evaluate_scene.side_effect = evaluate_scene
+        result = run(self.folder, self.manifest_path, [5], worker_count=2)
+        self.assertEqual(result['failed_scene_count'], 1)
+        self.assertEqual(result['actual_count'], 2)
+        table = read_csv(result['evaluations_path']).fillna('')
+        self.assertEqual(table['error'].tolist(), [
+            '', 'IOError: cannot open b.tif', ''])
+        self.assertEqual(table['actual_count'].tolist(), [2, '', 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
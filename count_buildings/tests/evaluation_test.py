@@ -0,0 +1,76 @@
+import numpy as np
+import unittest
+
+from ..libraries.evaluation import evaluate_locations, sum_evaluations
+from ..libraries.kdtree import KDTree
+
+
+class EvaluateLocationsTest(unittest.TestCase):
+
+    def test_evaluate_locations_like_loop(self):
+        random_state = np.random.RandomState(0)
+        actual_xys = random_state.randint(0, 100, (200, 2))
+        estimated_xys = random_state.randint(0, 100, (150, 2))
+        radii = [1, 2.5, 5, 10]
+        rows = evaluate_locations(actual_xys, estimated_xys, radii)
+        for radius, row in zip(radii, rows):
+            self.assertEqual(row, evaluate_locations_by_loop(
+                actual_xys, estimated_xys, radius))
+
+    def test_evaluate_locations_one_to_one(self):
+        actual_xys = [(0, 0), (10, 0), (30, 0)]
+        estimated_xys = [(1, 0), (2, 0), (12, 0), (100, 0)]
+        rows = evaluate_locations(actual_xys, estimated_xys, [
+            2.5, 5], match_one_to_one=True)
+        self.assertEqual([x['true_positive_count'] for x in rows], [3, 3])
+        self.assertEqual([x['matched_count'] for x in rows], [2, 2])
+        self.assertEqual(rows[0]['matched_precision'], 0.5)
+        self.assertEqual(rows[0]['matched_recall'], 2 / 3.)
+
+    def test_evaluate_locations_without_points(self):
+        row = evaluate_locations([], [(0, 0)], 5, match_one_to_one=True)[0]
+        self.assertEqual(row['false_positive_count'], 1)
+        self.assertEqual(row['matched_count'], 0)
+        self.assertEqual(row['recall'], np.inf)
+        row = evaluate_locations([(0, 0)] * 2, [], 5)[0]
+        self.assertEqual(row['false_negative_count'], 2)
+        self.assertEqual(row['precision'], np.inf)
+
+    def test_sum_evaluations(self):
+        random_state = np.random.RandomState(0)
+        xy_packs = [random_state.randint(0, 100, (x, 2)) for x in [
+            30, 20, 40, 10]]
+        rows = sum_evaluations([
+            evaluate_locations(xy_packs[0], xy_packs[1], [3, 6], True),
+            evaluate_locations(xy_packs[2], xy_packs[3], [3, 6], True)])
+        # Scenes far apart pool like one scene
+        expected_rows = evaluate_locations(
+            np.concatenate([xy_packs[0], xy_packs[2] + 1000]),
+            np.concatenate([xy_packs[1], xy_packs[3] + 1000]), [3, 6], True)
+        self.assertEqual(rows, expected_rows)
+
+
+def evaluate_locations_by_loop(actual_xys, estimated_xys, radius):
+    true_positive_count = 0
+    false_negative_count = 0
+    actual_tree = KDTree(actual_xys)
+    for estimated_xy in estimated_xys:
+        if len(actual_tree.query_radius(estimated_xy, radius)[1]):
+            true_positive_count += 1
+    estimated_tree = KDTree(estimated_xys)
+    for actual_xy in actual_xys:
+        if not len(estimated_tree.query_radius(actual_xy, radius)[1]):
+            false_negative_count += 1
+    return dict(
+        radius=radius,
+        actual_count=len(actual_xys),
+        estimated_count=len(estimated_xys),
+        true_positive_count=true_positive_count,
+        false_positive_count=len(estimated_xys) - true_positive_count,
+        false_negative_count=false_negative_count,
+        precision=true_positive_count / float(len(estimated_xys)),
+        recall=true_positive_count / float(len(actual_xys)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import numpy as np
+import unittest
+from mock import patch
+from pandas import DataFrame
+
+from ..libraries.kdtree import KDTree
+from ..scripts.get_counts_from_probabilities import determine_pixel_radius
+from ..scripts.get_counts_from_probabilities import run
+from ..scripts.get_counts_from_probabilities import get_selected_pixel_centers
+from ..scripts.get_counts_from_probabilities import yield_hotspot_via_metric
+
+
+SCRIPT_ROUTE = 'count_buildings.scripts.get_counts_from_probabilities'
+
+
+class RunTest(unittest.TestCase):
+
+    @patch(SCRIPT_ROUTE + '.save_pixel_centers')
+    @patch(SCRIPT_ROUTE + '.save_probability_grid')
+    @patch(SCRIPT_ROUTE + '.get_probability_grid')
+    @patch(SCRIPT_ROUTE + '.SatelliteImage')
+    @patch(SCRIPT_ROUTE + '.load_probabilities')
+    def test_save_heatmap(
+            self, mock_load_probabilities, mock_satellite_image,
+            mock_get_probability_grid, mock_save_probability_grid,
+            mock_save_pixel_centers):
+        mock_load_probabilities.return_value = DataFrame({
+            '0': [0.2, 0.9], '1': [0.8, 0.1],
+            'pixel_center_x': [4, 12], 'pixel_center_y': [4, 4]})
+        arguments = '/tmp', 'probabilities', 'image.tif', None, None, None, \
+            None, None
+        run(*arguments)
+        self.assertFalse(mock_save_probability_grid.called)
+        # Save the heatmap without counting peaks
+        result = run(*arguments, save_heatmap=True)
+        self.assertEqual(result['probability_count'], 1)
+        mock_get_probability_grid.assert_called_once_with(
+            mock_load_probabilities.return_value, None)
+        self.assertEqual(mock_save_probability_grid.call_args[0][1:], (
+            mock_get_probability_grid.return_value,
+            mock_satellite_image.return_value))
+
+
+class YieldHotspotViaMetricTest(unittest.TestCase):
+
+    def test_yield_hotspot_like_loop(self):
+        random_state = np.random.RandomState(0)
+        xys = random_state.randint(0, 100, (300, 2))
+        metrics = random_state.rand(300)
+        for radius in 1, 3, 8, 20:
+            hotspot_xys = list(yield_hotspot_via_metric(xys, radius, metrics))
+            expected_hotspot_xys = list(yield_hotspot_by_loop(
+                xys, radius, lambda index: metrics[index]))
+            self.assert_(np.allclose(hotspot_xys, expected_hotspot_xys))
+
+    def test_yield_hotspot_without_points(self):
+        self.assertEqual(list(yield_hotspot_via_metric(
+            np.zeros((0, 2)), 5, [])), [])
+
+
+class DeterminePixelRadiusTest(unittest.TestCase):
+
+    def test_determine_pixel_radius_like_walk(self):
+        random_state = np.random.RandomState(0)
+        probability_packs = DataFrame(dict(zip([
+            'pixel_center_x', 'pixel_center_y'],
+            8 * random_state.randint(0, 30, (2, 400)))))
+        probability_packs['1'] = random_state.rand(400)
+        for actual_count in 1, 50, 120, 200, 500:
+            for maximum_pixel_radius in 5, 30, np.inf:
+                pixel_radiuses, pixel_centers = determine_pixel_radius(
+                    probability_packs, actual_count, 1, maximum_pixel_radius)
+                expected_pixel_radiuses, expected_pixel_centers = \
+                    determine_pixel_radius_by_walk(
+                        probability_packs, actual_count, 1,
+                        maximum_pixel_radius)
+                self.assertEqual(pixel_radiuses, expected_pixel_radiuses)
+                self.assert_(np.allclose(
+                    pixel_centers, expected_pixel_centers))
+
+
+def determine_pixel_radius_by_walk(
+        probability_packs, actual_count,
+        minimum_pixel_radius, maximum_pixel_radius):
+    best_margin = np.inf
+    best_pixel_centers = []
+    best_pixel_radiuses = []
+    pixel_radius = minimum_pixel_radius
+    while True:
+        selected_pixel_centers = get_selected_pixel_centers(
+            probability_packs, pixel_radius)
+        actual_margin = len(selected_pixel_centers) - actual_count
+        if abs(best_margin) < abs(actual_margin):
+            break
+        if best_margin != actual_margin:
+            best_pixel_radiuses = []
+        best_margin = actual_margin
+        best_pixel_centers = selected_pixel_centers
+        best_pixel_radiuses.append(pixel_radius)
+        if pixel_radius >= maximum_pixel_radius:
+            break
+        if len(selected_pixel_centers) <= 1:
+            break
+        pixel_radius += 1
+    return best_pixel_radiuses, best_pixel_centers
+
+
+def yield_hotspot_by_loop(xys, radius, get_metric):
+    pending_indices = np.arange(len(xys))
+    while len(pending_indices):
+        pending_xys = xys[pending_indices]
+        pending_tree = KDTree(pending_xys)
+        best_metric, best_hotspot_xy, best_indices = -np.inf, None, []
+        for pending_index in pending_indices:
+            metric = get_metric(pending_index)
+            if metric < best_metric:
+                continue
+            xy = xys[pending_index]
+            selected_indices = pending_tree.query_radius(xy, radius)[1]
+            selected_xys = pending_xys[selected_indices]
+            selected_metrics = [
+                get_metric(x) for x in pending_indices[selected_indices]]
+            best_metric = metric
+            best_hotspot_xy = np.average(
+                selected_xys, axis=0, weights=selected_metrics)
+            best_indices = pending_indices[selected_indices]
+        yield best_hotspot_xy
+        pending_indices = np.array(list(
+            set(pending_indices) - set(best_indices)))
+
+
+if __name__ == '__main__':
+    unittest.main()
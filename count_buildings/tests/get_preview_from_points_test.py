@@ -0,0 +1,75 @@
+import numpy as np
+import unittest
+from skimage.draw import circle, circle_perimeter
+
+from ..scripts.get_preview_from_points import get_dense_pixel_frames
+from ..scripts.get_preview_from_points import paint_spots
+from ..scripts.get_preview_from_points import select_pixel_xys
+
+
+class GetDensePixelFramesTest(unittest.TestCase):
+
+    def test_get_dense_pixel_frames_like_search(self):
+        random_state = np.random.RandomState(0)
+        image_pixel_dimensions = 97, 83
+        pixel_xys = np.concatenate([
+            random_state.randint(0, 84, (200, 2)),
+            random_state.randint(40, 60, (50, 2))])
+        for pixel_dimensions in (20, 30), (35, 10), (200, 200):
+            pixel_frame = get_dense_pixel_frames(
+                pixel_xys, pixel_dimensions, image_pixel_dimensions,
+                bin_pixel_length=1)[0]
+            self.assertEqual(
+                len(select_half_open(pixel_xys, pixel_frame)),
+                max(len(select_half_open(pixel_xys, x)) for x in yield_frames(
+                    pixel_frame[1], image_pixel_dimensions)))
+
+    def test_get_dense_pixel_frames_without_overlap(self):
+        pixel_xys = [(5, 5)] * 3 + [(12, 5)] * 2 + [(45, 45)]
+        pixel_frames = get_dense_pixel_frames(
+            pixel_xys, (10, 10), (50, 50), 2, 5)
+        self.assertEqual(pixel_frames, [
+            ((5, 0), (10, 10)), ((40, 40), (10, 10))])
+        self.assertEqual(len(select_pixel_xys(pixel_xys, pixel_frames[0])), 5)
+        # Frames that end partway into a bin must not overlap either
+        pixel_xys = [(5, 5)] * 3 + [(40, 5)] * 2
+        pixel_frames = get_dense_pixel_frames(
+            pixel_xys, (35, 10), (70, 10), 2, 10)
+        self.assertEqual(pixel_frames, [((0, 0), (35, 10))])
+
+
+class PaintSpotsTest(unittest.TestCase):
+
+    def test_paint_spots_like_loop(self):
+        array = np.random.RandomState(0).randint(
+            1, 200, (20, 30, 3)).astype(np.uint8)
+        # Overlap spots and clip them on the far edges
+        pixel_xys = [(5, 5), (8, 6), (28, 10), (15, 18), (29, 19)]
+        expected_array = np.copy(array)
+        yellow = array[:, :, 0].max(), array[:, :, 1].max(), 0
+        for pixel_x, pixel_y in pixel_xys:
+            for (rows, columns), color in [
+                (circle(pixel_y, pixel_x, 3, array.shape), yellow),
+                (circle_perimeter(
+                    pixel_y, pixel_x, 3, 'andres', array.shape), (0, 0, 0)),
+            ]:
+                expected_array[rows, columns] = color
+        self.assert_(np.array_equal(
+            paint_spots(array, pixel_xys), expected_array))
+        self.assert_(np.array_equal(paint_spots(array, []), array))
+
+
+def select_half_open(pixel_xys, ((x, y), (width, height))):
+    return select_pixel_xys(pixel_xys, ((x, y), (width - 1, height - 1)))
+
+
+def yield_frames((pixel_width, pixel_height), (image_width, image_height)):
+    pixel_width = min(pixel_width, image_width)
+    pixel_height = min(pixel_height, image_height)
+    for x in xrange(image_width - pixel_width + 1):
+        for y in xrange(image_height - pixel_height + 1):
+            yield (x, y), (pixel_width, pixel_height)
+
+
+if __name__ == '__main__':
+    unittest.main()
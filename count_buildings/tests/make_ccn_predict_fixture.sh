@@ -0,0 +1,43 @@
+# Record what ccn-predict says about a small marker so that ccn_cpu_test
+# can check CPUConvNet against cuda-convnet; run on a machine with a GPU
+FIXTURE_FOLDER=$(dirname $(pwd)/$0)/fixtures/ccn_predict
+cd $FIXTURE_FOLDER
+rm -rf batches marker probabilities.csv
+
+python - batches <<EOF
+import numpy as np
+import os
+import sys
+from count_buildings.libraries.dataset import (
+    get_vectors_from_arrays, save_batch, save_batch_meta)
+target_folder = sys.argv[1]
+os.makedirs(target_folder)
+random_state = np.random.RandomState(0)
+arrays = random_state.randint(0, 256, (2, 32, 24, 24, 4)).astype(np.uint8)
+labels = random_state.randint(0, 2, (2, 32))
+save_batch_meta(
+    target_folder, arrays.reshape((-1, 24, 24, 4)).mean(axis=0),
+    [(x, x) for x in xrange(64)], ['pixel_center_x', 'pixel_center_y'],
+    'pickle', batch_size=32)
+for batch_index in xrange(2):
+    save_batch(
+        os.path.join(target_folder, 'data_batch_%s' % batch_index),
+        get_vectors_from_arrays(arrays[batch_index]).T,
+        labels[batch_index], xrange(batch_index * 32, (
+            batch_index + 1) * 32), 'pickle')
+EOF
+
+ccn-train options.cfg \
+    --save-path marker \
+    --data-path batches \
+    --train-range 0 \
+    --test-range 1
+mv marker/ConvNet__*/* marker
+rmdir marker/ConvNet__*
+
+ccn-predict options.cfg \
+    --write-preds probabilities.csv \
+    --data-path batches \
+    --train-range 0 \
+    --test-range 1 \
+    -f marker
@@ -0,0 +1,97 @@
+import numpy as np
+import os
+import shutil
+import time
+import unittest
+from mock import patch
+from tempfile import mkdtemp
+
+from ..libraries.points import (
+    get_cache_path, load_point_index, load_projected_xys)
+
+
+LIBRARY_ROUTE = 'count_buildings.libraries.points'
+PROJ4 = '+proj=utm +zone=37 +datum=WGS84 +units=m +no_defs'
+
+
+class LoadProjectedXYsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.cache_folder = os.path.join(self.folder, 'cache')
+        self.points_path = os.path.join(self.folder, 'points.shp')
+        for extension in '.shp', '.shx', '.prj':
+            open(os.path.join(self.folder, 'points' + extension), 'wt').write(
+                extension)
+        self.xys = np.random.RandomState(0).rand(10, 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    @patch(LIBRARY_ROUTE + '.load_points')
+    def test_load_projected_xys(self, mock_load_points):
+        mock_load_points.return_value = PROJ4, self.xys.tolist()
+        xys = load_projected_xys(self.points_path, PROJ4, self.cache_folder)
+        self.assert_(np.array_equal(xys, self.xys))
+        xys = load_projected_xys(self.points_path, PROJ4, self.cache_folder)
+        self.assert_(isinstance(xys, np.memmap))
+        self.assert_(np.array_equal(xys, self.xys))
+        self.assertEqual(mock_load_points.call_count, 1)
+        # Reload after a sidecar changes or for another projection
+        prj_path = os.path.join(self.folder, 'points.prj')
+        os.utime(prj_path, (time.time(), time.time() + 10))
+        load_projected_xys(self.points_path, PROJ4, self.cache_folder)
+        self.assertEqual(mock_load_points.call_count, 2)
+        load_projected_xys(
+            self.points_path, '+proj=longlat', self.cache_folder)
+        self.assertEqual(mock_load_points.call_count, 3)
+
+    @patch(LIBRARY_ROUTE + '.load_points')
+    def test_load_point_index(self, mock_load_points):
+        mock_load_points.return_value = PROJ4, self.xys.tolist()
+        for x in xrange(2):
+            point_index = load_point_index(
+                self.points_path, PROJ4, self.cache_folder)
+            offsets, indices = point_index.query_boxes([0, 0, 0.5, 0.5])
+            xs, ys = self.xys.T
+            self.assertEqual(sorted(indices), np.flatnonzero(
+                (xs <= 0.5) & (ys <= 0.5)).tolist())
+        self.assertEqual(mock_load_points.call_count, 1)
+        self.assertEqual(len([
+            x for x in os.listdir(self.cache_folder)
+            if x.endswith('.kdtree')]), 1)
+        mock_load_points.return_value = PROJ4, []
+        os.utime(self.points_path, (time.time(), time.time() + 10))
+        point_index = load_point_index(
+            self.points_path, PROJ4, self.cache_folder)
+        self.assertEqual(point_index.point_count, 0)
+
+    @patch(LIBRARY_ROUTE + '.load_points')
+    def test_load_point_index_from_bad_tree(self, mock_load_points):
+        mock_load_points.return_value = PROJ4, self.xys.tolist()
+        load_point_index(self.points_path, PROJ4, self.cache_folder)
+        for name in os.listdir(self.cache_folder):
+            if name.endswith('.kdtree'):
+                open(os.path.join(self.cache_folder, name), 'wb').write('x')
+        point_index = load_point_index(
+            self.points_path, PROJ4, self.cache_folder)
+        self.assertEqual(len(point_index.query_boxes([0, 0, 1, 1])[1]), 10)
+
+    def test_get_cache_path(self):
+        source_time = int(time.time())
+        os.utime(self.points_path, (source_time, source_time))
+        cache_path = get_cache_path(
+            self.points_path, PROJ4, self.cache_folder)
+        # Trust sources that keep their size and modification time
+        open(self.points_path, 'wt').write('.SHP')
+        os.utime(self.points_path, (source_time, source_time))
+        self.assertEqual(get_cache_path(
+            self.points_path, PROJ4, self.cache_folder), cache_path)
+        open(self.points_path, 'wt').write('.shp.')
+        os.utime(self.points_path, (source_time, source_time))
+        self.assertNotEqual(get_cache_path(
+            self.points_path, PROJ4, self.cache_folder), cache_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import numpy as np
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from ..libraries.prefilter import Prefilter, get_features, get_threshold
+
+
+class PrefilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_fit(self):
+        random_state = np.random.RandomState(0)
+        # Let positive arrays have edges and negative arrays be flat
+        positive_arrays = random_state.randint(0, 256, (50, 8, 8, 3))
+        negative_arrays = np.tile(random_state.randint(
+            0, 256, (50, 1, 1, 3)), (1, 8, 8, 1))
+        arrays = np.concatenate([positive_arrays, negative_arrays])
+        labels = np.arange(100) < 50
+        prefilter = Prefilter.fit(get_features(arrays), labels, 0.9)
+        prefilter_path = os.path.join(self.folder, 'prefilter.pkl')
+        prefilter.save(prefilter_path)
+        prefilter = Prefilter.load(prefilter_path)
+        is_selected = prefilter.select(arrays)
+        self.assert_(is_selected[labels].mean() >= 0.9)
+        self.assert_(not is_selected[~labels].any())
+
+    def test_get_threshold(self):
+        scores = np.arange(10.)
+        self.assertEqual(get_threshold(scores, 1), 0)
+        self.assertEqual(get_threshold(scores, 0.8), 2)
+        self.assertEqual(get_threshold(scores, 0.75), 2)
+        self.assertEqual(get_threshold([], 0.8), -np.inf)
+
+
+if __name__ == '__main__':
+    unittest.main()
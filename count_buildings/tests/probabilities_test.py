@@ -0,0 +1,109 @@
+import numpy as np
+import os
+import shutil
+import unittest
+from pandas import read_csv
+from tempfile import mkdtemp
+
+from ..libraries.probabilities import (
+    PROBABILITIES_CSV, PROBABILITIES_NAME, append_probabilities,
+    export_probabilities, get_peak_pixel_centers, get_probability_grid,
+    get_probability_records, get_records_from_table,
+    load_positive_pixel_centers, load_probabilities, save_probabilities)
+
+
+class ProbabilitiesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_append_probabilities(self):
+        random_state = np.random.RandomState(0)
+        probabilities_path = os.path.join(self.folder, PROBABILITIES_NAME)
+        save_probabilities(probabilities_path, get_probability_records(
+            np.zeros((0, 2)), np.zeros((0, 2))))
+        self.assertEqual(len(load_probabilities(self.folder)), 0)
+        shards = []
+        for shard_index, row_count in enumerate([3, 0, 5, 1000]):
+            probabilities = random_state.rand(row_count, 2)
+            shards.append(get_probability_records(
+                probabilities, random_state.randint(0, 1000, (
+                    row_count, 2)), np.arange(row_count) + shard_index))
+            append_probabilities(probabilities_path, shards[-1])
+        header_length = os.path.getsize(probabilities_path) - sum(
+            x.nbytes for x in shards)
+        self.assertEqual(header_length % 64, 0)
+        records = load_probabilities(self.folder)
+        self.assert_(isinstance(records, np.memmap))
+        self.assert_(np.array_equal(records, np.concatenate(shards)))
+        with self.assertRaises(ValueError):
+            append_probabilities(probabilities_path, get_probability_records(
+                np.zeros((1, 3)), np.zeros((1, 2))))
+
+    def test_export_probabilities(self):
+        records = get_probability_records(
+            [[0.9, 0.1], [0.25, 0.75]], [[10, 20], [30, 40]])
+        export_probabilities(os.path.join(
+            self.folder, PROBABILITIES_CSV), records)
+        table = read_csv(os.path.join(self.folder, PROBABILITIES_CSV))
+        self.assertEqual(list(table.columns), [
+            '0', '1', 'pixel_center_x', 'pixel_center_y', 'tile_index'])
+        self.assert_(np.array_equal(get_records_from_table(table), records))
+        # Read probabilities.csv when there is no store
+        self.assertEqual(load_positive_pixel_centers(
+            self.folder).tolist(), [[30, 40]])
+
+    def test_get_probability_grid(self):
+        # Let tiles of 10 pixels overlap by 2 and skip some tiles
+        records = get_probability_records(
+            [[0.9, 0.1], [0.2, 0.8], [0.4, 0.6], [0.7, 0.3]],
+            [[5, 5], [21, 5], [13, 13], [21, 21]])
+        grid, pixel_origin, pixel_interval = get_probability_grid(records)
+        self.assertEqual(pixel_origin.tolist(), [5, 5])
+        self.assertEqual(pixel_interval.tolist(), [8, 8])
+        self.assert_(np.allclose(grid, [
+            [0.1, -1, 0.8],
+            [-1, 0.6, -1],
+            [-1, -1, 0.3]]))
+        grid = get_probability_grid(records[[0, 1, 3]], (8, 8))[0]
+        self.assert_(np.allclose(grid, [
+            [0.1, -1, 0.8],
+            [-1, -1, -1],
+            [-1, -1, 0.3]]))
+        grid, pixel_origin, pixel_interval = get_probability_grid(
+            records[:1])
+        self.assertEqual(grid.shape, (1, 1))
+        self.assertEqual(pixel_interval.tolist(), [1, 1])
+        # Centers from shards that do not line up give a tiny interval
+        records = get_probability_records(
+            [[0.9, 0.1]] * 4, [[5, 5], [13, 5], [806, 5], [5, 13]])
+        with self.assertRaises(ValueError):
+            get_probability_grid(records)
+        grid = get_probability_grid(records, (8, 8))[0]
+        self.assertEqual(grid.shape, (2, 101))
+
+    def test_get_peak_pixel_centers(self):
+        grid = np.array([
+            [0.9, 0.8, 0.1, 0.1, 0.7],
+            [0.8, 0.1, 0.1, 0.1, 0.7],
+            [0.1, 0.1, 0.1, 0.6, 0.1],
+            [0.4, 0.1, 0.1, 0.1, 0.1]], dtype=np.float32)
+        pixel_origin, pixel_interval = np.array([5, 5]), np.array([10, 10])
+        self.assertEqual(get_peak_pixel_centers(
+            grid, pixel_origin, pixel_interval, 11).tolist(), [
+            [5, 5], [45, 15], [35, 25]])
+        self.assertEqual(get_peak_pixel_centers(
+            grid, pixel_origin, pixel_interval, 15).tolist(), [
+            [5, 5], [45, 15]])
+        self.assertEqual(get_peak_pixel_centers(
+            grid, pixel_origin, pixel_interval, 15, 0.3).tolist(), [
+            [5, 5], [45, 15], [5, 35]])
+        self.assertEqual(len(get_peak_pixel_centers(
+            np.zeros((0, 0)), pixel_origin, pixel_interval, 25)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
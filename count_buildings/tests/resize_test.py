@@ -0,0 +1,27 @@
+import numpy as np
+import unittest
+from scipy.ndimage.interpolation import zoom
+
+from ..libraries.transformations.resize import resize_arrays
+
+
+class ResizeArraysTest(unittest.TestCase):
+
+    def test_resize_arrays_like_zoom(self):
+        arrays = np.random.randint(0, 256, (5, 40, 36, 4)).astype('uint8')
+        array_shape = 32, 32, 3
+        resized_arrays = resize_arrays(arrays, array_shape)
+        for array, resized_array in zip(arrays, resized_arrays):
+            expected_array = zoom(array[:, :, :3], (32 / 40., 32 / 36., 1))
+            margin = np.abs(resized_array.astype(int) - expected_array)
+            self.assert_(margin.max() <= 1)
+        self.assertEqual(resized_arrays.dtype, arrays.dtype)
+
+    def test_resize_arrays_with_same_shape(self):
+        arrays = np.random.rand(2, 8, 8, 3)
+        resized_arrays = resize_arrays(arrays, (8, 8, 2))
+        self.assert_((resized_arrays == arrays[:, :, :, :2]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,6 +30,13 @@ class ProjectedCalibrationTest(unittest.TestCase):
             self.calibration.to_pixel_xy(old_projected_xy))
         self.assert_((old_projected_xy - new_projected_xy < 0.0000001).all())
 
+    def test_to_projected_xys(self):
+        pixel_xys = random.randint(0, 100, (5, 2))
+        self.assert_(np.allclose(
+            self.calibration.to_projected_xys(pixel_xys),
+            [self.calibration.to_projected_xy(x) for x in pixel_xys]))
+        self.assertEqual(self.calibration.to_projected_xys([]).shape, (0, 2))
+
 
 class MetricCalibrationTest(unittest.TestCase):
 
@@ -0,0 +1,87 @@
+import numpy as np
+import unittest
+
+from ..libraries.kdtree import KDTree
+from ..libraries.spatial_index import SpatialIndex
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.xys = random_state.randint(0, 100, (300, 2))
+        self.query_xys = random_state.randint(-10, 110, (50, 2))
+        self.spatial_index = SpatialIndex(self.xys)
+
+    def test_query_boxes(self):
+        boxes = np.column_stack([self.query_xys, self.query_xys + [
+            20, 7]])
+        boxes[0] = 10, 10, 10, 10
+        boxes[1] = 0, 0, 100, 100
+        offsets, indices = self.spatial_index.query_boxes(boxes)
+        self.assertEqual(len(offsets), len(boxes) + 1)
+        for box_index, (x1, y1, x2, y2) in enumerate(boxes):
+            xs, ys = self.xys.T
+            self.assertEqual(sorted(indices[
+                offsets[box_index]:offsets[box_index + 1]]), np.flatnonzero(
+                (x1 <= xs) & (xs <= x2) & (y1 <= ys) & (ys <= y2)).tolist())
+
+    def test_query_radius(self):
+        offsets, indices, distances = self.spatial_index.query_radius(
+            self.query_xys, 5)
+        for query_index, xy in enumerate(self.query_xys):
+            neighbor_slice = slice(
+                offsets[query_index], offsets[query_index + 1])
+            expected_distances = np.sqrt(np.square(
+                self.xys - xy).sum(axis=1))
+            order = np.argsort(indices[neighbor_slice])
+            self.assertEqual(
+                indices[neighbor_slice][order].tolist(),
+                np.flatnonzero(expected_distances < 5).tolist())
+            self.assert_(np.allclose(
+                distances[neighbor_slice][order],
+                expected_distances[expected_distances < 5]))
+
+    def test_query_nearest(self):
+        offsets, indices, distances = self.spatial_index.query_nearest(
+            self.query_xys, 3, 6)
+        for query_index, xy in enumerate(self.query_xys):
+            neighbor_slice = slice(
+                offsets[query_index], offsets[query_index + 1])
+            expected_distances = np.sort(np.sqrt(np.square(
+                self.xys - xy).sum(axis=1)))[:3]
+            self.assert_(np.allclose(
+                distances[neighbor_slice],
+                expected_distances[expected_distances < 6]))
+
+    def test_query_without_points(self):
+        spatial_index = SpatialIndex(np.zeros((0, 2)))
+        offsets, indices = spatial_index.query_boxes([[0, 0, 10, 10]])
+        self.assertEqual(offsets.tolist(), [0, 0])
+        offsets, indices, distances = spatial_index.query_radius(
+            [[0, 0], [1, 1]], 5)
+        self.assertEqual(offsets.tolist(), [0, 0, 0])
+        offsets, indices, distances = spatial_index.query_nearest([[0, 0]])
+        self.assertEqual(offsets.tolist(), [0, 0])
+        self.assertEqual(len(self.spatial_index.query_radius(
+            np.zeros((0, 2)), 5)[1]), 0)
+
+
+class KDTreeTest(unittest.TestCase):
+
+    def test_query_within_radius(self):
+        xys = np.random.RandomState(0).randint(0, 100, (300, 2))
+        kdtree = KDTree(xys)
+        distances, indices = kdtree.query((50, 50), maximum_distance=10)
+        expected_distances = np.sqrt(np.square(xys - (50, 50)).sum(axis=1))
+        self.assertEqual(sorted(indices), np.flatnonzero(
+            expected_distances < 10).tolist())
+        self.assert_(np.all(np.diff(distances) >= 0))
+        self.assert_(np.allclose(distances, expected_distances[indices]))
+        distances, indices = kdtree.query(
+            (50, 50), maximum_count=3, maximum_distance=10)
+        self.assertEqual(len(indices), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,8 +10,10 @@ export OVERLAP_METRIC_DIMENSIONS=8x8
 export ARRAY_SHAPE=32,32,4
 export ACTUAL_RADIUS=8
 export RANDOM_SEED=crosscompute
-export BATCH_SIZE=5k
-export INTERVAL_LENGTH=100000
+export BATCH_SIZE=5000
+# Bound scratch disk use to this many batches at a time
+export IN_FLIGHT_BATCH_COUNT=20
+export INTERVAL_LENGTH=`expr $BATCH_SIZE \* $IN_FLIGHT_BATCH_COUNT`
 
 normalize_image \
     --target_folder $TEMPORARY_FOLDER/normalize_image \
@@ -20,10 +22,6 @@ normalize_image \
     --target_meters_per_pixel_dimensions 0.5x0.5
 export NORMALIZED_IMAGE_PATH=$TEMPORARY_FOLDER/normalize_image/image.tif
 
-if [ ! -d $TEMPORARY_FOLDER/batches-* ]; then
-    bash prepare_scan.sh
-    rm -rf $TEMPORARY_FOLDER/arrays-*
-fi
 export CLASSIFIER_PATH
 export CLASSIFIER_NAME=`basename $CLASSIFIER_PATH`
 bash scan.sh
@@ -26,7 +26,8 @@ while [ $TILE_START_INDEX -lt $TILE_COUNT ]; do
         --random_seed $RANDOM_SEED \
         --arrays_folder $TEMPORARY_FOLDER/arrays-$TILE_INDICES \
         --batch_size $BATCH_SIZE \
-        --array_shape $ARRAY_SHAPE
+        --array_shape $ARRAY_SHAPE \
+        --preserve_order
 
     let TILE_START_INDEX=TILE_END_INDEX+1
 done
@@ -15,27 +15,34 @@ while [ $TILE_START_INDEX -lt $TILE_COUNT ]; do
     let TILE_END_INDEX=TILE_START_INDEX+INTERVAL_LENGTH-1
     TILE_INDICES=$TILE_START_INDEX-$TILE_END_INDEX
 
-    MAX_BATCH_INDEX=`get_index_from_batches \
-        --batches_folder $TEMPORARY_FOLDER/batches-$TILE_INDICES`
-    log ccn-predict options.cfg \
-        --write-preds $TEMPORARY_FOLDER/probabilities-$TILE_INDICES.csv \
-        --data-path $TEMPORARY_FOLDER/batches-$TILE_INDICES \
-        --train-range 0 \
-        --test-range 0-$MAX_BATCH_INDEX \
-        -f $CLASSIFIER_PATH
+    BATCHES_FOLDER=$TEMPORARY_FOLDER/batches-$TILE_INDICES
+    log get_batches_from_image \
+        --target_folder $BATCHES_FOLDER \
+        --image_path $NORMALIZED_IMAGE_PATH \
+        --tile_indices $TILE_INDICES \
+        --tile_metric_dimensions $EXAMPLE_METRIC_DIMENSIONS \
+        --overlap_metric_dimensions $OVERLAP_METRIC_DIMENSIONS \
+        --batch_size $BATCH_SIZE \
+        --array_shape $ARRAY_SHAPE
+    if [ -e $BATCHES_FOLDER/data_batch_0 ]; then
+        MAX_BATCH_INDEX=`get_index_from_batches \
+            --batches_folder $BATCHES_FOLDER`
+        log ccn-predict options.cfg \
+            --write-preds $TEMPORARY_FOLDER/probabilities-$TILE_INDICES.csv \
+            --data-path $BATCHES_FOLDER \
+            --train-range 0 \
+            --test-range 0-$MAX_BATCH_INDEX \
+            -f $CLASSIFIER_PATH
+    fi
+    rm -rf $BATCHES_FOLDER
 
     let TILE_START_INDEX=TILE_END_INDEX+1
 done
 
-cat $TEMPORARY_FOLDER/probabilities-*.csv > \
-    $TEMPORARY_FOLDER/probabilities.csv
-sed -i '/0,1,pixel_center_x,pixel_center_y/d' \
-    $TEMPORARY_FOLDER/probabilities.csv
-sed -i '1 i 0,1,pixel_center_x,pixel_center_y' \
-    $TEMPORARY_FOLDER/probabilities.csv
 PROBABILITY_FOLDER=$TEMPORARY_FOLDER/${CLASSIFIER_NAME}-probabilities
-mkdir -p $PROBABILITY_FOLDER
-cp $TEMPORARY_FOLDER/probabilities.csv $PROBABILITY_FOLDER/probabilities.csv
+log get_probabilities_from_shards \
+    --target_folder $PROBABILITY_FOLDER \
+    --shard_paths $TEMPORARY_FOLDER/probabilities-*.csv
 # COUNTS_FOLDER=$TEMPORARY_FOLDER/${CLASSIFIER_NAME}-counts
 # log get_counts_from_probabilities \
     # --target_folder $COUNTS_FOLDER \
@@ -51,7 +58,7 @@ log get_preview_from_points \
     --target_folder $PREVIEW_FOLDER \
     --random_seed $RANDOM_SEED \
     --image_path $IMAGE_PATH \
-    --points_path $TARGET_FOLDER/counts.shp \
+    --points_path $TARGET_FOLDER/counts.gpkg \
     --tile_pixel_dimensions 500x500 \
     --random_iteration_count 25
 mv $PREVIEW_FOLDER/*.jpg $TARGET_FOLDER/preview.jpg
@@ -20,6 +20,8 @@ count_buildings =\
     count_buildings.run:start
 evaluate_counts =\
     count_buildings.scripts.evaluate_counts:start
+evaluate_scenes =\
+    count_buildings.scripts.evaluate_scenes:start
 get_tiles_from_image =\
     count_buildings.scripts.get_tiles_from_image:start
 get_examples_from_points =\
@@ -28,6 +30,8 @@ get_dataset_from_examples =\
     count_buildings.scripts.get_dataset_from_examples:start
 get_batches_from_datasets =\
     count_buildings.scripts.get_batches_from_datasets:start
+get_prefilter_from_datasets =\
+    count_buildings.scripts.get_prefilter_from_datasets:start
 get_marker_from_batches =\
     count_buildings.scripts.get_marker_from_batches:start
 get_array_shape_from_batches =\
@@ -38,6 +42,14 @@ get_arrays_from_image =\
     count_buildings.scripts.get_arrays_from_image:start
 get_batches_from_arrays =\
     count_buildings.scripts.get_batches_from_arrays:start
+get_batches_from_image =\
+    count_buildings.scripts.get_batches_from_image:start
+get_probabilities_from_arrays =\
+    count_buildings.scripts.get_probabilities_from_arrays:start
+get_probabilities_from_image =\
+    count_buildings.scripts.get_probabilities_from_image:start
+get_probabilities_from_shards =\
+    count_buildings.scripts.get_probabilities_from_shards:start
 get_counts_from_probabilities =\
     count_buildings.scripts.get_counts_from_probabilities:start
 get_preview_from_points =\